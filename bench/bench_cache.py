@@ -0,0 +1,278 @@
+'''
+bench_cache
+times flameMenuSG async cache and menu builders on synthetic projects
+served by an in-process ShotGrid stand-in (see fake_shotgun_api3).
+
+usage:
+    python bench/bench_cache.py [--rows 1000,10000,100000] [--latency 0.05] [--row-latency 0.00001]
+    python bench/bench_cache.py --compare bench/results/<old>.json bench/results/<new>.json
+
+Every scale runs in its own process. Results are saved as json named
+after current commit so runs can be compared across commits.
+'''
+
+from __future__ import print_function
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+repo_folder = os.path.dirname(bench_folder)
+
+default_rows = [1000, 10000, 100000]
+common_uids = ['current_project', 'current_tasks', 'current_versions', 'current_pbfiles', 'current_steps']
+
+def timed(function, repeat = 1, setup = None, database = None):
+
+    # runs function repeat times, setup is called before every run
+    # and is not timed. Returns stats in seconds along with number
+    # of ShotGrid calls, rows returned and time ShotGrid stand-in
+    # spent evaluating queries per run (summed over concurrent calls)
+
+    times = []
+    calls = 0
+    rows = 0
+    server_time = 0.0
+    for run in range(repeat):
+        if setup:
+            setup()
+        if database:
+            database.reset_counters()
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+        if database:
+            calls += sum(database.calls.values())
+            rows += database.rows_returned
+            server_time += database.server_time
+    times.sort()
+    stats = {
+        'runs': repeat,
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'mean': sum(times) / len(times),
+        'max': times[-1]
+    }
+    if database:
+        stats['calls'] = calls // repeat
+        stats['rows'] = rows // repeat
+        stats['server'] = server_time / repeat
+    return stats
+
+def touch_rows(database, sg, share = 0.01):
+    # changes given share of tasks and versions through the api
+    # so delta and event passes have something to pick up
+
+    touch_rows.counter = getattr(touch_rows, 'counter', 0) + 1
+    for entity_type, field in (('Task', 'sg_sort_order'), ('Version', 'sg_status_list')):
+        ids = sorted(database.entities.get(entity_type, {}).keys())
+        step = max(1, int(1 / share))
+        for entity_id in ids[touch_rows.counter % step::step]:
+            value = touch_rows.counter if field == 'sg_sort_order' else ('rev', 'apr')[touch_rows.counter % 2]
+            sg.update(entity_type, entity_id, {field: value})
+
+def run_scale(rows, latency, row_latency, repeat):
+    import headless
+    import fake_shotgun_api3
+
+    result = {'rows': rows, 'phases': {}}
+    phases = result['phases']
+
+    database = fake_shotgun_api3.ShotgunDatabase()
+    start = time.time()
+    size = fake_shotgun_api3.project_size(rows)
+    project = fake_shotgun_api3.seed_project(database, **size)
+    result['seed'] = time.time() - start
+    result['project'] = size
+    result['rows'] = database.rows_total(['Task', 'Version', 'PublishedFile'])
+
+    # batch group named after the first shot so priority lane
+    # and batch loader menus have an entity to work with
+
+    shots = database.entities.get('Shot', {})
+    batch_name = shots[min(shots.keys())].get('code')
+    batch_groups = [shots[shot_id].get('code') for shot_id in sorted(shots.keys())[:50]]
+
+    start = time.time()
+    module = headless.build(database, project_name = project.get('name'), batch_groups = batch_groups, current_batch = batch_name)
+    result['startup'] = time.time() - start
+
+    database.latency = latency
+    database.row_latency = row_latency
+    connector = module.shotgunConnector
+    sg = connector.sg
+
+    # initial load of common queries
+
+    def register():
+        connector.register_common_queries()
+        headless.wait_for_cache(connector, common_uids)
+
+    phases['cache_register_initial'] = timed(register, repeat = max(1, repeat // 2), setup = lambda: connector.unregister_common_queries(retain = False), database = database)
+
+    # refresh passes
+
+    phases['cache_softupdate_idle'] = timed(connector.cache_softupdate, repeat, database = database)
+    phases['cache_softupdate_changes'] = timed(connector.cache_softupdate, repeat, setup = lambda: touch_rows(database, sg), database = database)
+    connector.cache_eventupdate()
+    phases['cache_eventupdate_changes'] = timed(connector.cache_eventupdate, repeat, setup = lambda: touch_rows(database, sg), database = database)
+    phases['cache_reconcile'] = timed(connector.cache_reconcile, repeat, database = database)
+    phases['cache_hardupdate'] = timed(connector.cache_hardupdate, max(1, repeat // 2), database = database)
+
+    # reads. cold runs drop memoized views first
+
+    def drop_views():
+        for uid in common_uids:
+            cache_request = connector.async_cache.get(uid, {})
+            cache_request['materialized'] = None
+            cache_request['columns'] = None
+
+    def retrive_all():
+        for uid in common_uids:
+            connector.cache_retrive_result(uid)
+
+    def indexes_all():
+        for uid in common_uids:
+            connector.cache_build_indexes(connector.async_cache.get(uid, {}))
+
+    phases['cache_retrive_result_cold'] = timed(retrive_all, repeat, setup = drop_views)
+    phases['cache_retrive_result_warm'] = timed(retrive_all, repeat)
+    phases['cache_build_indexes'] = timed(indexes_all, repeat)
+
+    # menus. build_menu of every app and flame hooks calling them
+
+    for app in module.apps:
+        if 'build_menu' in type(app).__dict__:
+            phases[app.name + '.build_menu'] = timed(app.build_menu, repeat)
+            phases[app.name + '.build_menu_cold'] = timed(app.build_menu, repeat, setup = drop_views)
+
+    phases['get_main_menu_custom_ui_actions'] = timed(module.get_main_menu_custom_ui_actions, repeat)
+    phases['get_media_panel_custom_ui_actions'] = timed(module.get_media_panel_custom_ui_actions, repeat)
+    phases['get_batch_custom_ui_actions'] = timed(module.get_batch_custom_ui_actions, repeat)
+
+    result['cache_memory'] = connector.cache_memory_report()
+    return result
+
+def git_revision():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = repo_folder).decode().strip()
+        changes = subprocess.check_output(['git', 'status', '--porcelain', 'flameMenuSG.py'], cwd = repo_folder).decode().strip()
+    except Exception:
+        return 'unknown'
+    if changes:
+        revision += '-dirty'
+    return revision
+
+def run(args):
+    revision = git_revision()
+    report = {
+        'revision': revision,
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency': args.latency,
+        'row_latency': args.row_latency,
+        'repeat': args.repeat,
+        'scales': {}
+    }
+
+    for rows in args.rows:
+        print('running %s rows...' % rows)
+        handle, path = tempfile.mkstemp(suffix = '.json')
+        os.close(handle)
+        command = [
+            sys.executable, os.path.abspath(__file__), '--worker', path,
+            '--rows', str(rows),
+            '--latency', str(args.latency),
+            '--row-latency', str(args.row_latency),
+            '--repeat', str(args.repeat)
+        ]
+        with open(os.devnull, 'w') as devnull:
+            status = subprocess.call(command, stdout = None if args.verbose else devnull)
+        if status:
+            print('scale %s failed with exit code %s' % (rows, status))
+            continue
+        with open(path) as result_file:
+            report['scales'][str(rows)] = json.load(result_file)
+        os.remove(path)
+        print_scale(report['scales'][str(rows)])
+
+    output = args.output
+    if not output:
+        output = os.path.join(bench_folder, 'results', revision + '.json')
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, 'w') as output_file:
+        json.dump(report, output_file, indent = 1, sort_keys = True)
+    print('results saved to %s' % output)
+
+def print_scale(scale):
+    print('%s rows, startup %.2fs, cache %.1f Mb' % (
+        scale.get('rows'),
+        scale.get('startup', 0),
+        sum(query.get('bytes', 0) for query in scale.get('cache_memory', {}).values()) / 1048576.0))
+    print('    %-48s %10s %10s %10s %8s %9s' % ('phase', 'median ms', 'max ms', 'server ms', 'calls', 'rows'))
+    for name in sorted(scale.get('phases', {}).keys()):
+        stats = scale['phases'][name]
+        print('    %-48s %10.2f %10.2f %10s %8s %9s' % (
+            name,
+            stats['median'] * 1000,
+            stats['max'] * 1000,
+            '%.2f' % (stats['server'] * 1000) if 'server' in stats else '',
+            stats.get('calls', ''),
+            stats.get('rows', '')))
+
+def compare(base_path, new_path):
+    with open(base_path) as base_file:
+        base = json.load(base_file)
+    with open(new_path) as new_file:
+        new = json.load(new_file)
+
+    print('%s -> %s (median ms)' % (base.get('revision'), new.get('revision')))
+    for rows in sorted(set(base['scales'].keys()) | set(new['scales'].keys()), key = int):
+        base_phases = base['scales'].get(rows, {}).get('phases', {})
+        new_phases = new['scales'].get(rows, {}).get('phases', {})
+        print('%s rows' % rows)
+        for name in sorted(set(base_phases.keys()) | set(new_phases.keys())):
+            before = base_phases.get(name, {}).get('median')
+            after = new_phases.get(name, {}).get('median')
+            if before is None or after is None:
+                print('    %-48s %10s %10s' % (name, '-' if before is None else '%.2f' % (before * 1000), '-' if after is None else '%.2f' % (after * 1000)))
+                continue
+            ratio = (after / before) if before else 0
+            print('    %-48s %10.2f %10.2f %7.2fx' % (name, before * 1000, after * 1000, ratio))
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'flameMenuSG cache and menu benchmarks')
+    parser.add_argument('--rows', default = ','.join(str(rows) for rows in default_rows),
+        type = lambda value: [int(rows) for rows in value.split(',')],
+        help = 'comma separated project sizes in cached rows')
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'seconds added to every ShotGrid call')
+    parser.add_argument('--row-latency', type = float, default = 0.0, help = 'seconds added per returned row')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--output', help = 'results json, default is bench/results/<revision>.json')
+    parser.add_argument('--compare', nargs = 2, metavar = ('BASE', 'NEW'), help = 'compare two results files')
+    parser.add_argument('--verbose', action = 'store_true', help = 'show flameMenuSG output')
+    parser.add_argument('--worker', help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.worker:
+        sys.path.insert(0, bench_folder)
+        result = run_scale(args.rows[0], args.latency, args.row_latency, args.repeat)
+        with open(args.worker, 'w') as result_file:
+            json.dump(result, result_file)
+    else:
+        run(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+'''
+fake_flame
+stand-in for flame python module used by flameMenuSG benchmarks.
+Module itself acts as 'flame', call setup() to build a project
+with desktop, batch groups, reel groups, libraries and current batch.
+'''
+
+import itertools
+import tempfile
+
+class PyAttribute(object):
+    def __init__(self, value = None):
+        self.value = value
+
+    def get_value(self):
+        return self.value
+
+    def set_value(self, value):
+        self.value = value
+        return True
+
+    def __eq__(self, other):
+        if isinstance(other, PyAttribute):
+            other = other.value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __add__(self, other):
+        return self.value + other
+
+    def __str__(self):
+        return str(self.value)
+
+    def __repr__(self):
+        return 'PyAttribute(%r)' % (self.value, )
+
+
+clip_uids = itertools.count(1)
+
+class PySegment(object):
+    def __init__(self):
+        self.comment = PyAttribute('')
+
+
+class PyTrack(object):
+    def __init__(self):
+        self.segments = [PySegment()]
+
+
+class PyVersion(object):
+    def __init__(self):
+        self.tracks = [PyTrack()]
+
+
+class PyClip(object):
+    def __init__(self, name):
+        self.name = PyAttribute(name)
+        self.uid = '%016X' % next(clip_uids)
+        self.versions = [PyVersion()]
+
+
+class PyReel(object):
+    def __init__(self, name, clips = None):
+        self.name = PyAttribute(name)
+        self.clips = list(clips or [])
+
+
+class PyReelGroup(object):
+    def __init__(self, name, reels = None):
+        self.name = PyAttribute(name)
+        self.reels = list(reels or [])
+
+
+class PyLibrary(object):
+    def __init__(self, name, clips = None):
+        self.name = PyAttribute(name)
+        self.clips = list(clips or [])
+
+
+class PyNode(object):
+    def __init__(self, name, node_type, destination = None):
+        self.name = PyAttribute(name)
+        self.type = node_type
+        self.destination = PyAttribute(destination)
+
+
+class PyBatch(object):
+    def __init__(self, name):
+        self.name = PyAttribute(name)
+        self.nodes = []
+        self.reels = []
+        self.shelf_reels = []
+        self.batch_iterations = []
+        self.saved_setups = []
+
+    def save_setup(self, path):
+        self.saved_setups.append(path)
+        return True
+
+    def organize(self):
+        return True
+
+
+class PyDesktop(object):
+    def __init__(self, name, batch_groups, reel_groups = None):
+        self.name = PyAttribute(name)
+        self.batch_groups = batch_groups
+        self.reel_groups = list(reel_groups or [])
+
+
+class PyWorkspace(object):
+    def __init__(self, desktop, libraries = None):
+        self.desktop = desktop
+        self.libraries = list(libraries or [])
+
+
+class PyProject(object):
+    def __init__(self, name, shotgun_project_name, workspace):
+        self.name = name
+        self.shotgun_project_name = PyAttribute(shotgun_project_name)
+        self.current_workspace = workspace
+
+
+class Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class PyExporter(object):
+    class PresetVisibility(object):
+        Project, Shared, Autodesk, Shotgun = range(4)
+        values = {0: Project, 1: Shared, 2: Autodesk, 3: Shotgun}
+
+    class PresetType(object):
+        Image_Sequence, Audio, Movie, Sequence_Publish = range(4)
+        values = {0: Image_Sequence, 1: Audio, 2: Movie, 3: Sequence_Publish}
+
+    presets_dir = tempfile.gettempdir()
+
+    @staticmethod
+    def get_presets_dir(visibility, preset_type):
+        return PyExporter.presets_dir
+
+PresetVisibility = PyExporter.PresetVisibility
+PresetType = PyExporter.PresetType
+
+project = Namespace(current_project = None)
+users = Namespace(current_user = Namespace(name = 'bench'))
+media_panel = Namespace(selected_entries = [])
+batch = None
+shortcuts = []
+idle_events = []
+
+def setup(
+        project_name = 'bench_project',
+        shotgun_project_name = None,
+        batch_groups = None,
+        current_batch = None,
+        reel_groups = 0,
+        reels_per_group = 4,
+        clips_per_reel = 0,
+        libraries = 0,
+        clips_per_library = 0,
+        batch_reels = 2,
+        render_nodes = 1):
+
+    # builds current project with a desktop of batch groups
+    # and reel groups and workspace libraries filled with clips.
+    # Current batch is the first batch group unless given by name.
+    # Render nodes of the current batch render into batch reels,
+    # reel groups and libraries in turn
+
+    global batch
+
+    def clips(prefix, count):
+        return [PyClip('%s_clip%04d' % (prefix, index)) for index in range(1, count + 1)]
+
+    batch_group_names = list(batch_groups or ['sq001_sh0010'])
+    current_batch = current_batch or batch_group_names[0]
+    groups = [PyBatch(name) for name in batch_group_names]
+    batch = PyBatch(current_batch)
+    for group in groups:
+        if group.name.get_value() == current_batch:
+            batch = group
+            break
+
+    batch.reels = [PyReel('Batch Renders' if index == 0 else 'Reel %s' % index, clips('batch%s' % index, clips_per_reel)) for index in range(batch_reels)]
+    batch.shelf_reels = [PyReel('Batch Shelf', clips('shelf', clips_per_reel))]
+
+    desktop_reel_groups = []
+    for group_index in range(1, reel_groups + 1):
+        reels = []
+        for reel_index in range(1, reels_per_group + 1):
+            reels.append(PyReel('Reel %s' % reel_index, clips('rg%s_reel%s' % (group_index, reel_index), clips_per_reel)))
+        desktop_reel_groups.append(PyReelGroup('Reel Group %s' % group_index, reels))
+
+    workspace_libraries = [PyLibrary('Library %s' % index, clips('lib%s' % index, clips_per_library)) for index in range(1, libraries + 1)]
+
+    destinations = [('Batch Reels', 'Batch Renders')]
+    if desktop_reel_groups:
+        destinations.append(('Reel Groups', desktop_reel_groups[0].name.get_value()))
+    if workspace_libraries:
+        destinations.append(('Libraries', workspace_libraries[0].name.get_value()))
+    batch.nodes = [PyNode('render%s' % index, 'Render', destinations[index % len(destinations)]) for index in range(render_nodes)]
+
+    desktop = PyDesktop('bench_desktop', groups, desktop_reel_groups)
+    project.current_project = PyProject(
+        project_name,
+        shotgun_project_name or project_name,
+        PyWorkspace(desktop, workspace_libraries))
+    media_panel.selected_entries = []
+    del shortcuts[:]
+    del idle_events[:]
+    return project.current_project
+
+def render():
+    # adds a clip to every render node destination
+    # as if current batch has been rendered. Returns added clips
+    # as (container, clip) tuples
+
+    rendered = []
+    for node in batch.nodes:
+        if node.type != 'Render':
+            continue
+        destination_type, destination_name = node.destination.get_value()
+        containers = []
+        if destination_type == 'Batch Reels':
+            containers = [reel for reel in batch.reels + batch.shelf_reels if reel.name == destination_name]
+        elif destination_type == 'Libraries':
+            containers = [library for library in project.current_project.current_workspace.libraries if library.name == destination_name]
+        elif destination_type == 'Reel Groups':
+            for reel_group in project.current_project.current_workspace.desktop.reel_groups:
+                if reel_group.name == destination_name:
+                    containers = reel_group.reels[:1]
+        for container in containers:
+            clip = PyClip(node.name.get_value() + '_render')
+            container.clips.append(clip)
+            rendered.append((container, clip))
+    return rendered
+
+def select(entries):
+    media_panel.selected_entries = list(entries)
+
+def desktop_clips():
+    # every clip on current desktop reel groups
+    result = []
+    for reel_group in project.current_project.current_workspace.desktop.reel_groups:
+        for reel in reel_group.reels:
+            result.extend(reel.clips)
+    return result
+
+def execute_shortcut(name):
+    shortcuts.append(name)
+    return True
+
+def schedule_idle_event(function, delay = 0):
+    idle_events.append(function)
+    return True
+
+def run_idle_events():
+    # runs functions scheduled with schedule_idle_event
+    # the way flame does once it is idle
+    count = 0
+    while idle_events:
+        function = idle_events.pop(0)
+        function()
+        count += 1
+    return count
@@ -0,0 +1,560 @@
+'''
+fake_shotgun_api3
+in-process stand-in for shotgun_api3 used by flameMenuSG benchmarks.
+Covers find / find_one / create / update / delete / upload surface
+and keeps EventLogEntry records for changes made through the api.
+'''
+
+import datetime
+import random
+import threading
+import time
+import types
+
+class ShotgunError(Exception):
+    pass
+
+class Fault(ShotgunError):
+    pass
+
+# field used as a display name of entity links
+
+display_name_fields = {
+    'Project': 'name',
+    'HumanUser': 'name',
+    'Task': 'content',
+    'Attachment': 'display_name',
+    'EventLogEntry': 'description'
+}
+
+def display_name_field(entity_type):
+    return display_name_fields.get(entity_type, 'code')
+
+
+class ShotgunDatabase(object):
+    # ShotgunDatabase holds entities shared by every connection
+    # created for it, so pooled connections of the connector see the same data.
+    # latency is added to every call, row_latency is added per returned row
+
+    def __init__(self, latency = 0.0, row_latency = 0.0):
+        self.entities = {}
+        self.retired = {}
+        self.last_id = {}
+        self.latency = latency
+        self.row_latency = row_latency
+        self.lock = threading.RLock()
+        self.calls = {}
+        self.rows_returned = 0
+        self.server_time = 0.0
+        self.clock = datetime.datetime.now().replace(microsecond = 0)
+
+    def now(self):
+        # strictly increasing timestamps keep delta sync deterministic
+        with self.lock:
+            self.clock = max(self.clock + datetime.timedelta(seconds = 1), datetime.datetime.now().replace(microsecond = 0))
+            return self.clock
+
+    def add(self, entity_type, data, entity_id = None):
+        # adds entity without logging an event, used for seeding
+        with self.lock:
+            if entity_id is None:
+                entity_id = self.last_id.get(entity_type, 0) + 1
+            self.last_id[entity_type] = max(entity_id, self.last_id.get(entity_type, 0))
+            row = {}
+            for field, value in data.items():
+                row[field] = self.store_value(value)
+            row['id'] = entity_id
+            if 'created_at' not in row:
+                row['created_at'] = self.clock
+            if 'updated_at' not in row:
+                row['updated_at'] = row['created_at']
+            self.entities.setdefault(entity_type, {})[entity_id] = row
+            return row
+
+    def store_value(self, value):
+        # links are stored as type and id only,
+        # names are resolved on read like the real server does
+        if isinstance(value, dict) and 'type' in value and 'id' in value:
+            return {'type': value.get('type'), 'id': value.get('id')}
+        if isinstance(value, (list, tuple)):
+            return [self.store_value(item) for item in value]
+        return value
+
+    def count(self, method, rows = 0, server_time = 0.0):
+        # server_time is time spent evaluating the call
+        # without simulated latency
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.rows_returned += rows
+            self.server_time += server_time
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls = {}
+            self.rows_returned = 0
+            self.server_time = 0.0
+
+    def wait(self, rows = 0):
+        delay = self.latency + self.row_latency * rows
+        if delay > 0:
+            time.sleep(delay)
+
+    def rows_total(self, entity_types = None):
+        if entity_types is None:
+            entity_types = self.entities.keys()
+        return sum(len(self.entities.get(entity_type, {})) for entity_type in entity_types)
+
+    def log_event(self, entity_type, action, row, attribute_name = None):
+        event = {
+            'event_type': 'Shotgun_%s_%s' % (entity_type, action),
+            'entity': {'type': entity_type, 'id': row.get('id')},
+            'attribute_name': attribute_name,
+            'meta': {'entity_id': row.get('id'), 'entity_type': entity_type},
+            'description': '%s %s %s' % (action, entity_type, row.get('id')),
+        }
+        if row.get('project'):
+            event['project'] = row.get('project')
+        self.add('EventLogEntry', event)
+
+
+class Shotgun(object):
+    # Shotgun mimics shotgun_api3.Shotgun connection.
+    # Connections created for the same database share its data
+
+    def __init__(self, base_url = None, script_name = None, api_key = None, database = None, **kwargs):
+        self.base_url = base_url or 'https://localhost'
+        self.database = database if database is not None else ShotgunDatabase()
+        self.closed = False
+
+    # read
+
+    def find(self, entity_type, filters, fields = None, order = None, filter_operator = None, limit = 0, retired_only = False, page = 0, include_archived_projects = True, additional_filter_presets = None):
+        if isinstance(filters, dict):
+            filter_operator = filters.get('filter_operator', filter_operator)
+            filters = filters.get('filters', [])
+        filter_operator = filter_operator or 'all'
+        fields = list(fields or [])
+
+        database = self.database
+        start = time.time()
+        with database.lock:
+            source = database.retired if retired_only else database.entities
+            rows = self.candidates(source.get(entity_type, {}), filters, filter_operator)
+            if limit and not page and [rule.get('field_name') for rule in order or []] == ['id']:
+                # ordered by id with a limit: walks rows in id order and stops
+                # once limit is reached, the way an indexed database does
+                reverse = order[0].get('direction', 'asc') == 'desc'
+                if reverse or not isinstance(rows, types.GeneratorType):
+                    rows = sorted(rows, key = lambda row: row.get('id'), reverse = reverse)
+                result_rows = []
+                for row in rows:
+                    if self.match(entity_type, row, filters, filter_operator):
+                        result_rows.append(row)
+                        if len(result_rows) >= limit:
+                            break
+                rows = result_rows
+            else:
+                rows = [row for row in rows if self.match(entity_type, row, filters, filter_operator)]
+                rows = self.sort(entity_type, rows, order)
+                if limit:
+                    offset = (page - 1) * limit if page else 0
+                    rows = rows[offset:offset + limit]
+            result = [self.project_row(entity_type, row, fields) for row in rows]
+
+        database.count('find', len(result), time.time() - start)
+        database.wait(len(result))
+        return result
+
+    def find_one(self, entity_type, filters, fields = None, order = None, filter_operator = None, retired_only = False, include_archived_projects = True, additional_filter_presets = None):
+        result = self.find(entity_type, filters, fields, order = order, filter_operator = filter_operator, limit = 1, retired_only = retired_only)
+        if result:
+            return result[0]
+        return None
+
+    # write
+
+    def create(self, entity_type, data, return_fields = None):
+        database = self.database
+        with database.lock:
+            now = database.now()
+            data = dict(data)
+            data.setdefault('created_at', now)
+            data['updated_at'] = now
+            row = database.add(entity_type, data)
+            database.log_event(entity_type, 'New', row)
+            fields = [field for field in data.keys()] + list(return_fields or [])
+            result = self.project_row(entity_type, row, fields)
+        database.count('create', 1)
+        database.wait(1)
+        return result
+
+    def update(self, entity_type, entity_id, data, multi_entity_update_modes = None):
+        database = self.database
+        with database.lock:
+            row = database.entities.get(entity_type, {}).get(entity_id)
+            if row is None:
+                raise Fault('%s with id %s does not exist' % (entity_type, entity_id))
+            modes = multi_entity_update_modes or {}
+            for field, value in data.items():
+                value = database.store_value(value)
+                mode = modes.get(field, 'set')
+                if mode == 'add':
+                    value = list(row.get(field) or []) + [item for item in value if item not in (row.get(field) or [])]
+                elif mode == 'remove':
+                    value = [item for item in (row.get(field) or []) if item not in value]
+                row[field] = value
+                database.log_event(entity_type, 'Change', row, attribute_name = field)
+            row['updated_at'] = database.now()
+            result = self.project_row(entity_type, row, list(data.keys()))
+        database.count('update', 1)
+        database.wait(1)
+        return result
+
+    def delete(self, entity_type, entity_id):
+        database = self.database
+        with database.lock:
+            row = database.entities.get(entity_type, {}).pop(entity_id, None)
+            if row is None:
+                return False
+            database.retired.setdefault(entity_type, {})[entity_id] = row
+            database.log_event(entity_type, 'Retirement', row)
+        database.count('delete')
+        database.wait()
+        return True
+
+    def revive(self, entity_type, entity_id):
+        database = self.database
+        with database.lock:
+            row = database.retired.get(entity_type, {}).pop(entity_id, None)
+            if row is None:
+                return False
+            database.entities.setdefault(entity_type, {})[entity_id] = row
+            database.log_event(entity_type, 'Revival', row)
+        database.count('revive')
+        database.wait()
+        return True
+
+    def upload(self, entity_type, entity_id, path, field_name = None, display_name = None, tag_list = None):
+        import os
+
+        database = self.database
+        with database.lock:
+            attachment = database.add('Attachment', {
+                'display_name': display_name or os.path.basename(path),
+                'attachment_links': [{'type': entity_type, 'id': entity_id}],
+                'created_at': database.now()
+                })
+            if field_name:
+                row = database.entities.get(entity_type, {}).get(entity_id)
+                if row is not None:
+                    row[field_name] = {'type': 'Attachment', 'id': attachment.get('id')}
+                    row['updated_at'] = database.now()
+                    database.log_event(entity_type, 'Change', row, attribute_name = field_name)
+        database.count('upload')
+        database.wait()
+        return attachment.get('id')
+
+    def upload_thumbnail(self, entity_type, entity_id, path, **kwargs):
+        return self.upload(entity_type, entity_id, path, field_name = 'image')
+
+    def close(self):
+        self.closed = True
+
+    # query evaluation
+
+    def candidates(self, rows_by_id, filters, filter_operator):
+        # narrows down rows with top level id filters so id range
+        # shards and id keyed pages do not scan the whole entity table
+
+        if filter_operator != 'all':
+            return rows_by_id.values()
+        low = None
+        high = None
+        for query_filter in filters:
+            if not isinstance(query_filter, (list, tuple)) or query_filter[0] != 'id':
+                continue
+            relation = query_filter[1]
+            values = self.filter_values(query_filter)
+            if relation == 'is' and values:
+                row = rows_by_id.get(values[0])
+                return [row] if row is not None else []
+            if relation == 'in':
+                return [rows_by_id[entity_id] for entity_id in values if entity_id in rows_by_id]
+            if relation == 'between' and len(values) == 2:
+                low = values[0] if low is None else max(low, values[0])
+                high = values[1] if high is None else min(high, values[1])
+            elif relation == 'greater_than' and values:
+                low = values[0] + 1 if low is None else max(low, values[0] + 1)
+            elif relation == 'less_than' and values:
+                high = values[0] - 1 if high is None else min(high, values[0] - 1)
+        if low is None and high is None:
+            return rows_by_id.values()
+        if low is None:
+            low = min(rows_by_id.keys()) if rows_by_id else 0
+        if high is None:
+            high = max(rows_by_id.keys()) if rows_by_id else 0
+        if (high - low) < len(rows_by_id):
+            # generator walks ids in ascending order
+            return (rows_by_id[entity_id] for entity_id in range(low, high + 1) if entity_id in rows_by_id)
+        return [row for entity_id, row in rows_by_id.items() if low <= entity_id <= high]
+
+    def filter_values(self, query_filter):
+        values = list(query_filter[2:])
+        if len(values) == 1 and isinstance(values[0], (list, tuple)) and query_filter[1] in ('in', 'not_in', 'between', 'not_between'):
+            values = list(values[0])
+        return values
+
+    def match(self, entity_type, row, filters, filter_operator = 'all'):
+        results = (self.match_filter(entity_type, row, query_filter) for query_filter in filters)
+        if filter_operator in ('any', 'or'):
+            return any(results)
+        return all(results)
+
+    def match_filter(self, entity_type, row, query_filter):
+        if isinstance(query_filter, dict):
+            return self.match(entity_type, row, query_filter.get('filters', []), query_filter.get('filter_operator', 'all'))
+
+        field, relation = query_filter[0], query_filter[1]
+        values = self.filter_values(query_filter)
+        value = self.resolve(entity_type, row, field)
+        expected = values[0] if values else None
+
+        if relation == 'is':
+            return self.equals(value, expected)
+        elif relation == 'is_not':
+            return not self.equals(value, expected)
+        elif relation == 'in':
+            return any(self.equals(value, item) for item in values)
+        elif relation == 'not_in':
+            return not any(self.equals(value, item) for item in values)
+        elif relation in ('greater_than', 'less_than', 'between', 'not_between'):
+            if value is None:
+                return relation == 'not_between'
+            if relation == 'greater_than':
+                return value > expected
+            elif relation == 'less_than':
+                return value < expected
+            inside = values[0] <= value <= values[1]
+            return inside if relation == 'between' else not inside
+        elif relation in ('contains', 'not_contains', 'starts_with', 'ends_with'):
+            if isinstance(value, list):
+                found = any(self.equals(item, expected) for item in value)
+            elif value is None:
+                found = False
+            elif relation == 'starts_with':
+                return str(value).startswith(expected)
+            elif relation == 'ends_with':
+                return str(value).endswith(expected)
+            else:
+                found = str(expected) in str(value)
+            return found if relation != 'not_contains' else not found
+        elif relation == 'type_is':
+            return isinstance(value, dict) and value.get('type') == expected
+        elif relation in ('in_last', 'not_in_last'):
+            units = {'MINUTE': 60, 'HOUR': 3600, 'DAY': 86400, 'WEEK': 604800, 'MONTH': 2592000, 'YEAR': 31536000}
+            horizon = datetime.datetime.now() - datetime.timedelta(seconds = values[0] * units.get(values[1], 86400))
+            inside = value is not None and value >= horizon
+            return inside if relation == 'in_last' else not inside
+        raise Fault('unsupported filter relation: %s' % relation)
+
+    def equals(self, value, expected):
+        if isinstance(value, list):
+            return any(self.equals(item, expected) for item in value)
+        if isinstance(expected, dict):
+            return isinstance(value, dict) and value.get('type') == expected.get('type') and value.get('id') == expected.get('id')
+        if isinstance(value, dict):
+            return value.get('id') == expected
+        return value == expected
+
+    def resolve(self, entity_type, row, field):
+        # resolves deep fields such as 'entity.Shot.sg_sequence'
+
+        path = field.split('.')
+        value = self.field_value(entity_type, row, path[0])
+        for index in range(1, len(path) - 1, 2):
+            linked_type, attribute = path[index], path[index + 1]
+            if not (isinstance(value, dict) and value.get('type') == linked_type):
+                return None
+            linked_row = self.database.entities.get(linked_type, {}).get(value.get('id'))
+            if linked_row is None:
+                return None
+            value = self.field_value(linked_type, linked_row, attribute)
+        return value
+
+    def field_value(self, entity_type, row, field):
+        if field == 'type':
+            return entity_type
+        value = row.get(field)
+        if isinstance(value, dict) and 'type' in value and 'id' in value:
+            return self.link(value)
+        if isinstance(value, list):
+            return [self.link(item) if isinstance(item, dict) else item for item in value]
+        return value
+
+    def link(self, value):
+        linked_type = value.get('type')
+        linked_row = self.database.entities.get(linked_type, {}).get(value.get('id'), {})
+        return {'type': linked_type, 'id': value.get('id'), 'name': linked_row.get(display_name_field(linked_type))}
+
+    def sort(self, entity_type, rows, order):
+        rows = sorted(rows, key = lambda row: row.get('id'))
+        for rule in reversed(order or []):
+            field = rule.get('field_name')
+            reverse = rule.get('direction', 'asc') == 'desc'
+
+            def sort_key(row, field = field):
+                value = self.resolve(entity_type, row, field)
+                if isinstance(value, dict):
+                    value = value.get('name')
+                return (value is not None, value)
+
+            rows = sorted(rows, key = sort_key, reverse = reverse)
+        return rows
+
+    def project_row(self, entity_type, row, fields):
+        result = {'type': entity_type, 'id': row.get('id')}
+        for field in fields:
+            if field in ('type', 'id'):
+                continue
+            result[field] = self.resolve(entity_type, row, field)
+        return result
+
+
+# synthetic project
+
+default_shot_steps = ['Comp', 'Roto', 'Paint', 'Light']
+default_asset_steps = ['Model', 'Texture']
+
+def seed_project(
+        database,
+        project_name = 'bench_project',
+        sequences = 4,
+        shots_per_sequence = 10,
+        assets = 4,
+        shot_steps = None,
+        asset_steps = None,
+        versions_per_task = 2,
+        published_files_per_version = 2,
+        users = 8,
+        seed = 1):
+
+    # fills database with a project of sequences, shots and assets,
+    # a task per step for every shot and asset, versions for every task
+    # and published files for every version.
+    # HumanUser with login 'user1' is assigned to a share of tasks.
+    # Returns project entity
+
+    rnd = random.Random(seed)
+    shot_steps = default_shot_steps if shot_steps is None else shot_steps
+    asset_steps = default_asset_steps if asset_steps is None else asset_steps
+    start = database.clock - datetime.timedelta(days = 30)
+
+    def timestamp():
+        return start + datetime.timedelta(seconds = rnd.randint(0, 30 * 24 * 3600))
+
+    project = database.add('Project', {'name': project_name, 'tank_name': project_name, 'sg_status': 'Active'})
+    project_link = {'type': 'Project', 'id': project.get('id')}
+
+    human_users = []
+    for index in range(1, users + 1):
+        human_users.append(database.add('HumanUser', {'login': 'user%s' % index, 'name': 'User %s' % index}))
+
+    steps = {}
+    for index, code in enumerate(shot_steps):
+        steps[code] = database.add('Step', {'code': code, 'short_name': code.lower(), 'entity_type': 'Shot', 'list_order': index})
+    for index, code in enumerate(asset_steps):
+        steps[code] = database.add('Step', {'code': code, 'short_name': code.lower(), 'entity_type': 'Asset', 'list_order': index})
+
+    storage = database.add('LocalStorage', {'code': 'primary', 'linux_path': '/var/tmp/bench', 'mac_path': '/var/tmp/bench', 'windows_path': 'C:\\bench'})
+    storage_link = {'type': 'LocalStorage', 'id': storage.get('id')}
+
+    database.add('TaskTemplate', {'code': 'Shot Template', 'entity_type': 'Shot'})
+    database.add('TaskTemplate', {'code': 'Asset Template', 'entity_type': 'Asset'})
+
+    published_file_types = {}
+    for code in ('Flame Render', 'Flame Batch File', 'Image Sequence'):
+        published_file_types[code] = database.add('PublishedFileType', {'code': code})
+    render_types = ['Flame Render', 'Flame Batch File', 'Image Sequence']
+
+    entities = []
+    for sequence_index in range(1, sequences + 1):
+        sequence = database.add('Sequence', {'code': 'sq%03d' % sequence_index, 'project': project_link})
+        for shot_index in range(1, shots_per_sequence + 1):
+            code = 'sq%03d_sh%04d' % (sequence_index, shot_index * 10)
+            shot = database.add('Shot', {
+                'code': code,
+                'project': project_link,
+                'sg_sequence': {'type': 'Sequence', 'id': sequence.get('id')},
+                'updated_at': timestamp()})
+            entities.append(('Shot', shot, shot_steps))
+    for asset_index in range(1, assets + 1):
+        asset = database.add('Asset', {
+            'code': 'asset%04d' % asset_index,
+            'sg_asset_type': rnd.choice(['Character', 'Prop', 'Environment']),
+            'project': project_link,
+            'updated_at': timestamp()})
+        entities.append(('Asset', asset, asset_steps))
+
+    for entity_type, entity, entity_steps in entities:
+        entity_link = {'type': entity_type, 'id': entity.get('id')}
+        for sort_order, step_code in enumerate(entity_steps):
+            step = steps.get(step_code)
+            assignees = rnd.sample(human_users, rnd.randint(0, min(2, len(human_users))))
+            task = database.add('Task', {
+                'content': step_code.lower(),
+                'step': {'type': 'Step', 'id': step.get('id')},
+                'sg_sort_order': sort_order,
+                'task_assignees': [{'type': 'HumanUser', 'id': user.get('id')} for user in assignees],
+                'project': project_link,
+                'entity': entity_link,
+                'updated_at': timestamp()})
+            task_link = {'type': 'Task', 'id': task.get('id')}
+
+            for version_number in range(1, versions_per_task + 1):
+                name = '%s_%s' % (entity.get('code'), step_code.lower())
+                created_at = timestamp()
+                version = database.add('Version', {
+                    'code': '%s_v%03d' % (name, version_number),
+                    'sg_task': task_link,
+                    'entity': entity_link,
+                    'project': project_link,
+                    'sg_status_list': rnd.choice(['rev', 'apr', 'ip']),
+                    'created_at': created_at})
+                version_link = {'type': 'Version', 'id': version.get('id')}
+
+                published_files = []
+                for index in range(published_files_per_version):
+                    file_type = render_types[index % len(render_types)]
+                    published_file = database.add('PublishedFile', {
+                        'code': '%s_v%03d' % (name, version_number),
+                        'name': name,
+                        'version_number': version_number,
+                        'published_file_type': {'type': 'PublishedFileType', 'id': published_file_types[file_type].get('id')},
+                        'path_cache': '%s/%s/%s/publish/%s_v%03d' % (project_name, entity.get('code'), step_code, name, version_number),
+                        'path_cache_storage': storage_link,
+                        'task': task_link,
+                        'entity': entity_link,
+                        'version': version_link,
+                        'project': project_link,
+                        'created_at': created_at})
+                    published_files.append({'type': 'PublishedFile', 'id': published_file.get('id')})
+                version['published_files'] = published_files
+
+    return {'type': 'Project', 'id': project.get('id'), 'name': project_name}
+
+def project_size(rows, versions_per_task = 2, published_files_per_version = 2):
+    # seed_project arguments for a project with about given number of
+    # tasks, versions and published files combined.
+    # One asset per ten shots, forty shots per sequence
+
+    rows_per_shot = len(default_shot_steps) * (1 + versions_per_task * (1 + published_files_per_version))
+    rows_per_asset = len(default_asset_steps) * (1 + versions_per_task * (1 + published_files_per_version))
+    shots = max(1, int(round(rows / (rows_per_shot + rows_per_asset / 10.0))))
+    sequences = max(1, (shots + 39) // 40)
+    return {
+        'sequences': sequences,
+        'shots_per_sequence': max(1, shots // sequences),
+        'assets': max(1, shots // 10),
+        'versions_per_task': versions_per_task,
+        'published_files_per_version': published_files_per_version
+    }
@@ -0,0 +1,207 @@
+'''
+headless
+runs flameMenuSG outside of flame: installs stand-ins for flame, sgtk
+and shotgun_api3 modules (and Qt if PySide2 is not avaliable), then builds
+framework, connector and apps against an in-process ShotGrid database.
+'''
+
+import os
+import sys
+import tempfile
+import time
+import types
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_folder))
+sys.path.insert(0, bench_folder)
+
+import fake_flame
+import fake_shotgun_api3
+
+
+class QtStandInType(type):
+    # class level attributes, i.e. QtCore.Qt.AlignCenter
+    def __getattr__(cls, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return QtStandIn()
+
+
+QtStandInBase = QtStandInType('QtStandInBase', (object, ), {})
+
+class QtStandIn(QtStandInBase):
+    # accepts any call, attribute and flag arithmetic
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return QtStandIn()
+
+    def __call__(self, *args, **kwargs):
+        return QtStandIn()
+
+    def __int__(self):
+        return 0
+
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+    def __or__(self, other):
+        return self
+    __ror__ = __and__ = __rand__ = __add__ = __radd__ = __sub__ = __rsub__ = __or__
+    __mul__ = __rmul__ = __floordiv__ = __rfloordiv__ = __truediv__ = __div__ = __or__
+
+
+class QtStandInModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        stand_in = QtStandInType(name, (QtStandIn, ), {})
+        setattr(self, name, stand_in)
+        return stand_in
+
+
+class ShotgunUser(object):
+    # authenticated user as returned by sgtk ShotgunAuthenticator
+    def __init__(self, database, login):
+        self.database = database
+        self.login = login
+
+    def create_sg_connection(self):
+        return fake_shotgun_api3.Shotgun(database = self.database)
+
+    def are_credentials_expired(self):
+        return False
+
+
+class ShotgunAuthenticator(object):
+    def __init__(self, user):
+        self.user = user
+
+    def get_user(self):
+        return self.user
+
+    def clear_default_user(self):
+        pass
+
+
+def qt_stand_in():
+    modules = {}
+    for name in ('QtCore', 'QtGui', 'QtWidgets'):
+        modules[name] = QtStandInModule(name)
+    return modules
+
+def install(database, login = 'user1', qt = None):
+    # puts stand-in modules into sys.modules.
+    # Real PySide2 is used if avaliable unless qt is False
+
+    sys.modules['flame'] = fake_flame
+    sys.modules['shotgun_api3'] = fake_shotgun_api3
+
+    if qt is None:
+        try:
+            from PySide2 import QtWidgets
+            qt = True
+            if not QtWidgets.QApplication.instance():
+                install.application = QtWidgets.QApplication([])
+        except ImportError:
+            qt = False
+    if not qt:
+        pyside = types.ModuleType('PySide2')
+        for name, module in qt_stand_in().items():
+            setattr(pyside, name, module)
+            sys.modules['PySide2.' + name] = module
+        sys.modules['PySide2'] = pyside
+
+    # sgtk: authentication hands out users of the database,
+    # current engine is set so toolkit is never bootstrapped
+
+    user = ShotgunUser(database, login)
+    sgtk = types.ModuleType('sgtk')
+    sgtk.authentication = types.ModuleType('sgtk.authentication')
+    sgtk.authentication.DefaultsManager = lambda *args, **kwargs: None
+    sgtk.authentication.ShotgunAuthenticator = lambda *args, **kwargs: ShotgunAuthenticator(user)
+    sgtk.platform = types.ModuleType('sgtk.platform')
+    engine = object()
+    sgtk.platform.current_engine = lambda: engine
+    sgtk.platform.qt = types.ModuleType('sgtk.platform.qt')
+    for name, module in qt_stand_in().items():
+        setattr(sgtk.platform.qt, name, module)
+        sys.modules['sgtk.platform.qt.' + name] = module
+    for name in ('sgtk', 'sgtk.authentication', 'sgtk.platform', 'sgtk.platform.qt'):
+        module = sgtk
+        for attribute in name.split('.')[1:]:
+            module = getattr(module, attribute)
+        sys.modules[name] = module
+    return user
+
+def flame_menu_sg():
+    # imports flameMenuSG with exception hook restored
+    import flameMenuSG
+    sys.excepthook = sys.__excepthook__
+    return flameMenuSG
+
+def temporary_home():
+    # prefs and cache snapshots go to a temporary home folder
+    home = tempfile.mkdtemp(prefix = 'flameMenuSG_bench_')
+    os.environ['HOME'] = home
+    return home
+
+def build(database, project_name = 'bench_project', login = 'user1', wait = True, timeout = 600, **desktop):
+
+    # returns flameMenuSG module once it has been initialized the same way
+    # flame does it: module.app_framework, module.shotgunConnector
+    # and module.apps are set. Background scheduler loop is stopped so
+    # benchmarks drive refresh passes explicitly.
+    # if wait is set returns once common queries have been fetched.
+    # desktop arguments are passed to fake_flame.setup()
+
+    temporary_home()
+
+    # module is imported before flame stand-in is installed
+    # so it does not initialize itself on import
+
+    module = flame_menu_sg()
+    module.DEBUG = False
+    install(database, login = login)
+    fake_flame.setup(project_name, **desktop)
+
+    # batch setups are saved to temporary home as well
+
+    framework = module.flameAppFramework()
+    framework.prefs['flameBatchBlessing'] = {
+        'flame_batch_root': os.path.join(os.environ['HOME'], 'flame_batch_setups'),
+        'enabled': True,
+        'use_project': True
+    }
+    framework.save_prefs()
+
+    module.app_initialized(project_name)
+    sys.excepthook = sys.__excepthook__
+    stop_scheduler(module.shotgunConnector)
+    if wait:
+        wait_for_cache(module.shotgunConnector, timeout = timeout)
+    return module
+
+def stop_scheduler(connector):
+    connector.threads = False
+    for loop in connector.loops:
+        loop.join()
+    connector.loops = []
+    connector.threads = True
+
+def wait_for_cache(connector, uids = None, timeout = 600):
+    # waits for initial fetch of registered queries to complete
+    start = time.time()
+    while time.time() - start < timeout:
+        if uids is None:
+            pending = [uid for uid, request in connector.async_cache.items() if not request.get('watermark')]
+        else:
+            pending = [uid for uid in uids if not connector.async_cache.get(uid, {}).get('watermark')]
+        if not pending:
+            return True
+        time.sleep(0.005)
+    raise RuntimeError('initial fetch has not completed in %s sec' % timeout)
@@ -0,0 +1,241 @@
+'''
+hook_latency
+drives flameMenuSG flame hooks against a flame stand-in (see fake_flame)
+at realistic desktop sizes and checks per-hook latency budgets.
+
+usage:
+    python bench/hook_latency.py [--desktop small,medium,large] [--runs 200] [--rows 10000]
+    python bench/hook_latency.py --budget get_batch_custom_ui_actions=80
+
+Reports p50 / p95 / p99 of every hook and exits with code 1 if p95
+of any hook is over its budget, so it can gate changes before they reach artists.
+'''
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+import time
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+
+# p95 budgets in milliseconds. Menu hooks are called synchronously
+# on every right click, render hooks on every batch render
+
+default_budgets = {
+    'get_main_menu_custom_ui_actions': 20,
+    'get_media_panel_custom_ui_actions[desktop]': 100,
+    'get_media_panel_custom_ui_actions[clips]': 100,
+    'get_batch_custom_ui_actions': 100,
+    'batch_render_begin': 50,
+    'batch_render_end': 100
+}
+
+# desktop sizes: batch groups on the desktop, reel groups with
+# four reels each, clips per reel, libraries and clips per library
+
+desktops = {
+    'small': {'batch_groups': 10, 'reel_groups': 2, 'clips_per_reel': 10, 'libraries': 1, 'clips_per_library': 20, 'render_nodes': 2},
+    'medium': {'batch_groups': 100, 'reel_groups': 6, 'clips_per_reel': 40, 'libraries': 4, 'clips_per_library': 100, 'render_nodes': 4},
+    'large': {'batch_groups': 400, 'reel_groups': 12, 'clips_per_reel': 100, 'libraries': 8, 'clips_per_library': 400, 'render_nodes': 8}
+}
+
+def percentile(times, fraction):
+    # nearest rank percentile of sorted times
+    if not times:
+        return 0.0
+    index = min(len(times) - 1, max(0, int(round(fraction * len(times) + 0.5)) - 1))
+    return times[index]
+
+def measure(function, runs, before = None, after = None):
+    # times function runs times, before and after are called
+    # around every run and are not timed
+    times = []
+    for run in range(runs):
+        if before:
+            before()
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+        if after:
+            after()
+    times.sort()
+    return {
+        'runs': runs,
+        'p50': percentile(times, 0.50),
+        'p95': percentile(times, 0.95),
+        'p99': percentile(times, 0.99),
+        'max': times[-1]
+    }
+
+def run_desktop(name, rows, runs):
+    import headless
+    import fake_flame
+    import fake_shotgun_api3
+
+    size = desktops[name]
+    database = fake_shotgun_api3.ShotgunDatabase()
+    project = fake_shotgun_api3.seed_project(database, **fake_shotgun_api3.project_size(rows))
+
+    # batch groups are named after shots so batch loader
+    # and publisher find entities for them
+
+    shots = database.entities.get('Shot', {})
+    shot_names = [shots[shot_id].get('code') for shot_id in sorted(shots.keys())]
+    batch_groups = [shot_names[index] if index < len(shot_names) else 'batch%04d' % index for index in range(size['batch_groups'])]
+
+    module = headless.build(
+        database,
+        project_name = project.get('name'),
+        batch_groups = batch_groups,
+        current_batch = batch_groups[0],
+        reel_groups = size['reel_groups'],
+        clips_per_reel = size['clips_per_reel'],
+        libraries = size['libraries'],
+        clips_per_library = size['clips_per_library'],
+        render_nodes = size['render_nodes'])
+
+    results = {}
+
+    # idle events scheduled by menu hooks (rescan) run
+    # between right clicks the way flame runs them when idle
+
+    results['get_main_menu_custom_ui_actions'] = measure(
+        module.get_main_menu_custom_ui_actions, runs,
+        after = fake_flame.run_idle_events)
+
+    fake_flame.select([fake_flame.project.current_project.current_workspace.desktop])
+    results['get_media_panel_custom_ui_actions[desktop]'] = measure(
+        module.get_media_panel_custom_ui_actions, runs,
+        after = fake_flame.run_idle_events)
+
+    fake_flame.select(fake_flame.desktop_clips()[:4])
+    results['get_media_panel_custom_ui_actions[clips]'] = measure(
+        module.get_media_panel_custom_ui_actions, runs,
+        after = fake_flame.run_idle_events)
+    fake_flame.select([])
+
+    results['get_batch_custom_ui_actions'] = measure(
+        module.get_batch_custom_ui_actions, runs,
+        after = fake_flame.run_idle_events)
+
+    # render hooks: begin collects destination clip uids,
+    # render adds a clip to every destination, end saves setup
+    # and blesses new clips. Rendered clips are removed afterwards
+    # so desktop size stays the same
+
+    render = {'user_data': {}, 'rendered': []}
+
+    def render_begin():
+        module.batch_render_begin({}, render['user_data'])
+
+    def start_render():
+        render['user_data'] = {}
+
+    def render_end():
+        module.batch_render_end({'aborted': False}, render['user_data'])
+
+    def render_clips():
+        render['user_data'] = {}
+        module.batch_render_begin({}, render['user_data'])
+        render['rendered'] = fake_flame.render()
+
+    def remove_clips():
+        for container, clip in render['rendered']:
+            container.clips.remove(clip)
+        render['rendered'] = []
+
+    results['batch_render_begin'] = measure(render_begin, runs, before = start_render)
+    results['batch_render_end'] = measure(render_end, runs, before = render_clips, after = remove_clips)
+
+    return results
+
+def budgets_from_args(overrides):
+    budgets = dict(default_budgets)
+    for override in overrides or []:
+        hook, value = override.split('=')
+        budgets[hook] = float(value)
+    return budgets
+
+def main():
+    import argparse
+    import subprocess
+    import tempfile
+
+    parser = argparse.ArgumentParser(description = 'flameMenuSG flame hook latency')
+    parser.add_argument('--desktop', default = 'small,medium,large',
+        type = lambda value: value.split(','),
+        help = 'comma separated desktop sizes: %s' % ', '.join(sorted(desktops.keys())))
+    parser.add_argument('--rows', type = int, default = 10000, help = 'cached rows in synthetic project')
+    parser.add_argument('--runs', type = int, default = 200)
+    parser.add_argument('--budget', action = 'append', metavar = 'HOOK=MS', help = 'override p95 budget of a hook')
+    parser.add_argument('--output', help = 'save results json')
+    parser.add_argument('--verbose', action = 'store_true', help = 'show flameMenuSG output')
+    parser.add_argument('--worker', help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        sys.path.insert(0, bench_folder)
+        results = run_desktop(args.desktop[0], args.rows, args.runs)
+        with open(args.worker, 'w') as results_file:
+            json.dump(results, results_file)
+        return 0
+
+    budgets = budgets_from_args(args.budget)
+    report = {'rows': args.rows, 'runs': args.runs, 'budgets': budgets, 'desktops': {}}
+    failed = []
+
+    # every desktop size runs in its own process
+
+    for name in args.desktop:
+        handle, path = tempfile.mkstemp(suffix = '.json')
+        os.close(handle)
+        command = [
+            sys.executable, os.path.abspath(__file__), '--worker', path,
+            '--desktop', name,
+            '--rows', str(args.rows),
+            '--runs', str(args.runs)
+        ]
+        with open(os.devnull, 'w') as devnull:
+            status = subprocess.call(command, stdout = None if args.verbose else devnull)
+        if status:
+            print('%s desktop failed with exit code %s' % (name, status))
+            failed.append((name, 'error', 0, 0))
+            continue
+        with open(path) as results_file:
+            results = json.load(results_file)
+        os.remove(path)
+        report['desktops'][name] = results
+
+        print('%s desktop %s' % (name, desktops[name]))
+        print('    %-44s %9s %9s %9s %9s %9s' % ('hook', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'budget'))
+        for hook in sorted(results.keys()):
+            stats = results[hook]
+            budget = budgets.get(hook)
+            over = budget is not None and stats['p95'] * 1000 > budget
+            if over:
+                failed.append((name, hook, stats['p95'] * 1000, budget))
+            print('    %-44s %9.2f %9.2f %9.2f %9.2f %9s%s' % (
+                hook,
+                stats['p50'] * 1000,
+                stats['p95'] * 1000,
+                stats['p99'] * 1000,
+                stats['max'] * 1000,
+                budget if budget is not None else '-',
+                ' OVER' if over else ''))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent = 1, sort_keys = True)
+
+    if failed:
+        print('latency budget exceeded:')
+        for name, hook, value, budget in failed:
+            print('    %s %s: p95 %.2f ms, budget %s ms' % (name, hook, value, budget))
+        return 1
+    print('all hooks are within budget')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
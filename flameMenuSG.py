@@ -12,6 +12,11 @@ import threading
 import atexit
 import inspect
 import re
+from contextlib import contextmanager
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
 from pprint import pprint
 from pprint import pformat
 
@@ -289,7 +294,7 @@ class flameAppFramework(object):
         #       'type': 'BatchGroup',
         #       'name': 'Name of the batch group',
         #       'shot_name': ''                         # shotgun uses shot name field in clips
-        #       'name_hash': hash(pformat({'type': 'Clip', 'name': clip_name, 'shot_name': shot_name}))
+        #       'name_hash': hash(('Clip', clip_name, shot_name))
         #       'master': uid                       # use to identify master flame object in terms of integration logic, i.e batch group for clip on its reels
         # }
         # }
@@ -351,7 +356,7 @@ class flameAppFramework(object):
                     wks_state[clip_uid]['name'] = clip_name
                     wks_state[clip_uid]['shot_name'] = shot_name
                     wks_state[clip_uid]['master'] = master_uid
-                wks_state[clip_uid]['name_hash'] = hash(pformat({'type': 'Clip', 'name': clip_name, 'shot_name': shot_name}))
+                wks_state[clip_uid]['name_hash'] = hash(('Clip', clip_name, shot_name))
 
         def map_sequences(sequences = [], master_uid = ''):
 
@@ -383,7 +388,7 @@ class flameAppFramework(object):
                     wks_state[seq_uid]['name'] = seq_name
                     wks_state[seq_uid]['shot_name'] = ''
                     wks_state[seq_uid]['master'] = master_uid
-                wks_state[seq_uid]['name_hash'] = hash(pformat({'type': 'Clip', 'name': seq_name, 'shot_name': ''}))
+                wks_state[seq_uid]['name_hash'] = hash(('Clip', seq_name, ''))
 
                 # I don't know how to use sequence segments at the moment
                 # but worth to have a bit of this code in order to check scan speed
@@ -446,7 +451,7 @@ class flameAppFramework(object):
                     wks_state[batch_uid] = {'type': 'BatchGroup', 'name': batch_name, 'shot_name': '', 'master': ''}
                 else:
                     wks_state[batch_uid]['name'] = batch_name
-                wks_state[batch_uid]['name_hash'] = hash(pformat({'type': 'BatchGroup', 'name': batch_name, 'shot_name': ''}))
+                wks_state[batch_uid]['name_hash'] = hash(('BatchGroup', batch_name, ''))
                 
                 # we don't have to distinquish between batch reels and shelf reels at the moment
 
@@ -703,11 +708,1194 @@ class flameMenuApp(object):
         return preset_fields
 
 
-class flameShotgunConnector(object):
+class flameShotgunConnectionPool(object):
+    # flameShotgunConnectionPool keeps a bounded set of shotgun
+    # connections for background threads so we do not pay for
+    # TLS and auth handshakes every time a loop or a query thread starts.
+    # Connections are checked out per thread: nested checkouts in the
+    # same thread get the same connection. Pool is reset when user changes.
+
+    def __init__(self, connector, max_size = 4):
+        self.connector = connector
+        self.max_size = max(1, max_size)
+        self.idle = []
+        self.created = 0
+        self.generation = 0
+        self.condition = threading.Condition()
+        self.local = threading.local()
+
+    @contextmanager
+    def connection(self, sg = None):
+        # given connection is used as is
+        if sg:
+            yield sg
+            return
+
+        held = getattr(self.local, 'sg', None)
+        if held:
+            yield held
+            return
+
+        sg, generation = self.checkout()
+        self.local.sg = sg
+        discard = False
+        try:
+            yield sg
+        except:
+            discard = True
+            raise
+        finally:
+            self.local.sg = None
+            self.checkin(sg, generation, discard)
+
+    def checkout(self):
+        with self.condition:
+            while True:
+                if self.idle:
+                    return self.idle.pop(), self.generation
+                if self.created < self.max_size:
+                    self.created += 1
+                    generation = self.generation
+                    break
+                self.condition.wait(1)
+
+        try:
+            sg_user = self.connector.sg_user
+            if not sg_user:
+                raise Exception('no shotgun user to create connection for')
+            return sg_user.create_sg_connection(), generation
+        except:
+            with self.condition:
+                if generation == self.generation:
+                    self.created -= 1
+                self.condition.notify()
+            raise
+
+    def checkin(self, sg, generation, discard = False):
+        with self.condition:
+            if generation != self.generation:
+                discard = True
+            elif discard:
+                self.created -= 1
+            else:
+                self.idle.append(sg)
+            self.condition.notify()
+        if discard:
+            self.close_connection(sg)
+
+    def reset(self):
+        # called when shotgun user changes.
+        # connections that are checked out are closed on checkin
+        with self.condition:
+            idle = self.idle
+            self.idle = []
+            self.created = 0
+            self.generation += 1
+            self.condition.notify_all()
+        for sg in idle:
+            self.close_connection(sg)
+
+    def close_connection(self, sg):
+        try:
+            sg.close()
+        except:
+            pass
+
+
+class flameQueryExecutor(object):
+    # flameQueryExecutor is a small fixed size thread pool
+    # that runs independent shotgun queries concurrently
+    # (there is no concurrent.futures in python 2).
+    # map() called from one of the executor threads runs inline
+    # so nested calls can not deadlock.
+
+    def __init__(self, size = 4):
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+
+        self.size = max(1, size)
+        self.tasks = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.running = True
+
+    def start_workers(self):
+        with self.lock:
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+            while len(self.workers) < self.size:
+                worker = threading.Thread(target=self.worker_loop)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def worker_loop(self):
+        self.local.worker = True
+        while self.running:
+            task = self.tasks.get()
+            if task is None:
+                break
+            function, item, results, errors, index, done = task
+            try:
+                results[index] = function(item)
+            except Exception as e:
+                errors[index] = e
+            done.set()
+
+    def map(self, function, items):
+
+        # returns results in the order of items.
+        # if any of the calls has failed the first exception is raised
+        # once all of the calls are complete
+
+        items = list(items)
+        if len(items) < 2 or getattr(self.local, 'worker', False) or (not self.running):
+            return [function(item) for item in items]
+
+        self.start_workers()
+
+        results = [None] * len(items)
+        errors = [None] * len(items)
+        events = []
+        for index, item in enumerate(items):
+            done = threading.Event()
+            events.append(done)
+            self.tasks.put((function, item, results, errors, index, done))
+        for done in events:
+            done.wait()
+        for error in errors:
+            if error is not None:
+                raise error
+        return results
+
+    def shutdown(self):
+        self.running = False
+        with self.lock:
+            for worker in self.workers:
+                self.tasks.put(None)
+
+
+class flameCacheRecord(MutableMapping):
+    # flameCacheRecord is a compact form of a cached shotgun row.
+    # Field names are kept once per distinct layout and values in a tuple,
+    # so a row costs about as much as a tuple instead of a dictionary.
+    # It behaves like a dictionary for existing callers: fields can be
+    # changed or added in place, added ones go into a small overflow dict.
+    # Records are pickled and copied as plain dictionaries.
+
+    __slots__ = ('_layout', '_values', '_extra')
+    empty_layout = ((), {})
+
+    def __init__(self, layout, values):
+        # layout is a tuple of (fields, {field: index}) shared between records
+        self._layout = layout
+        self._values = values
+        self._extra = None
+
+    def __getitem__(self, key):
+        index = self._layout[1].get(key)
+        if index is not None:
+            return self._values[index]
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default = None):
+        index = self._layout[1].get(key)
+        if index is not None:
+            return self._values[index]
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __setitem__(self, key, value):
+        index = self._layout[1].get(key)
+        if index is not None:
+            values = list(self._values)
+            values[index] = value
+            self._values = tuple(values)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._layout[1]:
+            extra = dict(self)
+            del extra[key]
+            self._layout = self.empty_layout
+            self._values = ()
+            self._extra = extra
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return (key in self._layout[1]) or (self._extra is not None and key in self._extra)
+
+    def __iter__(self):
+        for key in self._layout[0]:
+            yield key
+        if self._extra:
+            for key in list(self._extra.keys()):
+                yield key
+
+    def __len__(self):
+        return len(self._layout[0]) + (len(self._extra) if self._extra else 0)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def copy(self):
+        return dict(self)
+
+    def __eq__(self, other):
+        # records of the same layout are compared by values,
+        # values shared through interner compare by identity
+        if isinstance(other, flameCacheRecord) and other._layout is self._layout:
+            return other._values == self._values and other._extra == self._extra
+        return MutableMapping.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (dict, (self.items(), ))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class flameCacheMap(Mapping):
+    # flameCacheMap is a persistent dictionary for cached results and
+    # their secondary indexes. Keys are spread over buckets by hash and
+    # updated() returns a new map that copies only the buckets it touches,
+    # so merging a few rows into a large result costs about as much
+    # as the rows themselves. Published maps are never changed and can be
+    # read without the lock. A result map also carries its indexes and
+    # generation, so result, indexes and generation of a query are
+    # published together with a single assignment.
+    # Maps are pickled as plain dictionaries.
+
+    bucket_size = 256
+
+    def __init__(self, items = None):
+        items = dict(items or {})
+        count = 1
+        while count * self.bucket_size < len(items):
+            count *= 2
+        buckets = [{} for index in range(count)]
+        for key, value in items.items():
+            buckets[hash(key) & (count - 1)][key] = value
+        self.buckets = buckets
+        self.length = len(items)
+        self.indexes = {}
+        self.generation = 0
+
+    def __getitem__(self, key):
+        return self.buckets[hash(key) & (len(self.buckets) - 1)][key]
+
+    def get(self, key, default = None):
+        return self.buckets[hash(key) & (len(self.buckets) - 1)].get(key, default)
+
+    def __contains__(self, key):
+        return key in self.buckets[hash(key) & (len(self.buckets) - 1)]
+
+    def __iter__(self):
+        for bucket in self.buckets:
+            for key in bucket:
+                yield key
+
+    def __len__(self):
+        return self.length
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [value for bucket in self.buckets for value in bucket.values()]
+
+    def items(self):
+        return [item for bucket in self.buckets for item in bucket.items()]
+
+    def updated(self, changed = None, removed = None):
+
+        # returns new map with changed items set and removed keys dropped.
+        # Indexes and generation are carried over and are replaced
+        # by the caller before the map is published.
+        # Buckets are doubled once they hold four times bucket_size on average
+
+        changed = changed or {}
+        if self.length + len(changed) > len(self.buckets) * self.bucket_size * 4:
+            items = dict(self.items())
+            items.update(changed)
+            for key in (removed or []):
+                items.pop(key, None)
+            new_map = self.__class__(items)
+        else:
+            new_map = self.__class__.__new__(self.__class__)
+            new_map.buckets = list(self.buckets)
+            new_map.length = self.length
+            mask = len(self.buckets) - 1
+            copied = set()
+            for key, value in changed.items():
+                index = hash(key) & mask
+                if index not in copied:
+                    new_map.buckets[index] = dict(new_map.buckets[index])
+                    copied.add(index)
+                if key not in new_map.buckets[index]:
+                    new_map.length += 1
+                new_map.buckets[index][key] = value
+            for key in (removed or []):
+                index = hash(key) & mask
+                if key not in new_map.buckets[index]:
+                    continue
+                if index not in copied:
+                    new_map.buckets[index] = dict(new_map.buckets[index])
+                    copied.add(index)
+                del new_map.buckets[index][key]
+                new_map.length -= 1
+        new_map.indexes = self.indexes
+        new_map.generation = self.generation
+        return new_map
+
+    def __eq__(self, other):
+        return Mapping.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (dict, (self.items(), ))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class flameCacheInterner(object):
+    # flameCacheInterner makes rows of all cached queries share
+    # identical entity links, short strings and record layouts.
+    # Shared links are plain dictionaries and should not be changed in place.
+    # Interned strings are freed by python once unused, links and layouts
+    # are kept in tables until prune() drops the ones no cached row refers to.
+    # stale is set once rows have been dropped in bulk (i.e. unregistered
+    # query or evicted project) and cleared by prune()
+
+    max_string_length = 64
+
+    def __init__(self):
+        self.links = {}
+        self.layouts = {}
+        self.stale = False
+        try:
+            self.intern_string = sys.intern
+        except AttributeError:
+            self.intern_string = intern
+
+    def clear(self):
+        self.links = {}
+        self.layouts = {}
+        self.stale = False
+
+    def prune(self, results):
+
+        # rebuilds tables with links and layouts of rows in results only.
+        # Rows compacted while tables are rebuilt keep their links,
+        # they are only not shared with rows compacted later
+
+        self.stale = False
+        links = {}
+        layouts = {}
+        seen = set()
+
+        def keep(link):
+            if id(link) in seen:
+                return
+            seen.add(id(link))
+            try:
+                links[tuple(sorted(link.items()))] = link
+            except TypeError:
+                pass
+
+        for result_by_id in results:
+            for row in result_by_id.values():
+                if not isinstance(row, flameCacheRecord):
+                    continue
+                layouts[row._layout[0]] = row._layout
+                for value in row._values:
+                    if isinstance(value, dict):
+                        keep(value)
+                    elif isinstance(value, list):
+                        for item in value:
+                            if isinstance(item, dict):
+                                keep(item)
+        removed = (len(self.links) - len(links), len(self.layouts) - len(layouts))
+        self.links = links
+        self.layouts = layouts
+        return removed
+
+    def record(self, row):
+        if isinstance(row, flameCacheRecord):
+            return row
+        fields = tuple(row.keys())
+        layout = self.layouts.get(fields)
+        if layout is None:
+            fields = tuple(self.value(field) for field in fields)
+            layout = self.layouts.setdefault(fields, (fields, {field: index for index, field in enumerate(fields)}))
+        return flameCacheRecord(layout, tuple(self.value(row[field]) for field in layout[0]))
+
+    def value(self, value):
+        if isinstance(value, str):
+            if len(value) <= self.max_string_length:
+                return self.intern_string(value)
+            return value
+        if isinstance(value, dict):
+            return self.link(value)
+        if isinstance(value, list):
+            return [self.link(item) if isinstance(item, dict) else item for item in value]
+        return value
+
+    def link(self, link):
+        try:
+            key = tuple(sorted(link.items()))
+            shared = self.links.get(key)
+        except TypeError:
+            # nested or unhashable values
+            return link
+        if shared is None:
+            shared = self.links.setdefault(key, dict((self.value(k), self.value(v)) for k, v in link.items()))
+        return shared
+
+
+class flameCacheMetrics(object):
+    # flameCacheMetrics collects per-query cache statistics:
+    # fetch latency histograms by kind of fetch ('initial', 'full', 'soft',
+    # 'reconcile', 'events', 'service', 'focus', 'write'), error counts, reader hits and time of
+    # the last successful fetch. Row counts and sizes are taken
+    # from the cache itself when report is made.
+
+    # histogram bucket upper bounds, in seconds
+    buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = {}
+
+    def empty(self):
+        return {
+            'hits': 0,
+            'errors': {},
+            'last_error': None,
+            'last_success': None,
+            'latency': {}
+        }
+
+    def query(self, uid):
+        query = self.queries.get(uid)
+        if query is None:
+            query = self.queries.setdefault(uid, self.empty())
+        return query
+
+    def observe(self, uid, kind, seconds):
+        import bisect
+
+        with self.lock:
+            query = self.query(uid)
+            histogram = query['latency'].get(kind)
+            if histogram is None:
+                histogram = query['latency'].setdefault(kind, {
+                    'count': 0,
+                    'sum': 0.0,
+                    'max': 0.0,
+                    'buckets': [0] * (len(self.buckets) + 1)
+                })
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+            histogram['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+            query['last_success'] = time.time()
+
+    def error(self, uid, kind, message):
+        with self.lock:
+            query = self.query(uid)
+            query['errors'][kind] = query['errors'].get(kind, 0) + 1
+            query['last_error'] = {'time': time.time(), 'kind': kind, 'message': message}
+
+    def hit(self, uid):
+        with self.lock:
+            self.query(uid)['hits'] += 1
+
+    def forget(self, uid):
+        with self.lock:
+            self.queries.pop(uid, None)
+
+    def percentile(self, histogram, fraction):
+
+        # approximate: upper bound of the bucket percentile falls into
+
+        target = histogram['count'] * fraction
+        total = 0
+        for index, count in enumerate(histogram['buckets']):
+            total += count
+            if total >= target and count:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], histogram['max'])
+                return histogram['max']
+        return histogram['max']
+
+    def report(self):
+        import copy
+
+        with self.lock:
+            queries = copy.deepcopy(self.queries)
+        for query in queries.values():
+            for histogram in query['latency'].values():
+                histogram['mean'] = histogram['sum'] / histogram['count'] if histogram['count'] else 0.0
+                histogram['p50'] = self.percentile(histogram, 0.5)
+                histogram['p95'] = self.percentile(histogram, 0.95)
+        return queries
+
+
+class flameCacheColumns(object):
+    # flameCacheColumns is a columnar view of a cached result
+    # for vectorized filtering in menus. Columns are built lazily from
+    # result (it never changes once published) and the view is
+    # memoized by connector against the result, see cache_columns.
+    # Values of fields are coded by order of first appearance,
+    # links by (type, id). numpy is optional: without it
+    # the same filters run on plain lists
+
+    def __init__(self, result_by_id):
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+
+        self.numpy = numpy
+        self.rows = [result_by_id.get(entity_id) for entity_id in sorted(result_by_id.keys())]
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, kind, fields, build):
+        key = (kind, fields)
+        column = self.columns.get(key)
+        if column is None:
+            column = self.columns.setdefault(key, build(fields))
+        return column
+
+    def group_column(self, fields):
+
+        # codes of (field, field, ...) values of every row
+
+        def build(fields):
+            groups = {}
+            codes = []
+            for row in self.rows:
+                values = []
+                for field in fields:
+                    value = row.get(field)
+                    if isinstance(value, dict):
+                        value = (value.get('type'), value.get('id'))
+                    values.append(value)
+                codes.append(groups.setdefault(tuple(values), len(groups)))
+            if self.numpy:
+                codes = self.numpy.array(codes, dtype = self.numpy.int64)
+            return codes
+        return self.column('group', fields, build)
+
+    def rank_column(self, field):
+
+        # rank of every row by field value, equal values get equal rank
+        # and rows with no value rank below the rest
+
+        def build(field):
+            values = [row.get(field) for row in self.rows]
+            ranks = [0] * len(values)
+            rank = 0
+            previous = None
+            for position, index in enumerate(sorted(range(len(values)), key = lambda index: (values[index] is not None, values[index]))):
+                if position and values[index] != previous:
+                    rank += 1
+                ranks[index] = rank
+                previous = values[index]
+            if self.numpy:
+                ranks = self.numpy.array(ranks, dtype = self.numpy.int64)
+            return ranks
+        return self.column('rank', field, build)
+
+    def latest(self, group_fields, order_field, by_field = None):
+
+        # returns the row with the highest order_field value (i.e 'created_at')
+        # for every combination of group_fields values. Of the rows with equal
+        # values the one with the lowest id is returned.
+        # With by_field rows are returned as lists by value of that field
+
+        def build(key):
+            group_fields, order_field, by_field = key
+            groups = self.group_column(group_fields)
+            ranks = self.rank_column(order_field)
+            if not self.rows:
+                indices = []
+            elif self.numpy:
+                numpy = self.numpy
+                indices = numpy.arange(len(self.rows))
+                order = numpy.lexsort((-indices, ranks, groups))
+                sorted_groups = groups[order]
+                last = numpy.append(sorted_groups[1:] != sorted_groups[:-1], True)
+                indices = sorted(order[last])
+            else:
+                latest = {}
+                for index in range(len(self.rows)):
+                    current = latest.get(groups[index])
+                    if current is None or ranks[index] > ranks[current]:
+                        latest[groups[index]] = index
+                indices = sorted(latest.values())
+
+            rows = [self.rows[index] for index in indices]
+            if by_field is None:
+                return rows
+            rows_by_value = {}
+            for row in rows:
+                rows_by_value.setdefault(row.get(by_field), []).append(row)
+            return rows_by_value
+        return self.column('latest', (tuple(group_fields), order_field, by_field), build)
+
+    def rebuilt(self, result_by_id):
+
+        # returns view of changed result with the same
+        # filters built as menus have used with this one
+
+        columns = flameCacheColumns(result_by_id)
+        for kind, key in list(self.columns.keys()):
+            if kind == 'latest':
+                columns.latest(*key)
+        return columns
+
+
+class flameCacheSnapshots(object):
+    # flameCacheSnapshots keeps results of async cache queries
+    # in sqlite database next to preferences, so connector is able
+    # to start with warm cache and only catch up with delta sync.
+    # Snapshots are stored per project key (shotgun site and project id)
+    # and query key. Database is dropped and re-created if schema version
+    # does not match and snapshots older than max_age are never loaded.
+
+    schema_version = 2
+    max_age = 7 * 24 * 3600
+
     def __init__(self, framework):
+        self.name = self.__class__.__name__
+        self.framework = framework
+        self.lock = threading.Lock()
+        self.db_path = os.path.join(
+            self.framework.prefs_folder,
+            self.framework.bundle_name + '.cache.db')
+        self.ready = self.init_db()
+
+    def log(self, message):
+        self.framework.log('[' + self.name + '] ' + message)
+
+    def log_debug(self, message):
+        self.framework.log_debug('[' + self.name + '] ' + message)
+
+    def connect(self):
+        import sqlite3
+        return sqlite3.connect(self.db_path, timeout = 10)
+
+    def init_db(self):
+        if not os.path.isdir(self.framework.prefs_folder):
+            try:
+                os.makedirs(self.framework.prefs_folder)
+            except:
+                self.log('unable to create folder %s' % self.framework.prefs_folder)
+                return False
+
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    db = self.connect()
+                    try:
+                        db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+                        row = db.execute('SELECT value FROM meta WHERE key = ?', ('schema_version', )).fetchone()
+                        if (not row) or (row[0] != str(self.schema_version)):
+                            self.log_debug('resetting cache snapshots, schema version: %s' % (row[0] if row else None))
+                            db.execute('DROP TABLE IF EXISTS snapshots')
+                            db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('schema_version', str(self.schema_version)))
+                        db.execute('CREATE TABLE IF NOT EXISTS snapshots ('
+                            'project_key TEXT, query_key TEXT, uid TEXT, '
+                            'watermark BLOB, result BLOB, saved_at REAL, '
+                            'PRIMARY KEY (project_key, query_key))')
+                        db.execute('DELETE FROM snapshots WHERE saved_at < ?', (time.time() - self.max_age, ))
+                        db.commit()
+                    finally:
+                        db.close()
+                    return True
+                except Exception as e:
+                    # database is likely to be corrupted, start from scratch
+                    self.log('unable to open cache snapshots database %s: %s' % (self.db_path, e))
+                    try:
+                        os.remove(self.db_path)
+                    except:
+                        return False
+        return False
+
+    def query_key(self, key):
+
+        # key is a canonical query key made by cache_query_key
+
+        import hashlib
+        return hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+
+    def load(self, project_key, key):
+        import pickle
+
+        if not self.ready:
+            return None
+        
+        with self.lock:
+            try:
+                db = self.connect()
+                try:
+                    row = db.execute('SELECT watermark, result, saved_at FROM snapshots WHERE project_key = ? AND query_key = ?',
+                        (project_key, self.query_key(key))).fetchone()
+                finally:
+                    db.close()
+            except Exception as e:
+                self.log_debug('unable to load cache snapshot: %s' % e)
+                return None
+
+        if not row:
+            return None
+        if row[2] < time.time() - self.max_age:
+            return None
+
+        try:
+            watermark = pickle.loads(bytes(row[0]))
+            result = pickle.loads(bytes(row[1]))
+        except Exception as e:
+            self.log_debug('unable to unpack cache snapshot: %s' % e)
+            return None
+        
+        if not (isinstance(watermark, dict) and isinstance(result, dict)):
+            return None
+        
+        return {'watermark': watermark, 'result': result, 'saved_at': row[2]}
+
+    def save(self, project_key, uid, key, watermark, result):
+        import pickle
+        import sqlite3
+
+        if not self.ready:
+            return False
+
+        # protocol 2 keeps snapshots readable by both python 2 and 3 builds of flame
+        try:
+            watermark_blob = sqlite3.Binary(pickle.dumps(watermark, 2))
+            result_blob = sqlite3.Binary(pickle.dumps(result, 2))
+        except Exception as e:
+            self.log_debug('unable to pack cache snapshot for %s: %s' % (uid, e))
+            return False
+
+        with self.lock:
+            try:
+                db = self.connect()
+                try:
+                    db.execute('INSERT OR REPLACE INTO snapshots '
+                        '(project_key, query_key, uid, watermark, result, saved_at) VALUES (?, ?, ?, ?, ?, ?)',
+                        (project_key, self.query_key(key), uid, watermark_blob, result_blob, time.time()))
+                    db.commit()
+                finally:
+                    db.close()
+            except Exception as e:
+                self.log_debug('unable to save cache snapshot for %s: %s' % (uid, e))
+                return False
+        return True
+
+    def clear(self, project_key = None):
+        if not self.ready:
+            return False
+        with self.lock:
+            try:
+                db = self.connect()
+                try:
+                    if project_key is None:
+                        db.execute('DELETE FROM snapshots')
+                    else:
+                        db.execute('DELETE FROM snapshots WHERE project_key = ?', (project_key, ))
+                    db.commit()
+                finally:
+                    db.close()
+            except Exception as e:
+                self.log_debug('unable to clear cache snapshots: %s' % e)
+                return False
+        return True
+
+
+class flameCacheService(object):
+    # flameCacheService is a host level cache process shared by flame sessions.
+    # It owns a connector that polls ShotGrid for every query registered
+    # by sessions of this host, so identical queries of different sessions
+    # are fetched and refreshed once. Sessions subscribe to queries over
+    # unix socket and pull rows changed since the generation they hold.
+    # Messages are pickles prefixed with their length and signed with a key
+    # kept next to the socket, see service_key. Socket and key live in
+    # a directory only the user who has started the service has access to.
+    # Service exits once it has had no clients for cache_service_idle_exit seconds
+
+    def __init__(self, framework, socket_path, sg_user):
+        self.name = self.__class__.__name__
+        self.framework = framework
+        self.socket_path = socket_path
+        self.key = None
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.clients = 0
+        self.last_client = time.time()
+        self.running = True
+
+        self.connector = flameShotgunConnector(framework, service = True)
+        self.connector.sg_user = sg_user
+        self.connector.sg_pool.reset()
+        self.connector.update_human_user()
+        self.connector.sg = sg_user.create_sg_connection()
+        self.idle_exit = self.connector.prefs_global.get('cache_service_idle_exit', 600)
+
+    def log(self, message):
+        self.framework.log('[' + self.name + '] ' + message)
+
+    def log_debug(self, message):
+        self.framework.log_debug('[' + self.name + '] ' + message)
+
+    @staticmethod
+    def private_dir(path):
+
+        # creates directory only the current user has access to.
+        # Raises OSError if existing one belongs to someone else
+        # or is accessible by others
+
+        try:
+            os.mkdir(path, 0o700)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+        flameCacheService.check_owner(path)
+        return path
+
+    @staticmethod
+    def check_owner(path):
+        import stat
+
+        # raises OSError unless path belongs to the current user
+        # and nobody else has access to it
+
+        status = os.lstat(path)
+        if stat.S_ISLNK(status.st_mode) or status.st_uid != os.getuid() or (status.st_mode & 0o077):
+            raise OSError('%s is not private to user %s' % (path, os.getuid()))
+
+    @staticmethod
+    def service_key(socket_path):
+
+        # secret shared by sessions and service of the same user.
+        # Whoever comes first creates it, messages signed
+        # with another key are rejected before they are unpickled
+
+        key_path = os.path.join(os.path.dirname(socket_path), 'service.key')
+        try:
+            key_file = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except OSError:
+            key_file = None
+        if key_file is not None:
+            try:
+                os.write(key_file, os.urandom(32))
+            finally:
+                os.close(key_file)
+
+        flameCacheService.check_owner(key_path)
+        with open(key_path, 'rb') as key_file:
+            key = key_file.read()
+        if len(key) != 32:
+            raise OSError('cache service key %s is not complete' % key_path)
+        return key
+
+    @staticmethod
+    def send_message(connection, message, key):
+        import hashlib
+        import hmac
+        import pickle
+        import struct
+
+        data = pickle.dumps(message, 2)
+        signature = hmac.new(key, data, hashlib.sha256).digest()
+        connection.sendall(struct.pack('>I', len(data)) + signature + data)
+
+    @staticmethod
+    def recv_message(connection, key):
+        import hashlib
+        import hmac
+        import pickle
+        import struct
+
+        # returns None if connection has been closed
+
+        header = flameCacheService.recv_exactly(connection, 4)
+        if header is None:
+            return None
+        signature = flameCacheService.recv_exactly(connection, 32)
+        data = flameCacheService.recv_exactly(connection, struct.unpack('>I', header)[0])
+        if signature is None or data is None:
+            raise EOFError('connection closed in the middle of a message')
+        if not hmac.compare_digest(signature, hmac.new(key, data, hashlib.sha256).digest()):
+            raise ValueError('cache service message signature does not match')
+        return pickle.loads(data)
+
+    @staticmethod
+    def recv_exactly(connection, size):
+        chunks = []
+        received = 0
+        while received < size:
+            chunk = connection.recv(min(size - received, 1048576))
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            received += len(chunk)
+        return b''.join(chunks)
+
+    def serve_forever(self):
+        import socket
+
+        # another service may have been started by a concurrent session
+
+        try:
+            flameCacheServiceClient(self.socket_path, timeout = 5).request('ping')
+            self.log('cache service is already running on %s' % self.socket_path)
+            return False
+        except:
+            pass
+
+        # nothing is removed or listened to outside of user's private directory
+
+        try:
+            self.private_dir(os.path.dirname(self.socket_path))
+            if os.path.lexists(self.socket_path):
+                self.check_owner(self.socket_path)
+                os.remove(self.socket_path)
+            self.key = self.service_key(self.socket_path)
+        except OSError as e:
+            self.log('unable to start cache service: %s' % e)
+            return False
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        server.listen(16)
+        server.settimeout(1)
+        self.log('listening on %s, pid %s' % (self.socket_path, os.getpid()))
+
+        while self.running:
+            try:
+                connection, address = server.accept()
+            except socket.timeout:
+                with self.lock:
+                    idle = (not self.clients) and (time.time() - self.last_client) > self.idle_exit
+                if idle:
+                    self.log('no clients for %s sec, exiting' % self.idle_exit)
+                    break
+                continue
+            connection.settimeout(None)
+            handler = threading.Thread(target=self.handle, args=(connection, ))
+            handler.daemon = True
+            handler.start()
+
+        server.close()
+        try:
+            self.check_owner(self.socket_path)
+            os.remove(self.socket_path)
+        except:
+            pass
+        self.connector.terminate_loops()
+        return True
+
+    def handle(self, connection):
+        client_id = id(connection)
+        with self.lock:
+            self.clients += 1
+        try:
+            while self.running:
+                message = self.recv_message(connection, self.key)
+                if message is None:
+                    break
+                try:
+                    response = self.dispatch(client_id, message)
+                except Exception as e:
+                    self.log_debug('error handling %s: %s' % (message.get('method'), e))
+                    response = {'error': str(e)}
+                self.send_message(connection, response, self.key)
+        except Exception as e:
+            self.log_debug('client connection error: %s' % e)
+        finally:
+            connection.close()
+            self.release(client_id)
+            with self.lock:
+                self.clients -= 1
+                self.last_client = time.time()
+
+    def dispatch(self, client_id, message):
+        method = message.get('method')
+        connector = self.connector
+
+        if method == 'ping':
+            return {
+                'host': getattr(connector.sg_user, 'host', None),
+                'login': getattr(connector.sg_user, 'login', None),
+                'pid': os.getpid()
+                }
+
+        elif method == 'register':
+            uid = self.subscribe(client_id, message.get('query'), message.get('budget'), message.get('priority', 0))
+            return {'uid': uid}
+
+        elif method == 'sync':
+            for uid in message.get('release', []):
+                self.unsubscribe(client_id, uid)
+            connector.cache_touch(*message.get('used', []))
+            for uid in message.get('refresh', []):
+                connector.cache_request_refresh(uid, rescan = False)
+
+            changes = {}
+            missing = []
+            for uid, generation in message.get('queries', {}).items():
+                if uid not in connector.async_cache:
+                    missing.append(uid)
+                    continue
+                change = connector.cache_changes_since(uid, generation)
+                if change:
+                    changes[uid] = change
+            return {'changes': changes, 'missing': missing}
+
+        elif method == 'metrics':
+            return {'report': connector.cache_metrics_report()}
+
+        raise ValueError('unknown method: %s' % method)
+
+    def subscribe(self, client_id, query, budget = None, priority = 0):
+
+        # identical queries of different sessions share one service uid
+
+        connector = self.connector
+        uid = connector.cache_snapshots.query_key(connector.cache_query_key(query)).upper()
+        with self.lock:
+            subscribers = self.subscribers.setdefault(uid, {})
+            subscribers[client_id] = subscribers.get(client_id, 0) + 1
+            if uid not in connector.async_cache:
+                connector.cache_register(query, uid = uid, budget = budget, priority = priority, track_changes = True)
+        return uid
+
+    def unsubscribe(self, client_id, uid, count = 1):
+        with self.lock:
+            subscribers = self.subscribers.get(uid, {})
+            subscribers[client_id] = subscribers.get(client_id, 0) - count
+            if subscribers[client_id] <= 0:
+                del subscribers[client_id]
+            if not subscribers:
+                self.subscribers.pop(uid, None)
+                self.connector.cache_unregister(uid)
+
+    def release(self, client_id):
+        # drops subscriptions of disconnected client
+        for uid in list(self.subscribers.keys()):
+            count = self.subscribers.get(uid, {}).get(client_id)
+            if count:
+                self.unsubscribe(client_id, uid, count)
+
+
+class flameCacheServiceClient(object):
+    # flameCacheServiceClient talks to host cache service on behalf of connector.
+    # Requests are made one at a time over a single connection,
+    # connection is re-established with the next request if it fails
+
+    def __init__(self, socket_path, timeout = 60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.connection = None
+        self.key = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        import socket
+
+        # socket could have been put there by another user
+
+        flameCacheService.check_owner(os.path.dirname(self.socket_path))
+        flameCacheService.check_owner(self.socket_path)
+        self.key = flameCacheService.service_key(self.socket_path)
+
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+            connection.connect(self.socket_path)
+        except:
+            connection.close()
+            raise
+        self.connection = connection
+
+    def request(self, method, **kwargs):
+        message = dict(kwargs)
+        message['method'] = method
+        with self.lock:
+            try:
+                if not self.connection:
+                    self.connect()
+                flameCacheService.send_message(self.connection, message, self.key)
+                response = flameCacheService.recv_message(self.connection, self.key)
+            except:
+                self.close_connection()
+                raise
+            if response is None:
+                self.close_connection()
+                raise EOFError('cache service has closed connection')
+        if response.get('error'):
+            raise Exception('cache service: %s' % response.get('error'))
+        return response
+
+    def close(self):
+        with self.lock:
+            self.close_connection()
+
+    def close_connection(self):
+        if self.connection:
+            try:
+                self.connection.close()
+            except:
+                pass
+        self.connection = None
+
+
+class flameShotgunConnector(object):
+    def __init__(self, framework, service = False):
         self.name = self.__class__.__name__
         self.framework = framework
         self.connector = self
+        # connector of host cache service process has no flame
+        # project of its own, it serves queries of flame sessions
+        self.cache_service_host = service
         self.log('waking up')
 
         self.prefs = self.framework.prefs_dict(self.framework.prefs, self.name)
@@ -720,12 +1908,116 @@ class flameShotgunConnector(object):
         if not 'tank_name_overrides' in self.prefs.keys():
             # tank_name_overrides are {'project_id': 'overrided_tank_name'}
             self.prefs['tank_name_overrides'] = {}
-        
+        if not 'cache_hard_refresh_interval' in self.prefs_global.keys():
+            # full re-fetch of every registered query, in seconds
+            # delta sync keeps the cache up to date in between, 0 disables it
+            self.prefs_global['cache_hard_refresh_interval'] = 3600
+        if not 'cache_reconcile_interval' in self.prefs_global.keys():
+            # id-only pass that drops deleted or retired entities, in seconds
+            self.prefs_global['cache_reconcile_interval'] = 300
+        if not 'cache_snapshots' in self.prefs_global.keys():
+            # keep async cache on disk between flame sessions
+            self.prefs_global['cache_snapshots'] = True
+        if not 'cache_snapshot_interval' in self.prefs_global.keys():
+            # minimum time between saving changed queries to disk, in seconds
+            self.prefs_global['cache_snapshot_interval'] = 120
+        if not 'cache_refresh_mode' in self.prefs_global.keys():
+            # 'poll': delta sync of every registered query
+            # 'events': tail EventLogEntry and re-read changed entities only
+            self.prefs_global['cache_refresh_mode'] = 'poll'
+        if not 'cache_max_connections' in self.prefs_global.keys():
+            # size of background connection pool and query executor
+            self.prefs_global['cache_max_connections'] = 4
+        if not 'cache_initial_shards' in self.prefs_global.keys():
+            # number of id-range shards fetched concurrently on query register
+            self.prefs_global['cache_initial_shards'] = 8
+        if not 'cache_page_size' in self.prefs_global.keys():
+            # rows per page of paged fetch, 500 is the shotgun api maximum
+            self.prefs_global['cache_page_size'] = 500
+        if not 'cache_publish_pages' in self.prefs_global.keys():
+            # pages of initial fetch merged into cache at once,
+            # every merge publishes a new generation to menus
+            self.prefs_global['cache_publish_pages'] = 4
+        if not 'cache_refresh_budget' in self.prefs_global.keys():
+            # default staleness budget of a registered query, in seconds
+            self.prefs_global['cache_refresh_budget'] = 5
+        if not 'cache_measure_interval' in self.prefs_global.keys():
+            # memory used by a changed query is measured
+            # in background at most that often, in seconds
+            self.prefs_global['cache_measure_interval'] = 60
+        if not 'cache_idle_after' in self.prefs_global.keys():
+            # queries not used by menus for longer than that
+            # are refreshed less and less often, in seconds
+            self.prefs_global['cache_idle_after'] = 300
+        if not 'cache_focus_budget' in self.prefs_global.keys():
+            # staleness budget of rows linked to entities in focus
+            # (see cache_focus_entity), in seconds
+            self.prefs_global['cache_focus_budget'] = 2
+        if not 'cache_focus_entities' in self.prefs_global.keys():
+            # number of most recently focused entities kept in focus
+            self.prefs_global['cache_focus_entities'] = 8
+        if not 'cache_focus_expire' in self.prefs_global.keys():
+            # entities not focused again by menus for longer
+            # than that leave focus, in seconds
+            self.prefs_global['cache_focus_expire'] = 900
+        if not 'cache_query_scope' in self.prefs_global.keys():
+            # per site scoping of common queries by uid, i.e.
+            # {'current_versions': {'exclude_statuses': ['omt'], 'updated_within': 365}}
+            # 'exclude_statuses': rows with these statuses are not fetched
+            # 'updated_within': rows not updated for that many days are not fetched
+            # 'entity_types': rows are fetched only for entities of these types
+            # 'fields': fields to fetch instead of default ones
+            # see cache_scope_query and cache_scope_report
+            self.prefs_global['cache_query_scope'] = {}
+        if not 'cache_idle_decay_max' in self.prefs_global.keys():
+            # maximum staleness budget multiplier for idle queries
+            self.prefs_global['cache_idle_decay_max'] = 16
+        if not 'cache_compact_rows' in self.prefs_global.keys():
+            # keep cached rows as compact records sharing identical links and strings
+            self.prefs_global['cache_compact_rows'] = True
+        if not 'cache_service' in self.prefs_global.keys():
+            # share async cache between flame sessions of this host
+            # through a background cache service process
+            self.prefs_global['cache_service'] = False
+        if not 'cache_service_python' in self.prefs_global.keys():
+            # python interpreter to run cache service with, empty to look for
+            # the one flame python comes from (see cache_service_python)
+            self.prefs_global['cache_service_python'] = ''
+        if not 'cache_service_idle_exit' in self.prefs_global.keys():
+            # cache service exits after having no clients for that long, in seconds
+            self.prefs_global['cache_service_idle_exit'] = 600
+        if not 'cache_retained_projects' in self.prefs_global.keys():
+            # number of recently linked projects which common queries are kept
+            # in memory and refreshed in background once project is unlinked
+            self.prefs_global['cache_retained_projects'] = 2
+        if not 'cache_retained_memory' in self.prefs_global.keys():
+            # memory budget for queries of retained projects, in Mb
+            self.prefs_global['cache_retained_memory'] = 512
+        if not 'cache_retained_budget' in self.prefs_global.keys():
+            # staleness budget of retained projects queries, in seconds
+            self.prefs_global['cache_retained_budget'] = 900
+
         self.sg_user = None
         self.sg_human_user = None
         self.sg_user_name = None
         self.sg = None
-        if not self.prefs_global.get('user signed out', False):
+
+        # background threads never use self.sg, 
+        # they check out connections from the pool instead
+        # and run independent queries with executor
+
+        self.sg_pool = flameShotgunConnectionPool(self, self.prefs_global.get('cache_max_connections', 4))
+        self.cache_executor = flameQueryExecutor(self.prefs_global.get('cache_max_connections', 4))
+
+        # client of host cache service, set when connected.
+        # uids of unregistered queries are released with the next sync
+
+        self.cache_service = None
+        self.cache_service_released = []
+        self.cache_service_attempt = 0
+        self.cache_service_lock = threading.Lock()
+
+        if not (self.cache_service_host or self.prefs_global.get('user signed out', False)):
             self.log_debug('requesting for Shotgun user')
             try:
                 self.get_user()
@@ -736,7 +2028,51 @@ class flameShotgunConnector(object):
         self.sg_linked_project = None
         self.sg_linked_project_id = None
 
+        # async_cache and cached results are copy-on-write:
+        # writers holding cache_lock build new dictionaries and swap them in,
+        # so readers never need a lock and never see partial updates
+
         self.async_cache = {}
+        self.cache_lock = threading.RLock()
+        self.cache_interner = flameCacheInterner()
+        self.cache_metrics = flameCacheMetrics()
+        self.cache_snapshots = flameCacheSnapshots(self.framework)
+        self.cache_last_event_id = None
+
+        # refresh requests made with cache_refresh wake up scheduler,
+        # hooks rescan is scheduled once for any number of refreshed queries
+
+        self.cache_refresh_wakeup = threading.Event()
+        self.cache_rescan_scheduled = False
+
+        # hard update or reconcile pass running in its own thread,
+        # see cache_maintenance_pass
+
+        self.cache_maintenance_thread = None
+
+        # entities written through to the cache waiting
+        # to be re-read by scheduler, see cache_write_through
+
+        self.cache_write_pending = []
+
+        # entities in focus by (type, id), see cache_focus_entity
+
+        self.cache_focus = {}
+
+        # time rows of entities have last been fetched by (type, id),
+        # kept after entities leave focus so they are not fetched again
+        # when they come back within cache_focus_expire seconds
+
+        self.cache_focus_fetched = {}
+
+        # default common queries by uid before scoping, see cache_scope_query
+
+        self.cache_scope_defaults = {}
+
+        # scope report built in background for preferences pane,
+        # see cache_scope_report_start
+
+        self.cache_scope_status = {'running': False, 'text': None}
 
         self.async_cache_hash = hash(pformat(self.async_cache))
 
@@ -744,8 +2080,9 @@ class flameShotgunConnector(object):
         if not self.flame_workspace_state:
             self.flame_workspace_state = {}
 
-        self.check_sg_linked_project()
-        self.update_sg_storage_root()
+        if not self.cache_service_host:
+            self.check_sg_linked_project()
+            self.update_sg_storage_root()
 
         # UID for all tasks in async cache
 
@@ -756,8 +2093,7 @@ class flameShotgunConnector(object):
 
         self.loops = []
         self.threads = True
-        self.loops.append(threading.Thread(target=self.cache_long_loop, args=(45, )))
-        self.loops.append(threading.Thread(target=self.cache_short_loop, args=(4, )))
+        self.loops.append(threading.Thread(target=self.cache_scheduler_loop, args=(1, )))
         # self.loops.append(threading.Thread(target=self.flame_scan_loop))
         
         for loop in self.loops:
@@ -765,6 +2101,9 @@ class flameShotgunConnector(object):
             loop.start()
 
         self.tk_engine = None
+        if self.cache_service_host:
+            return
+
         self.bootstrap_toolkit()
 
         # register tasks query for async cache loop
@@ -781,87 +2120,318 @@ class flameShotgunConnector(object):
 
     # background loops and related functions
 
-    def cache_long_loop(self, timeout):
-        avg_delta = timeout / 2
-        recent_deltas = [avg_delta]*9
+    def cache_scheduler_loop(self, tick):
+
+        # Every registered query has its own staleness budget and priority.
+        # Scheduler wakes up every tick and refreshes only queries
+        # that have been stale for longer than their effective budget.
+        # Queries are dispatched to executor workers in priority order
+
+        last_hardupdate = time.time()
+        last_reconcile = time.time()
+        last_snapshot = time.time()
         while self.threads:
             start = time.time()
 
-            if not (self.sg_user and self.sg_linked_project_id):
+            if not (self.sg_user and (self.sg_linked_project_id or self.cache_service_host)):
                 time.sleep(1)
                 continue
 
-            sg = None
+            # sessions connected to host cache service get changes
+            # from it instead of refreshing queries themselves
+
+            self.cache_refresh_wakeup.clear()
+
+            # entities written by the plugin are re-read first,
+            # see cache_write_through
 
             try:
-                sg = self.sg_user.create_sg_connection()
-                self.cache_hardupdate(sg = sg)
+                self.cache_write_follow_up()
             except Exception as e:
-                self.log_debug('error hard updating cache in cache_long_loop: %s' % e)
-            
-            if sg: sg.close()
-            
-            self.preformat_common_queries()
-
-            self.log_debug('cache_long_loop took %s sec' % str(time.time() - start))
-            delta = time.time() - start
-            last_delta = recent_deltas[len(recent_deltas) - 1]
-            recent_deltas.pop(0)
-            
-            if abs(delta - last_delta) > last_delta*3:
-                delta = last_delta*3
+                self.log_debug('error re-reading written entities in cache_scheduler_loop: %s' % e)
 
-            recent_deltas.append(delta)
-            avg_delta = sum(recent_deltas)/float(len(recent_deltas))
-            if avg_delta > timeout/2:
-                self.loop_timeout(avg_delta*2, start)
-            else:
-                self.loop_timeout(timeout, start)
+            if self.prefs_global.get('cache_service') and not self.cache_service_host:
+                if self.cache_service or self.cache_service_connect():
+                    self.cache_service_sync()
+                    self.cache_refresh_landed(list(self.async_cache.keys()), max_wait = 10)
+                    self.loop_timeout(tick, start)
+                    continue
+            elif self.cache_service:
+                self.cache_service_detach()
+
+            # delta sync keeps rows up to date so full re-fetch
+            # is only performed once in a while and deleted entities
+            # are dropped with cheap id-only pass
+
+            hard_refresh_interval = self.prefs_global.get('cache_hard_refresh_interval', 3600)
+            reconcile_interval = self.prefs_global.get('cache_reconcile_interval', 300)
+
+            # retired and out of filter rows are handled
+            # by cache_eventupdate in events mode
+
+            events_mode = self.prefs_global.get('cache_refresh_mode') == 'events'
+
+            # queries of retained projects are only soft updated,
+            # they catch up with deletions once adopted again.
+            # Hard update and reconcile run in their own thread
+            # one at a time, so delta work and refresh requests
+            # are not held up by a full re-fetch of a large project
+
+            active_uids = self.cache_active_uids()
+            if not (self.cache_maintenance_thread and self.cache_maintenance_thread.is_alive()):
+                if hard_refresh_interval and (start - last_hardupdate) >= hard_refresh_interval:
+                    self.cache_start_maintenance(self.cache_maintenance_pass, True, active_uids)
+                    last_hardupdate = start
+                    last_reconcile = start
+                elif reconcile_interval and (start - last_reconcile) >= reconcile_interval and (not events_mode):
+                    self.cache_start_maintenance(self.cache_maintenance_pass, False, active_uids)
+                    last_reconcile = start
+                elif self.cache_interner.stale:
+                    self.cache_start_maintenance(self.cache_prune_interner)
+                elif self.cache_measure_due(start):
+                    self.cache_start_maintenance(self.cache_measure_queries, start)
 
-    def cache_short_loop(self, timeout):
-        avg_delta = timeout / 2
-        recent_deltas = [avg_delta]*9
-        while self.threads:
-            start = time.time()
-            
-            if not (self.sg_user and self.sg_linked_project_id):
-                time.sleep(1)
-                continue
+            try:
+                self.cache_evict_parked()
+            except Exception as e:
+                self.log_debug('error evicting retained queries in cache_scheduler_loop: %s' % e)
 
-            sg = None
+            try:
+                self.cache_refresh_focus(start)
+            except Exception as e:
+                self.log_debug('error refreshing entities in focus in cache_scheduler_loop: %s' % e)
 
             try:
-                sg = self.sg_user.create_sg_connection()
-                self.cache_softupdate(sg = sg)
+                self.cache_warm_columns()
             except Exception as e:
-                self.log_debug('error soft updating cache in cache_short_loop: %s' % e)
-            
-            if sg: sg.close()
+                self.log_debug('error building columnar views in cache_scheduler_loop: %s' % e)
+
+            due_uids = self.cache_due_queries(start)
+            for uid in [uid for uid in due_uids if not self.async_cache.get(uid, {}).get('watermark')]:
+                self.cache_start_initial_fetch(uid)
+                due_uids.remove(uid)
+            if due_uids:
+                generations = self.cache_generations()
+                try:
+                    if events_mode:
+                        # event log is shared by all queries so every
+                        # query is brought up to date by one pass
+                        self.cache_eventupdate()
+                        due_uids = list(self.async_cache.keys())
+                    else:
+                        self.cache_softupdate(uids = due_uids)
+                except Exception as e:
+                    self.log_debug('error soft updating cache in cache_scheduler_loop: %s' % e)
+                self.cache_mark_refreshed(due_uids)
+                self.cache_refresh_landed(due_uids, since = start)
+                self.log_debug('cache_scheduler_loop refreshed %s queries, %s changed, in %s sec' % (
+                    len(due_uids),
+                    len(self.cache_changed_since(generations)),
+                    str(time.time() - start)))
 
-            self.preformat_common_queries()
+            if (start - last_snapshot) >= self.prefs_global.get('cache_snapshot_interval', 120):
+                self.cache_save_snapshots()
+                last_snapshot = start
 
-            delta = time.time() - start
-            self.log_debug('cache_short_loop took %s sec' % str(delta))
+            self.loop_timeout(tick, start)
 
-            last_delta = recent_deltas[len(recent_deltas) - 1]
-            recent_deltas.pop(0)
-            
-            if abs(delta - last_delta) > last_delta*3:
-                delta = last_delta*3
+    def cache_start_maintenance(self, function, *args):
+        self.cache_maintenance_thread = threading.Thread(target=function, args=args)
+        self.cache_maintenance_thread.daemon = True
+        self.cache_maintenance_thread.start()
 
-            recent_deltas.append(delta)
-            avg_delta = sum(recent_deltas)/float(len(recent_deltas))
-            if avg_delta > timeout/2:
-                self.loop_timeout(avg_delta*2, start)
-            else:
-                self.loop_timeout(timeout, start)
-                                
-    def terminate_loops(self):
+    def cache_maintenance_pass(self, hard, uids):
+
+        # full re-fetch (hard) or id-only reconcile of given queries.
+        # Rows replaced by hard update leave links behind in interner
+        # tables, so they are pruned afterwards
+
+        try:
+            if hard:
+                self.cache_hardupdate(uids = uids)
+                self.cache_mark_refreshed(uids)
+                self.cache_prune_interner()
+            else:
+                self.cache_reconcile(uids = uids)
+        except Exception as e:
+            self.log_debug('error hard updating cache in cache_maintenance_pass: %s' % e)
+
+    def cache_prune_interner(self):
+
+        # drops shared links and layouts no cached row refers to anymore,
+        # parked queries included
+
+        start = time.time()
+        results = [cache_request.get('result') or {} for cache_request in list(self.async_cache.values())]
+        removed_links, removed_layouts = self.cache_interner.prune(results)
+        self.log_debug('pruned interner: %s links, %s layouts removed, %s links kept, took %s' % (
+            removed_links, removed_layouts, len(self.cache_interner.links), time.time() - start))
+
+    def cache_effective_budget(self, cache_request, now):
+
+        # queries used by menus within the last minute are refreshed twice as often,
+        # queries not used for cache_idle_after seconds back off exponentially
+
+        budget = cache_request.get('budget') or self.prefs_global.get('cache_refresh_budget', 5)
+        return budget * self.cache_idle_multiplier(cache_request.get('last_used', 0), now)
+
+    def cache_idle_multiplier(self, last_used, now):
+        idle = now - last_used
+        if idle < 60:
+            return 0.5
+        idle_after = self.prefs_global.get('cache_idle_after', 300)
+        if idle_after and idle > idle_after:
+            decay = 2 ** min(int(idle // idle_after), 16)
+            return min(decay, self.prefs_global.get('cache_idle_decay_max', 16))
+        return 1
+
+    def cache_due_queries(self, now = None):
+
+        # returns uids of queries that are due for refresh sorted by
+        # priority and by how much they are overdue.
+        # Queries requested with cache_refresh are due regardless
+        # of their budget and come first.
+        # Queries that have not completed initial fetch are due once
+        # their retry time has come unless the fetch is still running,
+        # scheduler performs initial fetch again for them
+
+        if now is None:
+            now = time.time()
+
+        due = []
+        for uid, cache_request in list(self.async_cache.items()):
+            if not cache_request.get('watermark'):
+                if not (cache_request.get('fetching') or now < cache_request.get('fetch_retry', 0)):
+                    due.append((False, -cache_request.get('priority', 0), 0, uid))
+                continue
+            requested = cache_request.get('refresh_requested') is not None
+            budget = self.cache_effective_budget(cache_request, now)
+            overdue = (now - cache_request.get('last_refresh', 0)) / float(budget)
+            if overdue >= 1 or requested:
+                due.append((not requested, -cache_request.get('priority', 0), -overdue, uid))
+        return [uid for requested, priority, overdue, uid in sorted(due)]
+
+    def cache_mark_refreshed(self, uids, now = None):
+        if now is None:
+            now = time.time()
+        for uid in uids:
+            cache_request = self.async_cache.get(uid)
+            if cache_request:
+                cache_request['last_refresh'] = now
+
+    def cache_refresh(self, uid, rescan = True):
+
+        # stale-while-revalidate: returns cached result right away
+        # and requests background refresh of the query.
+        # If rescan is set flame hooks are rescanned once
+        # refreshed data is in cache
+
+        self.cache_request_refresh(uid, rescan)
+        return self.cache_retrive_result(uid)
+
+    def cache_request_refresh(self, uid, rescan = True):
+
+        # returns False if query is not registered or the scheduler
+        # does not refresh queries until project is linked.
+        # Queries that have not completed initial fetch are never refreshed
+        # by scheduler passes, so their fetch is started right away if it is
+        # not running and False is returned for callers to rescan themselves
+
+        if not (self.sg_user and (self.sg_linked_project_id or self.cache_service_host)):
+            return False
+        with self.cache_lock:
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                return False
+            unsynced = not (cache_request.get('watermark') or 'service_uid' in cache_request)
+            if not unsynced and cache_request.get('refresh_requested') is None:
+                cache_request['refresh_requested'] = getattr(cache_request.get('result'), 'generation', 0)
+                cache_request['refresh_requested_at'] = time.time()
+                cache_request['refresh_sent'] = None
+            if rescan and not unsynced:
+                cache_request['rescan_requested'] = True
+        if unsynced:
+            self.cache_start_initial_fetch(uid)
+            return False
+        self.cache_refresh_wakeup.set()
+        return True
+
+    def cache_refresh_landed(self, uids, since = None, max_wait = None):
+
+        # completes refresh requests of queries that have been refreshed
+        # by a pass started at since. Requests made later wait for the next pass.
+        # With cache service changes arrive with one of the next syncs,
+        # so requests wait for a change for up to max_wait seconds
+
+        now = time.time()
+        rescan = False
+        with self.cache_lock:
+            for uid in uids:
+                cache_request = self.async_cache.get(uid)
+                if not cache_request or cache_request.get('refresh_requested') is None:
+                    continue
+                if since is not None and cache_request.get('refresh_requested_at', 0) > since:
+                    continue
+                changed = getattr(cache_request.get('result'), 'generation', 0) != cache_request.get('refresh_requested')
+                if not changed and max_wait is not None:
+                    sent = cache_request.get('refresh_sent')
+                    if sent is None or (now - sent) < max_wait:
+                        continue
+                cache_request['refresh_requested'] = None
+                if cache_request.pop('rescan_requested', False):
+                    rescan = True
+        if rescan:
+            self.cache_schedule_rescan()
+        return rescan
+
+    def cache_schedule_rescan(self):
+
+        # flame runs scheduled function on its main thread once idle,
+        # further requests are ignored until then
+
+        with self.cache_lock:
+            if self.cache_rescan_scheduled:
+                return False
+            self.cache_rescan_scheduled = True
+
+        def rescan():
+            self.cache_rescan_scheduled = False
+            rescan_hooks()
+
+        try:
+            import flame
+            flame.schedule_idle_event(rescan)
+        except Exception as e:
+            self.log_debug('unable to schedule hooks rescan: %s' % e)
+            self.cache_rescan_scheduled = False
+            return False
+        return True
+
+    def cache_touch(self, *uids):
+
+        # marks queries as used by menus so they are refreshed more often
+
+        now = time.time()
+        for uid in uids:
+            cache_request = self.async_cache.get(uid)
+            if cache_request:
+                cache_request['last_used'] = now
+                self.cache_metrics.hit(uid)
+
+    def terminate_loops(self):
         self.threads = False
         
         for loop in self.loops:
             loop.join()
 
+        if self.cache_service:
+            self.cache_service.close()
+            self.cache_service = None
+
+        self.cache_executor.shutdown()
+        self.cache_save_snapshots()
+        self.sg_pool.reset()
+
     def loop_timeout(self, timeout, start):
         time_passed = int(time.time() - start)
         if timeout <= time_passed:
@@ -871,11 +2441,13 @@ class flameShotgunConnector(object):
                 if not self.threads:
                     self.log_debug('leaving loop thread: %s' % inspect.currentframe().f_back.f_code.co_name)
                     break
+                if self.cache_refresh_wakeup.is_set():
+                    break
                 time.sleep(0.1)
 
     # async cache related methods
 
-    def cache_register(self, query, perform_query = True, uid = None):
+    def cache_register(self, query, perform_query = True, uid = None, indexes = None, budget = None, priority = 0, track_changes = False):
         import uuid
 
         if not uid:
@@ -883,143 +2455,862 @@ class flameShotgunConnector(object):
         
         self.log_debug('registering\n %s under uid: %s' % (pformat(query), uid))
 
-        self.async_cache[uid] = {'query': query, 'result': {}}
-        
+        # watermark holds the highest 'updated_at' and id seen in a complete
+        # result set and is used by delta sync to fetch only changed rows
+
+        # budget is the time in seconds cached result is allowed to be stale,
+        # default is cache_refresh_budget. Queries with higher priority
+        # are refreshed first.
+        # indexes is a dictionary of secondary index names and key functions.
+        # Every index is stored in the cache request under its name as
+        # a dictionary of lists of rows grouped by key and sorted by id,
+        # and is kept up to date as rows are added, changed or removed
+
+        # key is a canonical (entity, filters, fields) tuple computed once here.
+        # Queries sharing the same entity and filters are fetched together and
+        # a query with the same or narrower field list starts from the result
+        # of one that is already in cache
+
+        # track_changes keeps a short log of changed ids (see cache_log_change).
+        # When connected to cache service query is fetched and refreshed
+        # by the service and service_uid holds its uid there once subscribed
+
+        key = self.cache_query_key(query)
+        parked_uid = self.cache_find_parked(key)
+        if parked_uid:
+            return self.cache_adopt(parked_uid, uid, indexes = indexes, budget = budget, priority = priority)
+        shared_request = self.cache_find_shared(key, query)
+
+        cache_request = {
+            'query': query,
+            'key': key,
+            'filters_key': key[:2],
+            'result': flameCacheMap(),
+            'watermark': None,
+            'dirty': False,
+            'project_key': self.cache_project_key(),
+            'indexes': {},
+            'materialized': None,
+            'columns': None,
+            'budget': budget,
+            'priority': priority,
+            'last_refresh': time.time(),
+            'last_used': time.time()
+            }
+        if track_changes:
+            cache_request['changes'] = []
+        if self.cache_service:
+            cache_request['service_uid'] = None
+        with self.cache_lock:
+            async_cache = dict(self.async_cache)
+            async_cache[uid] = cache_request
+            self.async_cache = async_cache
+        if indexes:
+            for index_name in indexes.keys():
+                self.cache_add_index(uid, index_name, indexes.get(index_name))
+        
+        if shared_request:
+            with self.cache_lock:
+                shared_rows, excluded_ids = self.cache_plan_rows(uid, shared_request.get('query'), shared_request.get('result', {}))
+                self.cache_replace_result(uid, dict(shared_rows))
+                self.async_cache[uid]['watermark'] = dict(shared_request.get('watermark'))
+            self.log_debug('%s shares result with registered query, len: %s' % (uid, self.cache_result_len(uid)))
+            return uid
+
         if not self.sg_user:
             return uid
 
-        if perform_query:            
-            # perform actual shotgun query
-            # Cached results are stored as a dictionary with entity id as a key.
-
-            # TODO:
-            # Queries on register are performed in two separate threads each with its own
-            # shotgun connection. One thread performs full query while other perform looped
-            # queries limited by one day with days counting backwards from current one.
-            # That allows us to fill the cache faster with some recent data during
-            # long initial queries
-
-            def loong_fetch(query, uid, flag):
-                entity = query.get('entity')
-                filters = query.get('filters')
-                fields = query.get('fields')
-
-                start = time.time()
-                result = []
-                result_by_id = {}
-                
-                try:
-                    sg = self.sg_user.create_sg_connection()
-                    result = sg.find(entity, filters, fields)
-                    result_by_id = {e.get('id'):e for e in result}
-                except Exception as e:
-                    self.log_debug('error performing long fetch on register %s' % e)
+        if perform_query and cache_request.get('service_uid', False) is None:
+            # service has the query in its cache if any other
+            # session has registered it, so we subscribe right away
 
-                flag.append(True )
-                self.async_cache[uid]['result'] = result_by_id
+            sync_thread = threading.Thread(target=self.cache_service_sync, kwargs={'uids': [uid]})
+            sync_thread.daemon = True
+            sync_thread.start()
 
-                self.preformat_common_queries()
+        elif perform_query and self.cache_load_snapshot(uid):
+            # warm start: snapshot has been loaded from disk,
+            # so we only need to catch up with changes made since it has been saved
 
-                if sg: sg.close()
+            catch_up_thread = threading.Thread(target=self.cache_catch_up, args=(uid, ))
+            catch_up_thread.daemon = True
+            catch_up_thread.start()
 
-                delta = time.time() - start
-                self.log_debug('long fetch: query: %s, len: %s took %s' % (entity, len(result_by_id.keys()), delta))
+        elif perform_query:
+            # initial fetch is performed in background and rows
+            # are available in cache as soon as each shard arrives
 
-            def quick_fetch(query, uid, flag):
-                from datetime import datetime, timedelta
+            self.cache_start_initial_fetch(uid)
+        
+        return uid
 
-                entity = query.get('entity')
-                filters = query.get('filters')
-                fields = query.get('fields')
+    def cache_catch_up(self, uid):
 
-                start = time.time()
+        # brings query loaded from snapshot or adopted from
+        # retained project up to date: changed rows and deletions
 
-                '''
-                try:
-                    sg = self.sg_user.create_sg_connection()
-                    result = sg.find(entity, filters, fields, limit=99)
-                    result_by_id = {e.get('id'):e for e in result}
-                except Exception as e:
-                    self.log_debug('error performing quick_fetch query on register %s' % e)
+        try:
+            with self.sg_pool.connection() as sg:
+                self.cache_softupdate(sg = sg, uids = [uid])
+                self.cache_reconcile(sg = sg, uids = [uid])
+        except Exception as e:
+            self.log_debug('error catching up %s: %s' % (uid, e))
 
-                for entity_id in result_by_id.keys():
-                    self.async_cache[uid]['result'][entity_id] = result_by_id.get(entity_id)
+    def cache_park(self, uid):
 
-                delta = time.time() - start
-                self.log_debug('quick_fetch: query: %s, len: %s took %s' % (entity, len(result_by_id.keys()), delta))
-                '''
+        # keeps query of the project being unlinked in cache under
+        # '<uid>@<project key>' so cache_register adopts it with its result
+        # once the project is linked again. Parked queries are refreshed
+        # in background with cache_retained_budget and evicted
+        # least recently linked project first once new project
+        # queries are registered (see cache_evict_parked)
 
-                sg = None
-                result = []
-                result_by_id = {}
+        with self.cache_lock:
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                return None
+            if not (self.prefs_global.get('cache_retained_projects', 2) and cache_request.get('watermark')):
+                self.cache_unregister(uid)
+                return None
+            parked_uid = '%s@%s' % (uid, cache_request.get('project_key'))
+            self.cache_unregister(parked_uid)
+            async_cache = dict(self.async_cache)
+            del async_cache[uid]
+            async_cache[parked_uid] = cache_request
+            cache_request['parked'] = {
+                'time': time.time(),
+                'budget': cache_request.get('budget'),
+                'priority': cache_request.get('priority', 0),
+                'bytes': None
+                }
+            cache_request['budget'] = self.prefs_global.get('cache_retained_budget', 900)
+            cache_request['priority'] = -1
+            self.async_cache = async_cache
+            self.cache_metrics.forget(uid)
+        self.log_debug('retained %s as %s' % (uid, parked_uid))
+        return parked_uid
+
+    def cache_find_parked(self, key):
+        for uid, cache_request in list(self.async_cache.items()):
+            if cache_request.get('parked') and cache_request.get('key') == key:
+                return uid
+        return None
 
-                try:
-                    sg = self.sg_user.create_sg_connection()
-                except Exception as e:
-                    self.log_debug('error performing quick_fetch query on register %s' % e)
+    def cache_adopt(self, parked_uid, uid, indexes = None, budget = None, priority = 0):
 
-                day = 0
-                max_days = 99
-                while not flag:
-                    start = time.time()
+        # brings parked query back under uid with its result and indexes
 
-                    day_filters = list(filters)
-                    start_window = datetime.now() - timedelta(days=day)
-                    end_window = datetime.now() - timedelta(days=day+1)
-                    day_filters.append(['updated_at', 'between', start_window, end_window])
+        with self.cache_lock:
+            cache_request = self.async_cache.get(parked_uid)
+            if not cache_request:
+                return None
+            self.cache_unregister(uid)
+            async_cache = dict(self.async_cache)
+            del async_cache[parked_uid]
+            async_cache[uid] = cache_request
+            del cache_request['parked']
+            cache_request['budget'] = budget
+            cache_request['priority'] = priority
+            cache_request['last_used'] = time.time()
+            self.async_cache = async_cache
+            self.cache_metrics.forget(parked_uid)
+        for index_name in (indexes or {}).keys():
+            if index_name not in cache_request.get('indexes', {}).keys():
+                self.cache_add_index(uid, index_name, indexes.get(index_name))
+        self.log_debug('%s adopted retained query %s, len: %s' % (uid, parked_uid, self.cache_result_len(uid)))
+
+        if self.sg_user and not self.cache_service:
+            catch_up_thread = threading.Thread(target=self.cache_catch_up, args=(uid, ))
+            catch_up_thread.daemon = True
+            catch_up_thread.start()
+        return uid
 
-                    try:
-                        result = sg.find(entity, day_filters, fields)
-                        result_by_id = {e.get('id'):e for e in result}
-                    except Exception as e:
-                        self.log_debug('error performing quick_fetch query on register %s' % e)
+    def cache_active_uids(self):
+        return [uid for uid, cache_request in list(self.async_cache.items()) if not cache_request.get('parked')]
+
+    def cache_measure_due(self, now):
+
+        # returns uids of queries which memory is due to be measured:
+        # the ones never measured, parked ones not measured since
+        # they have been parked and the ones changed since they have been
+        # measured, at most once per cache_measure_interval seconds
+
+        interval = self.prefs_global.get('cache_measure_interval', 60)
+        due = []
+        for uid, cache_request in list(self.async_cache.items()):
+            measured = cache_request.get('measured')
+            parked = cache_request.get('parked')
+            generation = getattr(cache_request.get('result'), 'generation', 0)
+            if not measured:
+                due.append(uid)
+            elif parked and parked.get('bytes') is None:
+                due.append(uid)
+            elif measured.get('generation') != generation and (now - measured.get('time', 0)) >= interval:
+                due.append(uid)
+        return due
+
+    def cache_measure_queries(self, now = None):
+
+        # memory used by cached rows is measured in background so metrics
+        # report does not walk the cache on UI thread. Parked queries
+        # are then checked against cache_retained_memory.
+        # Every query is measured on its own, objects it shares with
+        # other queries (links, strings, layouts) are counted for each
+
+        if now is None:
+            now = time.time()
+        measured_uids = []
+        for uid in self.cache_measure_due(now):
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                continue
+            result_by_id = cache_request.get('result') or {}
+            cache_request['measured'] = {
+                'generation': getattr(result_by_id, 'generation', 0),
+                'bytes': self.cache_memory_report(uids = [uid]).get(uid, {}).get('bytes', 0),
+                'time': now
+                }
+            parked = cache_request.get('parked')
+            if parked and parked.get('bytes') is None:
+                parked['bytes'] = cache_request['measured']['bytes']
+            measured_uids.append(uid)
+        self.cache_evict_parked()
+        return measured_uids
+
+    def cache_evict_parked(self):
+
+        # keeps parked queries of cache_retained_projects most recently
+        # unlinked projects as long as they fit in cache_retained_memory
+
+        projects = {}
+        for uid, cache_request in list(self.async_cache.items()):
+            parked = cache_request.get('parked')
+            if not parked:
+                continue
+            project = projects.setdefault(cache_request.get('project_key'), {'time': 0, 'bytes': 0, 'uids': []})
+            project['time'] = max(project['time'], parked.get('time', 0))
+            project['bytes'] += parked.get('bytes') or 0
+            project['uids'].append(uid)
+
+        retained = self.prefs_global.get('cache_retained_projects', 2)
+        budget = self.prefs_global.get('cache_retained_memory', 512) * 1048576
+        total = 0
+        evicted = []
+        for index, project in enumerate(sorted(projects.values(), key = lambda project: -project['time'])):
+            total += project['bytes']
+            if index >= retained or total > budget:
+                for uid in project['uids']:
+                    self.cache_unregister(uid)
+                    evicted.append(uid)
+        if evicted:
+            self.log_debug('evicted retained queries: %s' % ', '.join(evicted))
+        return evicted
+
+    def cache_start_initial_fetch(self, uid):
+
+        # initial fetch runs in its own thread, one per query at a time.
+        # If it fails query stays without watermark and the scheduler
+        # tries again in 5 seconds, backing off up to a minute
+
+        cache_request = self.async_cache.get(uid)
+        if not cache_request:
+            return False
+        with self.cache_lock:
+            if cache_request.get('fetching'):
+                return False
+            cache_request['fetching'] = True
 
-                    for entity_id in result_by_id.keys():
-                        self.async_cache[uid]['result'][entity_id] = result_by_id.get(entity_id)
+        def fetch(batch_name):
+            try:
+                fetched = self.cache_initial_fetch(uid, batch_name)
+            except Exception as e:
+                self.log_debug('error performing initial fetch for %s: %s' % (uid, e))
+                fetched = False
+            with self.cache_lock:
+                cache_request['fetching'] = False
+                if cache_request.get('watermark'):
+                    cache_request.pop('fetch_failures', None)
+                    cache_request.pop('fetch_retry', None)
+                elif not fetched:
+                    failures = cache_request.get('fetch_failures', 0) + 1
+                    cache_request['fetch_failures'] = failures
+                    cache_request['fetch_retry'] = time.time() + min(60, 5 * 2 ** (failures - 1))
+                    self.log_debug('initial fetch for %s has failed %s times, retrying in %s sec' % (
+                        uid, failures, int(cache_request['fetch_retry'] - time.time())))
+
+        fetch_thread = threading.Thread(target=fetch, args=(self.flame_batch_name(), ))
+        fetch_thread.daemon = True
+        fetch_thread.start()
+        return True
 
-                    self.preformat_common_queries()
+    def cache_initial_fetch(self, uid, batch_name = None):
+
+        # Query is split into id-range shards fetched concurrently with
+        # pooled connections. Rows linked to the entity named after current
+        # batch group and tasks assigned to current user are fetched first
+        # in their own small shards along with the id range of the query.
+        # Every shard is fetched page by page and merged into cache every
+        # cache_publish_pages pages, so menus see first rows as soon as
+        # they arrive. Watermark is set only once all shards are complete
+        # so delta sync does not start with partial result, and it is
+        # limited to fetch mark taken along with id range (see cache_watermark).
+        # Priority shards could read a few rows before the mark is taken,
+        # changes that land in between are within delta sync overlap window
+
+        cache_request = self.async_cache.get(uid)
+        if not cache_request:
+            return False
 
-                    delta = time.time() - start
-                    self.log_debug('quick_fetch for day %s: query: %s, len: %s took %s' % (abs(day), entity, len(result_by_id.keys()), delta))
+        query = cache_request.get('query')
+        entity = query.get('entity')
+        filters = list(query.get('filters', []))
+        fields = self.cache_query_fields(query)
 
-                    day += 1
-                    if day > max_days:
-                        break
+        start = time.time()
+        fetched = {'rows': 0, 'watermark': None}
+        fetched_lock = threading.Lock()
+        publish_pages = max(1, self.prefs_global.get('cache_publish_pages', 4))
 
-                if sg: sg.close()
+        def publish(result_by_id):
+            with fetched_lock:
+                fetched['rows'] += len(result_by_id.keys())
+                fetched['watermark'] = self.cache_watermark(result_by_id, fetched['watermark'])
 
-            flag = []
-            quick_fetch_thread = threading.Thread(target=quick_fetch, args=(query, uid, flag, ))
-            loong_fetch_thread = threading.Thread(target=loong_fetch, args=(query, uid, flag, ))
-            quick_fetch_thread.daemon = True
-            loong_fetch_thread.daemon = True
-            
-            quick_fetch_thread.start()
-            loong_fetch_thread.start()
-        
-        return uid
+            # query could have been unregistered or registered again
+            # under the same uid while we were waiting for shotgun
+
+            if self.async_cache.get(uid) is cache_request:
+                self.cache_merge_result(uid, result_by_id, advance_watermark = False)
+
+        def fetch_shard(shard_filters, sg):
+            rows = 0
+            result_by_id = {}
+            for page_index, page in enumerate(self.cache_find_paged(sg, entity, filters + shard_filters, fields)):
+                result_by_id.update(page)
+                rows += len(page.keys())
+                if (page_index + 1) % publish_pages == 0:
+                    publish(result_by_id)
+                    result_by_id = {}
+            if result_by_id:
+                publish(result_by_id)
+            return rows
+
+        def id_bound(direction, sg):
+            row = sg.find_one(entity, filters, ['id'], order = [{'field_name': 'id', 'direction': direction}])
+            return row.get('id') if row else 0
+
+        def fetch_mark(argument, sg):
+            return self.cache_fetch_mark(sg, entity, filters)
+
+        def run_job(job, sg):
+            function, argument = job
+            return function(argument, sg)
+
+        jobs = [(id_bound, 'asc'), (id_bound, 'desc'), (fetch_mark, None)]
+        for priority_filters in self.cache_priority_filters(query, batch_name):
+            jobs.append((fetch_shard, priority_filters))
+        results = self.cache_run_queries(run_job, jobs, kind = 'initial', uids = [uid])
+        min_id, max_id = results[0], results[1]
+
+        # with no mark watermark is left without 'updated_at'
+        # and delta sync looks back an hour
+
+        mark = results[2] or {'updated_at': None}
+
+        if min_id is None or max_id is None:
+            shards = [[]]
+        elif not (min_id or max_id):
+            shards = []
+        else:
+            shards = self.cache_id_shards(min_id, max_id)
+
+        results = self.cache_run_queries(fetch_shard, shards, kind = 'initial', uids = [uid])
+        if None in results:
+            # some of the shards have failed, hard update would fix it later
+            # but it is worth to try once again with a single query
+            try:
+                with self.sg_pool.connection() as sg:
+                    fetch_shard([], sg)
+            except Exception as e:
+                self.log_debug('error performing initial fetch for %s: %s' % (uid, e))
+                return False
+
+        with self.cache_lock:
+            if self.async_cache.get(uid) is not cache_request:
+                return False
+            cache_request['watermark'] = self.cache_watermark({}, fetched['watermark'], fetch_mark = mark)
+            self.cache_mark_complete(cache_request)
+
+        self.log_debug('initial fetch: query: %s, shards: %s, len: %s took %s' % (entity, len(shards), fetched['rows'], time.time() - start))
+        return True
+
+    def cache_find_paged(self, sg, entity, filters, fields, page_size = None):
+
+        # yields result of the query page by page as dictionaries by id.
+        # Pages are keyed on id rather than on page number so rows created
+        # or deleted while paging do not shift pages and are never skipped.
+        # Every page list is dropped once it has been turned into dictionary
+
+        if not page_size:
+            page_size = max(1, self.prefs_global.get('cache_page_size', 500))
+        last_id = None
+        while True:
+            page_filters = list(filters)
+            if last_id is not None:
+                page_filters.append(['id', 'greater_than', last_id])
+            page = sg.find(
+                entity,
+                page_filters,
+                fields,
+                order = [{'field_name': 'id', 'direction': 'asc'}],
+                limit = page_size
+            )
+            if not page:
+                return
+            last_id = page[-1].get('id')
+            complete = len(page) < page_size
+            page = {e.get('id'):e for e in page}
+            yield page
+            if complete:
+                return
+
+    def cache_id_shards(self, min_id, max_id):
+
+        # splits id range into filters for concurrent fetch.
+        # most recent ids come first as they are more likely
+        # to be the ones users are working on
+
+        min_shard_size = 500
+        shard_count = max(1, self.prefs_global.get('cache_initial_shards', 8))
+        shard_size = max(min_shard_size, (max_id - min_id + shard_count) // shard_count)
+
+        shards = []
+        high = max_id
+        while high >= min_id:
+            low = max(min_id, high - shard_size + 1)
+            shards.append([['id', 'between', low, high]])
+            high = low - 1
+        return shards
+
+    def cache_priority_filters(self, query, batch_name = None):
+
+        # returns filters for shards to be fetched before the rest of the query.
+        # Entity named after batch group is linked by id once current tasks
+        # know it (see cache_find_entity), by name of any type rows
+        # can be linked to before that
+
+        priority = []
+        link_field = self.cache_link_field(query)
+        if batch_name and link_field:
+            entity = self.cache_find_entity(batch_name)
+            if entity:
+                priority.append([[link_field, 'is', {'type': entity.get('type'), 'id': entity.get('id')}]])
+            else:
+                priority.append([{
+                    'filter_operator': 'any',
+                    'filters': [
+                        [link_field + '.' + entity_type + '.' + self.cache_entity_name_field(entity_type), 'is', batch_name]
+                        for entity_type in self.cache_linked_entity_types()
+                    ]}])
+
+        if query.get('entity') == 'Task' and self.sg_human_user:
+            priority.append([['task_assignees', 'is', {'type': 'HumanUser', 'id': self.sg_human_user.get('id')}]])
+
+        return priority
+
+    def cache_link_field(self, query):
+
+        # returns field linking rows of the query to shot or asset, if any
+
+        fields = query.get('fields', [])
+        if 'entity' in fields:
+            return 'entity'
+        for field in fields:
+            if field.endswith('.entity'):
+                return field
+        return None
+
+    def cache_focus_entity(self, entity):
+        return bool(self.cache_focus_entities([entity]))
+
+    def cache_focus_entities(self, entities):
+
+        # puts shots or assets artist works on (the one named after current
+        # batch group or added to batch loader) in focus: their rows of
+        # registered queries are fetched right away with small dedicated
+        # queries and then refreshed every cache_focus_budget seconds,
+        # more often than the rest of the project.
+        # Only cache_focus_entities most recently focused entities are kept,
+        # and only for cache_focus_expire seconds since menus last focused them.
+        # At most cache_focus_entities of given entities are taken so menus
+        # listing more of them do not push each other out of focus on
+        # every build, and entities fetched within cache_focus_expire
+        # seconds are not fetched again when they come back to focus.
+        # Returns keys of entities being fetched
+
+        max_entities = max(1, self.prefs_global.get('cache_focus_entities', 8))
+        expire = self.prefs_global.get('cache_focus_expire', 900)
+        keys = []
+        for entity in entities:
+            if not (entity and entity.get('type') and entity.get('id')):
+                continue
+            key = (entity.get('type'), entity.get('id'))
+            if key not in keys:
+                keys.append(key)
+        keys = keys[:max_entities]
+        if not keys:
+            return []
+
+        now = time.time()
+        fetch_keys = []
+        with self.cache_lock:
+            focus = dict(self.cache_focus)
+            for key in keys:
+                focused = focus.get(key)
+                if focused:
+                    focused['last_used'] = now
+                    continue
+                fetched = self.cache_focus_fetched.get(key)
+                if fetched is None or (expire and (now - fetched) > expire):
+                    fetch_keys.append(key)
+                    fetched = None
+                focus[key] = {
+                    'entity': {'type': key[0], 'id': key[1]},
+                    'last_used': now,
+                    'last_refresh': fetched
+                    }
+            for old_key in sorted(focus.keys(), key = lambda k: focus[k].get('last_used'))[:-max_entities]:
+                del focus[old_key]
+            self.cache_focus = focus
+
+        # sessions connected to cache service get rows from the service
+
+        if fetch_keys and not self.cache_service:
+            focus_thread = threading.Thread(target=self.cache_refresh_focus, kwargs={'keys': fetch_keys})
+            focus_thread.daemon = True
+            focus_thread.start()
+        return fetch_keys
+
+    def cache_refresh_focus(self, now = None, keys = None):
+
+        # fetches rows linked to entities in focus that are due, or to
+        # given keys, and merges changed ones into every registered query
+        # that has link field. Watermarks are not advanced as the rest
+        # of the query could be behind. Deleted rows are left to reconcile.
+        # Focus budget backs off the same way query budgets do once
+        # menus stop using entity, expired entities leave focus.
+        # In events mode event log already brings every query up
+        # to date each tick so focused entities are not polled
+
+        if now is None:
+            now = time.time()
+        if keys is None:
+            self.cache_expire_focus(now)
+            if self.prefs_global.get('cache_refresh_mode') == 'events':
+                return []
+        budget = self.prefs_global.get('cache_focus_budget', 2)
+        due = []
+        for key, focused in list(self.cache_focus.items()):
+            if keys is not None:
+                if key in keys:
+                    due.append(focused)
+            elif (now - (focused.get('last_refresh') or 0)) >= budget * max(1, self.cache_idle_multiplier(focused.get('last_used', 0), now)):
+                due.append(focused)
+        if not due:
+            return []
+
+        with self.cache_lock:
+            for focused in due:
+                focused['last_refresh'] = now
+                entity = focused.get('entity')
+                self.cache_focus_fetched[(entity.get('type'), entity.get('id'))] = now
+        return self.cache_fetch_linked([focused.get('entity') for focused in due], kind = 'focus')
+
+    def cache_expire_focus(self, now):
+        expire = self.prefs_global.get('cache_focus_expire', 900)
+        if not expire:
+            return []
+        with self.cache_lock:
+            expired = [key for key, focused in self.cache_focus.items() if (now - focused.get('last_used', 0)) > expire]
+            for key, fetched in list(self.cache_focus_fetched.items()):
+                if (now - fetched) > expire:
+                    del self.cache_focus_fetched[key]
+            if expired:
+                focus = dict(self.cache_focus)
+                for key in expired:
+                    del focus[key]
+                self.cache_focus = focus
+        if expired:
+            self.log_debug('entities left focus: %s' % expired)
+        return expired
+
+    def cache_fetch_linked(self, entities, kind = None):
+
+        # fetches rows linked to given shots or assets with small dedicated
+        # queries and merges changed ones into every registered query that
+        # has link field. Watermarks are not advanced as the rest
+        # of the query could be behind. Deleted rows are left to reconcile.
+        # Returns uids of queries that have changed
+
+        items = []
+        for query, group_uids in self.cache_query_groups(self.cache_active_uids()):
+            link_field = self.cache_link_field(query)
+            if not link_field:
+                continue
+            for entity in entities:
+                items.append((query, group_uids, link_field, entity))
+        if not items:
+            return []
+
+        def linked_fetch(item, sg):
+            query, group_uids, link_field, entity = item
+            linked_filters = list(query.get('filters', []))
+            linked_filters.append([link_field, 'is', entity])
+            result = sg.find(query.get('entity'), linked_filters, self.cache_query_fields(query))
+            return {e.get('id'):e for e in result}
+
+        generations = self.cache_generations()
+        results = self.cache_run_queries(linked_fetch, items, kind = kind)
+
+        for (query, group_uids, link_field, entity), result_by_id in zip(items, results):
+            if result_by_id is None:
+                continue
+            for uid in group_uids:
+                self.cache_merge_planned(uid, query, result_by_id, advance_watermark = False)
+        return self.cache_changed_since(generations)
+
+    def sg_create(self, entity_type, data, refresh_links = None):
+
+        # creates entity and writes it through to the cache so menus
+        # see it right away (see cache_write_through). Fields registered
+        # queries need are returned by create itself.
+        # refresh_links are fields of data linking to entities that
+        # change along with this one, i.e. 'version' of PublishedFile
+        # gets it in its 'published_files'
+
+        return_fields = [field for field in self.cache_write_fields(entity_type) if field not in data.keys()]
+        if return_fields:
+            entity = self.sg.create(entity_type, data, return_fields = return_fields)
+        else:
+            entity = self.sg.create(entity_type, data)
+        self.cache_write_through(entity_type, [entity], self.cache_data_links(data, refresh_links),
+            linked_rows = 'task_template' in data.keys())
+        return entity
+
+    def sg_update(self, entity_type, entity_id, data, refresh_links = None):
+
+        # updates entity and writes it through to the cache
+
+        entity = self.sg.update(entity_type, entity_id, data)
+        written = dict(entity or {})
+        written.update({'type': entity_type, 'id': entity_id})
+        self.cache_write_through(entity_type, [written], self.cache_data_links(data, refresh_links))
+        return entity
+
+    def cache_data_links(self, data, fields):
+        links = []
+        for field in (fields or []):
+            link = data.get(field)
+            if isinstance(link, dict) and link.get('type') and link.get('id'):
+                links.append({'type': link.get('type'), 'id': link.get('id')})
+        return links
+
+    def cache_write_fields(self, entity_type):
+
+        # returns fields and filter fields of registered queries
+        # on entity type, the ones written rows need to be cached
+
+        fields = []
+        for query, group_uids in self.cache_query_groups(self.cache_active_uids()):
+            if query.get('entity') != entity_type:
+                continue
+            for field in self.cache_query_fields(query) + self.cache_filter_fields(query.get('filters', [])):
+                if field not in fields:
+                    fields.append(field)
+        return fields
+
+    def cache_write_through(self, entity_type, entities, links = None, linked_rows = False):
+
+        # writes entities created or updated by the plugin, as returned
+        # by shotgun, through to every registered query on their entity type
+        # so there is no need to wait for the next refresh. It is called
+        # from the UI thread so no requests are made here: written fields
+        # are merged into cached rows and rows are kept or dropped by query
+        # filters that can be evaluated on them (see cache_write_rows).
+        # Written entities are re-read, entities given in links refreshed and
+        # rows created along with entity on the server (i.e. tasks from
+        # task template of a new shot) fetched by scheduler afterwards,
+        # see cache_write_follow_up.
+        # Errors are logged only, the write itself has been made.
+        # Returns uids of queries that have changed
+
+        entities = [entity for entity in entities if entity and entity.get('id')]
+        changed = []
+        try:
+            generations = self.cache_generations()
+            for uid in self.cache_active_uids():
+                cache_request = self.async_cache.get(uid)
+                if not (cache_request and cache_request.get('query', {}).get('entity') == entity_type):
+                    continue
+                rows, stale_ids = self.cache_write_rows(cache_request, entities)
+                if rows:
+                    self.cache_merge_result(uid, rows, advance_watermark = False)
+                if stale_ids:
+                    self.cache_remove_ids(uid, stale_ids)
+            changed = self.cache_changed_since(generations)
+        except Exception as e:
+            self.log_debug('error writing %s %s through to cache: %s' % (entity_type, [entity.get('id') for entity in entities], e))
+
+        with self.cache_lock:
+            self.cache_write_pending.append({
+                'entity_type': entity_type,
+                'entity_ids': [entity.get('id') for entity in entities],
+                'links': list(links or []),
+                'linked_rows': linked_rows
+                })
+        self.cache_refresh_wakeup.set()
+
+        if changed:
+            self.log_debug('%s %s written through to %s' % (entity_type, [entity.get('id') for entity in entities], ', '.join(changed)))
+            self.cache_schedule_rescan()
+        return changed
+
+    def cache_write_rows(self, cache_request, entities):
+
+        # returns (rows by id, stale ids) written entities make of cached
+        # result. Written fields are merged into cached rows. Rows that no
+        # longer match query filters are stale, filters are only evaluated
+        # if they can be on cached rows and written fields.
+        # New rows are added once they match and carry every field
+        # the query asks for, the rest are left to re-read
+
+        query = cache_request.get('query')
+        fields = self.cache_query_fields(query)
+        filters = query.get('filters', [])
+        local = all(self.cache_local_filter(query_filter) for query_filter in filters)
+        filter_fields = self.cache_filter_fields(filters)
+        result_by_id = cache_request.get('result') or {}
+
+        rows = {}
+        stale_ids = []
+        for entity in entities:
+            entity_id = entity.get('id')
+            cached_row = result_by_id.get(entity_id)
+            row = dict(cached_row or {})
+            row.update({'type': entity.get('type'), 'id': entity_id})
+            for field in fields:
+                if field in entity.keys():
+                    row[field] = entity.get(field)
+            written = dict(row)
+            written.update(entity)
+            matches = None
+            if local and all(field in written.keys() for field in filter_fields):
+                matches = all(self.cache_match_filter(written, query_filter) for query_filter in filters)
+            if matches is False:
+                if cached_row is not None:
+                    stale_ids.append(entity_id)
+            elif cached_row is not None:
+                rows[entity_id] = row
+            elif matches and all(field in row.keys() for field in fields):
+                rows[entity_id] = row
+        return (rows, stale_ids)
+
+    def cache_write_follow_up(self):
+
+        # re-reads entities written through to the cache with every
+        # registered query on their entity type along with entities given
+        # in their links, and fetches rows created along with them on the
+        # server with cache_fetch_linked. Runs on scheduler thread so UI
+        # thread that has made the write does not wait for shotgun.
+        # Written rows missing from re-read are removed from the cache.
+        # Returns uids of queries that have changed
+
+        with self.cache_lock:
+            pending = self.cache_write_pending
+            self.cache_write_pending = []
+        if not pending:
+            return []
+
+        ids_by_type = {}
+        linked_entities = []
+        for write in pending:
+            written = [{'type': write.get('entity_type'), 'id': entity_id} for entity_id in write.get('entity_ids')]
+            for entity in written + write.get('links'):
+                ids_by_type.setdefault(entity.get('type'), [])
+                if entity.get('id') not in ids_by_type[entity.get('type')]:
+                    ids_by_type[entity.get('type')].append(entity.get('id'))
+            if write.get('linked_rows'):
+                linked_entities.extend(written)
+
+        items = []
+        for query, group_uids in self.cache_query_groups(self.cache_active_uids()):
+            ids = ids_by_type.get(query.get('entity'))
+            if ids:
+                items.append((query, group_uids, ids))
+
+        def reread(item, sg):
+            query, group_uids, ids = item
+            write_filters = list(query.get('filters', []))
+            write_filters.append(['id', 'in', ids])
+            result = sg.find(query.get('entity'), write_filters, self.cache_query_fields(query))
+            return {e.get('id'):e for e in result}
+
+        generations = self.cache_generations()
+        results = self.cache_run_queries(reread, items, kind = 'write')
+        for (query, group_uids, ids), result_by_id in zip(items, results):
+            if result_by_id is None:
+                continue
+            missing_ids = [entity_id for entity_id in ids if entity_id not in result_by_id]
+            for uid in group_uids:
+                self.cache_merge_planned(uid, query, result_by_id, advance_watermark = False, missing_ids = missing_ids)
+        if linked_entities:
+            self.cache_fetch_linked(linked_entities, kind = 'write')
+        changed = self.cache_changed_since(generations)
+
+        if changed:
+            self.log_debug('written entities re-read into %s' % ', '.join(changed))
+            self.cache_schedule_rescan()
+        return changed
+
+    def flame_batch_name(self):
+        try:
+            import flame
+            return flame.batch.name.get_value()
+        except:
+            return None
     
     def cache_unregister(self, uid):
         if not uid:
             return False            
-        if uid in self.async_cache.keys():
-            del self.async_cache[uid]
-            return True
-        else:
-            return False
+        with self.cache_lock:
+            if uid in self.async_cache.keys():
+                async_cache = dict(self.async_cache)
+                cache_request = async_cache.pop(uid)
+                self.async_cache = async_cache
+                self.cache_metrics.forget(uid)
+                self.cache_interner.stale = True
+                if cache_request.get('service_uid'):
+                    self.cache_service_released.append(cache_request.get('service_uid'))
+                return True
+            else:
+                return False
 
     def cache_retrive_result(self, uid, perform_query = False, sg = None):
         
         # Cached results are stored as a dictionary with entity id as a key.
         # cache_retrive_result unpacks it back to the list of dictionaries to match the
         # standart Shotgun's find() result. Returned list is currently always 
-        # sorted form lower to higher id
+        # sorted form lower to higher id.
+        # The list is built once per cache entry generation and shared
+        # between callers so it should be treated as read-only
 
         if not uid in self.async_cache.keys():
             return False
         query = self.async_cache.get(uid)
         if not query:
             return False
+        query['last_used'] = time.time()
+        self.cache_metrics.hit(uid)
 
         # use main thread shotgun connection if not given
 
@@ -1038,7 +3329,7 @@ class flameShotgunConnector(object):
             current_result = []
             current_result_by_id = {}
             try:
-                current_result = sg.find(entity, filters, fields)
+                current_result = sg.find(entity, filters, self.cache_query_fields(query_body))
             except Exception as e:
                 self.log_debug('error performing query on cache_retrive_result %s' % e)
             
@@ -1049,264 +3340,1815 @@ class flameShotgunConnector(object):
                     self.log_debug('error grouping shotgun query result by uid in cache_retrive_result: %s' % e)
 
             if current_result_by_id:
-                self.async_cache[uid]['result'] = current_result_by_id
+                self.cache_replace_result(uid, current_result_by_id)
                 return current_result
 
-        query = self.async_cache.get(uid)
-        result = []
-        if query:
-            result_by_id = query.get('result')
-            if result_by_id and isinstance(result_by_id, dict):
-                for entity_uid in sorted(result_by_id.keys()):
-                    result.append(result_by_id.get(entity_uid))
+        return self.cache_materialize(uid)
+
+    def cache_materialize(self, uid):
+
+        # returns result as a list sorted by id.
+        # Result dictionaries are never changed once published so
+        # the list is memoized against the dictionary itself and
+        # can be built without taking the lock
+
+        cache_request = self.async_cache.get(uid)
+        if not cache_request:
+            return []
+        result_by_id = cache_request.get('result')
+        materialized = cache_request.get('materialized')
+        if materialized and materialized[0] is result_by_id:
+            return materialized[1]
+
+        result = []
+        if result_by_id:
+            for entity_uid in sorted(result_by_id.keys()):
+                result.append(result_by_id.get(entity_uid))
+        cache_request['materialized'] = (result_by_id, result)
+        return result
+
+    def cache_columns(self, uid):
+
+        # returns columnar view of cached result (see flameCacheColumns).
+        # The view is memoized against the result like sorted list
+
+        cache_request = self.async_cache.get(uid)
+        if not cache_request:
+            return flameCacheColumns({})
+        result_by_id = cache_request.get('result') or {}
+        columns = cache_request.get('columns')
+        if columns and columns[0] is result_by_id:
+            return columns[1]
+        columns = flameCacheColumns(result_by_id)
+        cache_request['columns'] = (result_by_id, columns)
+        return columns
+
+    def cache_warm_columns(self):
+
+        # rebuilds columnar views menus have used once their results
+        # have changed, so menus do not build them on UI thread
+
+        warmed = []
+        for uid, cache_request in list(self.async_cache.items()):
+            columns = cache_request.get('columns')
+            result_by_id = cache_request.get('result') or {}
+            if not columns or columns[0] is result_by_id:
+                continue
+            cache_request['columns'] = (result_by_id, columns[1].rebuilt(result_by_id))
+            warmed.append(uid)
+        return warmed
+
+    def cache_iter_result(self, uid):
+
+        # iterates over cached rows of published result itself, so no list
+        # is built. Rows come in no particular order, use cache_materialize
+        # for rows sorted by id. Published results are never changed,
+        # rows changed while iterating are picked up with the next call
+
+        cache_request = self.async_cache.get(uid)
+        if not cache_request:
+            return
+        result_by_id = cache_request.get('result') or {}
+        for entity_id in result_by_id:
+            yield result_by_id.get(entity_id)
+
+    def cache_result_len(self, uid):
+        cache_request = self.async_cache.get(uid)
+        if not cache_request:
+            return 0
+        return len(cache_request.get('result', {}))
+
+    def cache_generation(self, uid):
+
+        # generation is increased every time entry result changes
+        # and can be used by callers to memoize anything built on top of it
+
+        cache_request = self.async_cache.get(uid)
+        if not cache_request:
+            return None
+        return getattr(cache_request.get('result'), 'generation', 0)
+
+    def cache_clear(self):
+        with self.cache_lock:
+            self.async_cache = {}
+            self.cache_interner.clear()
+        return True
+    
+    def register_common_queries(self):
+        self.unregister_common_queries()
+
+        if not self.connector.sg_linked_project_id:
+            return False
+                        
+        self.current_project_uid = self.connector.cache_register({
+            'entity': 'Project',
+            'filters': [['id', 'is', self.connector.sg_linked_project_id]],
+            'fields': [
+            ]
+        }, uid = 'current_project', budget = 300)
+
+        self.current_tasks_uid = self.connector.cache_register(self.cache_scope_query('current_tasks', {
+            'entity': 'Task',
+            'filters': [['project.Project.id', 'is', self.connector.sg_linked_project_id]],
+            'fields': [
+                'content',
+                'step.Step.code',
+                'step.Step.short_name',
+                'step.Step.id',
+                'sg_sort_order',
+                'task_assignees',
+                'project.Project.id',
+                'entity',
+                'entity.Asset.sg_asset_type',
+                'entity.Shot.sg_sequence'
+            ]
+        }, required = ['content', 'entity', 'task_assignees', 'step.Step.id', 'step.Step.code', 'step.Step.short_name']), uid = 'current_tasks', indexes = {
+            'by_entity': self.cache_link_key('entity'),
+            'by_entity_name': self.cache_link_name_key('entity'),
+            'by_assignee': self.cache_multi_link_key('task_assignees')
+            }, priority = 2)
+
+        self.current_versions_uid = self.connector.cache_register(self.cache_scope_query('current_versions', {
+            'entity': 'Version',
+            'filters': [['project.Project.id', 'is', self.connector.sg_linked_project_id]],
+            'fields': [
+                'code',
+                'sg_task.Task.id',
+                'entity',
+                'published_files'
+            ]
+        }, required = ['code', 'entity', 'sg_task.Task.id', 'published_files']), uid = 'current_versions', indexes = {'by_entity': self.cache_link_key('entity')}, priority = 1)
+
+        self.current_pbfiles_uid = self.connector.cache_register(self.cache_scope_query('current_pbfiles', {
+            'entity': 'PublishedFile',
+            'filters': [['project.Project.id', 'is', self.connector.sg_linked_project_id]],
+            'fields': [
+                'name',
+                'created_at',
+            #    'sg_colourspace',
+            #    'sg_image_file_type',
+                'published_file_type',
+                'path_cache',
+                'path_cache_storage',
+            #    'path',
+            #    'project.Project.id',
+            #    'project.Project.name',
+            #    'project.Project.tank_name',
+            #    'project.Project.sg_status',
+            #    'sg_source_location',
+                'task.Task.id',
+                'task.Task.entity',
+            #    'task.Task.content',
+            #    'task.Task.entity.Entity.type',
+            #    'task.Task.step.Step.id',
+            #    'task.Task.step.Step.code',
+            #    'task.Task.step.Step.short_name',
+                'version.Version.id',
+                'version.Version.code',
+            #    'version.Version.name',
+                'version_number',
+                'version.Version.sg_status_list'
+            ]
+        }, required = [
+            'name',
+            'created_at',
+            'published_file_type',
+            'path_cache',
+            'path_cache_storage',
+            'task.Task.id',
+            'task.Task.entity',
+            'version.Version.id',
+            'version.Version.code',
+            'version_number'
+        ]), uid = 'current_pbfiles', indexes = {'by_entity': self.cache_link_key('task.Task.entity')}, priority = 1)
+
+        self.current_steps_uid = self.connector.cache_register({
+            'entity': 'Step',
+            'filters': [],
+            'fields': [
+                'code',
+                'list_order',
+                'short_name',
+                'entity_type'
+            ]
+        }, uid = 'current_steps', budget = 600)
+
+        # queries of previously linked project have been adopted by now,
+        # so it is safe to drop ones beyond cache_retained_projects
+        self.connector.cache_evict_parked()
+
+    def cache_scope_query(self, uid, query, required = None):
+
+        # applies site scoping from cache_query_scope prefs to common query.
+        # Status and date filters are relative ('in_last') so the query
+        # and its snapshot key stay the same between sessions.
+        # required fields (the ones menus and indexes rely on)
+        # are fetched whatever the fields setting is, so fields
+        # setting can only trim optional ones or add new ones
+
+        self.cache_scope_defaults[uid] = query
+        scope = self.prefs_global.get('cache_query_scope', {}).get(uid)
+        if not scope:
+            return query
+
+        filters = list(query.get('filters', []))
+        if scope.get('exclude_statuses'):
+            filters.append(['sg_status_list', 'not_in', list(scope.get('exclude_statuses'))])
+        if scope.get('updated_within'):
+            filters.append(['updated_at', 'in_last', int(scope.get('updated_within')), 'DAY'])
+        link_field = self.cache_link_field(query)
+        entity_types = list(scope.get('entity_types') or [])
+        if entity_types and link_field:
+            filters.append({
+                'filter_operator': 'any',
+                'filters': [[link_field, 'type_is', entity_type] for entity_type in entity_types]
+                })
+
+        fields = list(query.get('fields', []))
+        if scope.get('fields'):
+            fields = list(scope.get('fields'))
+            for field in (required or []):
+                if field not in fields:
+                    fields.append(field)
+
+        scoped_query = dict(query)
+        scoped_query['filters'] = filters
+        scoped_query['fields'] = fields
+        return scoped_query
+
+    def cache_scope_report(self, sample_size = 200):
+
+        # rows and bytes of scoped common queries against their defaults.
+        # Default rows are counted with id-only query, bytes are estimated
+        # from a sample of the most recent default rows measured with
+        # default and with scoped fields. Sample is fetched with both
+        # so fields added by scope are measured as well.
+        # Pages through every default row, should not run on UI thread
+
+        report = {}
+        for uid, default_query in sorted(self.cache_scope_defaults.items()):
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                continue
+            query = cache_request.get('query')
+            entity = default_query.get('entity')
+            default_fields = self.cache_query_fields(default_query)
+            fields = self.cache_query_fields(query)
+            sample_fields = default_fields + [field for field in fields if field not in default_fields]
+            try:
+                with self.sg_pool.connection() as sg:
+                    default_rows = 0
+                    for page in self.cache_find_paged(sg, entity, default_query.get('filters', []), ['id']):
+                        default_rows += len(page.keys())
+                    sample = sg.find(entity, default_query.get('filters', []), sample_fields,
+                        order = [{'field_name': 'id', 'direction': 'desc'}],
+                        limit = sample_size)
+            except Exception as e:
+                self.log_debug('error building scope report for %s: %s' % (uid, e))
+                continue
+
+            def row_bytes(rows, row_fields):
+                if not rows:
+                    return 0
+                projected = {}
+                for row in rows:
+                    projected[row.get('id')] = dict((k, v) for k, v in row.items() if k in row_fields or k in ('type', 'id'))
+                return self.cache_size_of(self.cache_compact(projected), set()) / float(len(rows))
+
+            rows = self.cache_result_len(uid)
+            default_bytes = int(default_rows * row_bytes(sample, default_fields))
+            scoped_bytes = int(rows * row_bytes(sample, fields))
+            report[uid] = {
+                'entity': entity,
+                'rows': rows,
+                'default_rows': default_rows,
+                'saved_rows': default_rows - rows,
+                'bytes': scoped_bytes,
+                'default_bytes': default_bytes,
+                'saved_bytes': default_bytes - scoped_bytes,
+                'fields': len(query.get('fields', [])),
+                'default_fields': len(default_query.get('fields', []))
+            }
+        return report
+
+    def cache_scope_report_start(self):
+
+        # builds scope report text in background thread. Once it is done
+        # cache_scope_status has 'running' cleared and 'text' set
+
+        with self.cache_lock:
+            if self.cache_scope_status.get('running'):
+                return False
+            self.cache_scope_status = {'running': True, 'text': None}
+
+        def build_report():
+            try:
+                text = self.cache_scope_text()
+            except Exception as e:
+                text = 'error building scope report: %s' % e
+            self.cache_scope_status = {'running': False, 'text': text}
+
+        report_thread = threading.Thread(target=build_report)
+        report_thread.daemon = True
+        report_thread.start()
+        return True
+
+    def cache_scope_text(self, report = None):
+
+        # plain text table of cache_scope_report
+
+        if report is None:
+            report = self.cache_scope_report()
+
+        lines = ['%-16s %-14s %9s %9s %9s %9s %9s %9s' % ('query', 'entity', 'rows', 'default', 'saved', 'Mb', 'default', 'saved')]
+        saved_bytes = 0
+        for uid in sorted(report.keys()):
+            query = report[uid]
+            saved_bytes += query['saved_bytes']
+            lines.append('%-16s %-14s %9s %9s %9s %9.1f %9.1f %9.1f' % (
+                uid,
+                query['entity'],
+                query['rows'],
+                query['default_rows'],
+                query['saved_rows'],
+                query['bytes'] / 1048576.0,
+                query['default_bytes'] / 1048576.0,
+                query['saved_bytes'] / 1048576.0))
+        lines.append('total saved: %.1f Mb' % (saved_bytes / 1048576.0))
+        return '\n'.join(lines)
+
+    def unregister_common_queries(self, retain = True):
+        # un-registers async cache requests.
+        # queries of linked project are retained (see cache_park)
+        # unless retain is False, in which case retained queries
+        # of other projects are dropped as well
+
+        self.cache_focus = {}
+        self.cache_focus_fetched = {}
+        for uid in ('current_project', 'current_tasks', 'current_versions', 'current_pbfiles', 'current_steps'):
+            if retain:
+                self.cache_park(uid)
+            else:
+                self.cache_unregister(uid)
+        if not retain:
+            for uid, cache_request in list(self.async_cache.items()):
+                if cache_request.get('parked'):
+                    self.cache_unregister(uid)
+
+
+    def cache_query_key(self, query):
+
+        # returns canonical immutable key for a query:
+        # (entity, filters, fields) with lists turned into tuples,
+        # dictionaries into sorted tuples of items,
+        # top level filters and fields sorted and de-duplicated
+
+        def canonical(value):
+            if isinstance(value, dict):
+                return tuple(sorted((k, canonical(v)) for k, v in value.items()))
+            if isinstance(value, (list, tuple, set)):
+                return tuple(canonical(v) for v in value)
+            return value
+
+        filters = set(canonical(f) for f in query.get('filters', []))
+        fields = set(query.get('fields', []))
+        return (
+            query.get('entity'),
+            tuple(sorted(filters, key = repr)),
+            tuple(sorted(fields))
+            )
+
+    def cache_find_shared(self, key, query):
+
+        # looks for a complete cached result of the query on the same entity
+        # the query could be served from (see cache_query_groups):
+        # the same or fewer filters, the rest of filters can be evaluated
+        # on cached rows, and the same or wider list of fields
+
+        fields = set(key[2])
+        filters = set(key[1])
+        for cache_request in list(self.async_cache.values()):
+            shared_key = cache_request.get('key')
+            if not (shared_key and shared_key[0] == key[0]):
+                continue
+            if not cache_request.get('watermark'):
+                continue
+            if not set(shared_key[1]).issubset(filters):
+                continue
+            extra_filters = self.cache_extra_filters(query, set(shared_key[1]))
+            if extra_filters is None:
+                continue
+            if fields.union(self.cache_filter_fields(extra_filters)).issubset(shared_key[2]):
+                return cache_request
+        return None
+
+    def cache_query_groups(self, uids = None, synced_only = False):
+
+        # query planner: merges registered queries into the minimal set of
+        # superset queries fetched once per cycle. Queries with the same
+        # entity and filters are merged with the union of their fields.
+        # A query with the same filters as another one plus some more
+        # is served by the wider query if its extra filters can be
+        # evaluated on cached rows (see cache_match_filter): the wider query
+        # fetches fields of both and cache_plan_rows projects rows back
+        # to every query. Returns list of (query, [uids]) tuples in order
+        # of the first uid of every group.
+        # synced_only skips queries that have not completed initial fetch yet
+
+        if uids is None:
+            uids = list(self.async_cache.keys())
+
+        planned = []
+        for uid in uids:
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                continue
+            query = cache_request.get('query')
+            if not (query and query.get('entity')):
+                continue
+            if synced_only and not cache_request.get('watermark'):
+                continue
+            filters_key = cache_request.get('filters_key')
+            if filters_key is None:
+                filters_key = self.cache_query_key(query)[:2]
+                cache_request['filters_key'] = filters_key
+            planned.append((uid, query, filters_key))
+
+        # wider queries (fewer filters) are planned first
+        # so narrower ones can join them
+
+        groups = []
+        for position, (uid, query, filters_key) in sorted(enumerate(planned), key = lambda item: (len(item[1][2][1]), item[0])):
+            filters = set(filters_key[1])
+            for group in groups:
+                if group['entity'] != filters_key[0] or not group['filters'].issubset(filters):
+                    continue
+                extra_filters = self.cache_extra_filters(query, group['filters'])
+                if extra_filters is None:
+                    continue
+                break
+            else:
+                group = {
+                    'entity': filters_key[0],
+                    'filters': filters,
+                    'query': {
+                        'entity': query.get('entity'),
+                        'filters': query.get('filters', []),
+                        'fields': []
+                        },
+                    'uids': [],
+                    'position': position
+                    }
+                groups.append(group)
+                extra_filters = []
+            group_fields = group['query']['fields']
+            for field in list(query.get('fields', [])) + self.cache_filter_fields(extra_filters):
+                if field not in group_fields:
+                    group_fields.append(field)
+            group['uids'].append((position, uid))
+            group['position'] = min(group['position'], position)
+
+        groups.sort(key = lambda group: group['position'])
+        return [(group['query'], [uid for position, uid in sorted(group['uids'])]) for group in groups]
+
+    def cache_extra_filters(self, query, filters):
+
+        # returns filters of the query that are not in given set of
+        # canonical filters, or None if any of them can not be
+        # evaluated on cached rows
+
+        extra_filters = []
+        for query_filter in query.get('filters', []):
+            if self.cache_query_key({'filters': [query_filter]})[1][0] in filters:
+                continue
+            if not self.cache_local_filter(query_filter):
+                return None
+            extra_filters.append(query_filter)
+        return extra_filters
+
+    def cache_local_filter(self, query_filter):
+        if isinstance(query_filter, dict):
+            if query_filter.get('filter_operator', 'all') not in ('all', 'and', 'any', 'or'):
+                return False
+            return all(self.cache_local_filter(f) for f in query_filter.get('filters', []))
+        if not (isinstance(query_filter, (list, tuple)) and len(query_filter) >= 3):
+            return False
+        return query_filter[1] in ('is', 'is_not', 'in', 'not_in', 'type_is')
+
+    def cache_filter_fields(self, filters):
+        fields = []
+        for query_filter in filters:
+            if isinstance(query_filter, dict):
+                sub_fields = self.cache_filter_fields(query_filter.get('filters', []))
+            else:
+                sub_fields = [query_filter[0]]
+            for field in sub_fields:
+                if field not in fields:
+                    fields.append(field)
+        return fields
+
+    def cache_match_filter(self, row, query_filter):
+
+        # evaluates simple shotgun filter on a row: 'is', 'is_not', 'in',
+        # 'not_in' and 'type_is' on plain, link and multi-entity fields,
+        # nested 'all' / 'any' groups of them
+
+        if isinstance(query_filter, dict):
+            results = [self.cache_match_filter(row, f) for f in query_filter.get('filters', [])]
+            if query_filter.get('filter_operator') in ('any', 'or'):
+                return any(results)
+            return all(results)
+
+        field, relation = query_filter[0], query_filter[1]
+        values = list(query_filter[2:])
+        if len(values) == 1 and isinstance(values[0], (list, tuple)) and relation in ('in', 'not_in'):
+            values = list(values[0])
+        value = row.get(field)
+        if relation == 'type_is':
+            return isinstance(value, dict) and value.get('type') == values[0]
+
+        def equals(value, expected):
+            if isinstance(value, (list, tuple)):
+                return any(equals(item, expected) for item in value)
+            if isinstance(expected, dict):
+                return isinstance(value, dict) and value.get('type') == expected.get('type') and value.get('id') == expected.get('id')
+            if isinstance(value, dict):
+                return value.get('id') == expected
+            return value == expected
+
+        matched = any(equals(value, expected) for expected in values)
+        return matched if relation in ('is', 'in') else not matched
+
+    def cache_plan_rows(self, uid, query, result_by_id):
+
+        # projects rows fetched with planned superset query back to
+        # query registered under uid: rows that do not match its extra
+        # filters are excluded, fields it has not asked for are dropped.
+        # Returns (rows by id, excluded ids). Result is returned as is
+        # if the query is the same as the superset one
+
+        cache_request = self.async_cache.get(uid)
+        if not cache_request:
+            return ({}, [])
+        own_query = cache_request.get('query')
+        group_key = self.cache_query_key(query)
+        extra_filters = self.cache_extra_filters(own_query, set(group_key[1])) or []
+        fields = set(self.cache_query_fields(own_query))
+        if (not extra_filters) and fields == set(self.cache_query_fields(query)):
+            return (result_by_id, [])
+
+        fields.update(('type', 'id'))
+        rows = {}
+        excluded_ids = []
+        for entity_id, row in result_by_id.items():
+            if extra_filters and not all(self.cache_match_filter(row, f) for f in extra_filters):
+                excluded_ids.append(entity_id)
+                continue
+            rows[entity_id] = dict((field, value) for field, value in row.items() if field in fields)
+        return (rows, excluded_ids)
+
+    def cache_run_queries(self, function, items, sg = None, kind = None, uids = None):
+
+        # runs function(item, sg) for every item concurrently,
+        # each call with its own pooled connection.
+        # If connection is given calls are made one by one using it.
+        # Failed calls are logged and return None.
+        # If kind is given latency and errors of every call are recorded
+        # in cache metrics for uids, or for uids of (query, uids) group items
+
+        def run(item):
+            start = time.time()
+            item_uids = []
+            if kind:
+                item_uids = uids if uids is not None else item[1]
+            try:
+                with self.sg_pool.connection(sg) as pooled_sg:
+                    result = function(item, pooled_sg)
+            except Exception as e:
+                self.log_debug('error in %s: %s' % (function.__name__, e))
+                for uid in item_uids:
+                    self.cache_metrics.error(uid, kind, str(e))
+                return None
+            for uid in item_uids:
+                self.cache_metrics.observe(uid, kind, time.time() - start)
+            return result
+
+        if sg:
+            return [run(item) for item in items]
+        return self.cache_executor.map(run, items)
+
+    def cache_softupdate(self, sg = None, uids = None):
+
+        # delta sync: fetch only rows updated since the query watermark.
+        # queries that have not completed their initial fetch yet are skipped,
+        # complete but empty results fall back to the last hour window
+
+        def delta_fetch(group, sg):
+            query, group_uids = group
+            watermarks = []
+            for uid in group_uids:
+                watermark = self.async_cache.get(uid, {}).get('watermark')
+                if watermark:
+                    watermarks.append(watermark)
+            if not watermarks:
+                return None
+
+            # the oldest watermark covers every query in the group
+
+            watermark = min(watermarks, key = lambda w: (w.get('updated_at') is not None, w.get('updated_at')))
+            delta_filters = list(query.get('filters', []))
+            delta_filters.append(self.cache_delta_filter(watermark))
+
+            result = sg.find(query.get('entity'), delta_filters, self.cache_query_fields(query))
+            return {e.get('id'):e for e in result}
+
+        groups = self.cache_query_groups(uids, synced_only = True)
+        generations = self.cache_generations()
+        results = self.cache_run_queries(delta_fetch, groups, sg = sg, kind = 'soft')
+
+        for (query, group_uids), result_by_id in zip(groups, results):
+            if result_by_id is None:
+                continue
+            for uid in group_uids:
+                self.cache_merge_planned(uid, query, result_by_id)
+        return self.cache_changed_since(generations)
+
+    def cache_merge_planned(self, uid, query, result_by_id, advance_watermark = True, missing_ids = None):
+
+        # merges rows of planned superset query into query registered
+        # under uid. Rows that no longer match its filters and missing_ids
+        # are removed from the cache
+
+        rows, excluded_ids = self.cache_plan_rows(uid, query, result_by_id)
+        self.cache_merge_result(uid, rows, advance_watermark = advance_watermark)
+        cached_ids = self.async_cache.get(uid, {}).get('result', {})
+        stale_ids = [entity_id for entity_id in list(excluded_ids) + list(missing_ids or []) if entity_id in cached_ids]
+        if stale_ids:
+            self.cache_remove_ids(uid, stale_ids)
+
+    def cache_hardupdate(self, sg = None, uids = None):
+
+        # full re-fetch of registered queries.
+        # Pages are collected straight into result dictionary,
+        # it replaces cached result once the last page has arrived
+
+        def full_fetch(group, sg):
+            query, group_uids = group
+            fetch_mark = self.cache_fetch_mark(sg, query.get('entity'), query.get('filters', []))
+            result_by_id = {}
+            for page in self.cache_find_paged(sg, query.get('entity'), query.get('filters', []), self.cache_query_fields(query)):
+                result_by_id.update(page)
+            return (result_by_id, fetch_mark)
+
+        groups = self.cache_query_groups(uids)
+        generations = self.cache_generations()
+        results = self.cache_run_queries(full_fetch, groups, sg = sg, kind = 'full')
+
+        for (query, group_uids), result in zip(groups, results):
+            if result is None:
+                continue
+            result_by_id, fetch_mark = result
+            for index, uid in enumerate(group_uids):
+                # every query keeps its own result dictionary
+                rows, excluded_ids = self.cache_plan_rows(uid, query, result_by_id)
+                self.cache_replace_result(uid, dict(rows) if (rows is result_by_id and index) else rows, fetch_mark = fetch_mark)
+        return self.cache_changed_since(generations)
+
+    def cache_reconcile(self, sg = None, uids = None):
+
+        # id-only pass over every registered query.
+        # delta sync never sees deleted or retired entities, as well as entities
+        # that no longer match query filters, so such ids are dropped here
+
+        def ids_fetch(group, sg):
+            query, group_uids = group
+            return set(e.get('id') for e in sg.find(query.get('entity'), query.get('filters', []), ['id']))
+
+        groups = self.cache_query_groups(uids, synced_only = True)
+        generations = self.cache_generations()
+        results = self.cache_run_queries(ids_fetch, groups, sg = sg, kind = 'reconcile')
+
+        for (query, group_uids), current_ids in zip(groups, results):
+            if current_ids is None:
+                continue
+            for uid in group_uids:
+                result_by_id = self.async_cache.get(uid, {}).get('result', {})
+                stale_ids = [entity_id for entity_id in list(result_by_id.keys()) if entity_id not in current_ids]
+                if stale_ids:
+                    self.log_debug('reconcile: removing %s stale ids from %s' % (len(stale_ids), uid))
+                    self.cache_remove_ids(uid, stale_ids)
+        return self.cache_changed_since(generations)
+
+    def cache_generations(self):
+
+        # current generation of every query. Refresh passes
+        # return uids of queries that have changed since then,
+        # so quiet cycles can be told apart and skipped by callers
+
+        return {uid: getattr(cache_request.get('result'), 'generation', 0) for uid, cache_request in list(self.async_cache.items())}
+
+    def cache_changed_since(self, generations):
+        changed_uids = []
+        for uid, cache_request in list(self.async_cache.items()):
+            if getattr(cache_request.get('result'), 'generation', 0) != generations.get(uid):
+                changed_uids.append(uid)
+        return changed_uids
+
+    def cache_eventupdate(self, sg = None, uids = None):
+
+        # EventLogEntry driven refresh.
+        # Instead of polling every registered query we tail event log
+        # from the last seen event id and re-read only entities that have been
+        # created, changed or revived. Retired entities are removed from cache.
+        # Fields that are linked through another entity (i.e 'task.Task.entity')
+        # are re-read when corresponding attribute of linked entity has changed.
+        # Plain link display names (i.e. 'name' in 'entity' links) are refreshed
+        # with hard update and reconcile passes.
+
+        if uids is None:
+            uids = list(self.async_cache.keys())
+
+        page_size = 500
+        max_pages = 10
+
+        # collect entity types to listen to.
+        # project-scoped queries only need events of linked project
+
+        scoped_types = set()
+        global_types = set()
+        for uid in uids:
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                continue
+            query = cache_request.get('query', {})
+            entity = query.get('entity')
+            if not entity:
+                continue
+            types = set([entity])
+            for field in query.get('fields', []):
+                path = field.split('.')
+                if len(path) > 2:
+                    types.add(path[1])
+            project_scoped = False
+            for query_filter in query.get('filters', []):
+                if isinstance(query_filter, (list, tuple)) and str(query_filter[0]).startswith('project'):
+                    project_scoped = True
+            # service serves queries of several projects,
+            # it tails events of every project
+
+            if project_scoped and self.sg_linked_project_id:
+                scoped_types.update(types)
+            else:
+                global_types.update(types)
+        scoped_types = scoped_types - global_types
+
+        if not (scoped_types or global_types):
+            return False
+
+        def event_types(entity_types):
+            result = []
+            for entity_type in sorted(entity_types):
+                for action in ('New', 'Change', 'Retirement', 'Revival'):
+                    result.append('Shotgun_%s_%s' % (entity_type, action))
+            return result
+
+        scope_filters = []
+        if scoped_types:
+            scope_filters.append({
+                'filter_operator': 'all',
+                'filters': [
+                    ['event_type', 'in', event_types(scoped_types)],
+                    ['project', 'is', {'type': 'Project', 'id': self.sg_linked_project_id}]
+                ]})
+        if global_types:
+            scope_filters.append(['event_type', 'in', event_types(global_types)])
+
+        events = []
+        last_event_id = self.cache_last_event_id
+        catch_up = False
+
+        with self.sg_pool.connection(sg) as event_sg:
+
+            # start from the most recent event and catch up with
+            # anything changed since queries were fetched with delta sync
+
+            if last_event_id is None:
+                latest_event = event_sg.find_one(
+                    'EventLogEntry',
+                    [],
+                    ['id'],
+                    order = [{'field_name': 'id', 'direction': 'desc'}]
+                )
+                last_event_id = latest_event.get('id') if latest_event else 0
+                catch_up = True
+            else:
+                for page in range(max_pages):
+                    page_events = event_sg.find(
+                        'EventLogEntry',
+                        [
+                            ['id', 'greater_than', last_event_id],
+                            {'filter_operator': 'any', 'filters': scope_filters}
+                        ],
+                        ['event_type', 'entity', 'attribute_name', 'meta'],
+                        order = [{'field_name': 'id', 'direction': 'asc'}],
+                        limit = page_size
+                    )
+                    if page_events:
+                        events.extend(page_events)
+                        last_event_id = page_events[-1].get('id')
+                    if len(page_events) < page_size:
+                        break
+                else:
+                    # we are too far behind, it is cheaper to perform delta sync
+                    # and start tailing from the most recent event again
+                    self.log_debug('event log is too far behind, falling back to delta sync')
+                    last_event_id = None
+                    catch_up = True
+
+        # delta sync of catch up picks up everything since query
+        # watermarks, so event id can be moved forward right away.
+        # Otherwise it is moved once events have been applied
+
+        if catch_up:
+            self.cache_last_event_id = last_event_id
+            self.cache_softupdate(sg = sg, uids = uids)
+            return True
+        if not events:
+            self.cache_last_event_id = last_event_id
+            return True
+
+        # the last event for an entity wins
+
+        entity_state = {}
+        changed_attributes = {}
+        for event in events:
+            event_type = event.get('event_type', '').split('_')
+            if len(event_type) < 3:
+                continue
+            entity_type = event_type[1]
+            action = event_type[-1]
+            meta = event.get('meta') or {}
+            if event.get('entity'):
+                entity_id = event.get('entity').get('id')
+            else:
+                entity_id = meta.get('entity_id')
+            if not entity_id:
+                continue
+
+            entity_state[(entity_type, entity_id)] = 'retired' if action == 'Retirement' else 'changed'
+            if action == 'Change' and event.get('attribute_name'):
+                attributes = changed_attributes.setdefault(entity_type, {})
+                attributes.setdefault(event.get('attribute_name'), set()).add(entity_id)
+
+        self.log_debug('events: %s, entities affected: %s' % (len(events), len(entity_state.keys())))
+
+        def find_chunked(sg, entity, filters, fields, field_name, values):
+            values = list(values)
+            result = []
+            for index in range(0, len(values), page_size):
+                chunk_filters = list(filters)
+                chunk_filters.append([field_name, 'in', values[index:index + page_size]])
+                result.extend(sg.find(entity, chunk_filters, fields))
+            return result
+
+        def reread(group, sg):
+            query, group_uids = group
+            entity = query.get('entity')
+            filters = query.get('filters', [])
+            fields = self.cache_query_fields(query)
+
+            changed_ids = set()
+            retired_ids = set()
+            for (entity_type, entity_id), state in entity_state.items():
+                if entity_type != entity:
+                    continue
+                if state == 'retired':
+                    retired_ids.add(entity_id)
+                else:
+                    changed_ids.add(entity_id)
+
+            # linked fields: 'link.Type.attribute'
+
+            linked = []
+            for field in query.get('fields', []):
+                path = field.split('.')
+                if len(path) < 3:
+                    continue
+                linked_ids = changed_attributes.get(path[1], {}).get(path[2])
+                if linked_ids:
+                    linked.append((path[0] + '.' + path[1] + '.id', linked_ids))
+
+            result_by_id = {}
+            if changed_ids:
+                for row in find_chunked(sg, entity, filters, fields, 'id', changed_ids):
+                    result_by_id[row.get('id')] = row
+            for link_field, linked_ids in linked:
+                for row in find_chunked(sg, entity, filters, fields, link_field, linked_ids):
+                    result_by_id[row.get('id')] = row
+
+            # changed entities that are no longer returned
+            # do not match query filters anymore
+
+            missing_ids = retired_ids | (changed_ids - set(result_by_id.keys()))
+            return (result_by_id, missing_ids)
+
+        groups = self.cache_query_groups(uids, synced_only = True)
+        results = self.cache_run_queries(reread, groups, sg = sg, kind = 'events')
+
+        failed = False
+        for (query, group_uids), result in zip(groups, results):
+            if result is None:
+                failed = True
+                continue
+            result_by_id, missing_ids = result
+            for uid in group_uids:
+                self.cache_merge_planned(uid, query, result_by_id, missing_ids = missing_ids)
+
+        # if any group has failed to re-read its rows event id is kept
+        # so the next pass replays the same events. Applying them
+        # again to groups that have succeeded changes nothing
+
+        if failed:
+            self.log_debug('keeping last event id %s to replay events' % self.cache_last_event_id)
+            return False
+        self.cache_last_event_id = last_event_id
+        return True
+
+    def cache_query_fields(self, query):
+
+        # 'updated_at' is always requested along with query fields
+        # in order to track the high-water mark of the result
+
+        fields = list(query.get('fields', []))
+        if 'updated_at' not in fields:
+            fields.append('updated_at')
+        return fields
+
+    def cache_delta_filter(self, watermark):
+
+        # rows committed late with an earlier timestamp could be
+        # missed with a strict watermark, so there is a small overlap window.
+        # rows fetched twice are simply overwritten in cache
+
+        from datetime import timedelta
+
+        last_updated = watermark.get('updated_at')
+        if not last_updated:
+            return ['updated_at', 'in_last', 1, 'HOUR']
+        return ['updated_at', 'greater_than', last_updated - timedelta(seconds = 60)]
+
+    def cache_watermark(self, result_by_id, watermark = None, fetch_mark = None):
+
+        # fetch_mark is the one taken with cache_fetch_mark when fetch has
+        # started. Fetches spanning many pages take a while and rows read on
+        # early pages could change before later pages arrive, so watermark
+        # of such fetch is never later than its start
+
+        if not watermark:
+            watermark = {'updated_at': None, 'id': 0}
+        else:
+            watermark = dict(watermark)
+
+        for entity_id, row in result_by_id.items():
+            if entity_id > watermark['id']:
+                watermark['id'] = entity_id
+            updated_at = row.get('updated_at')
+            if updated_at and ((not watermark['updated_at']) or updated_at > watermark['updated_at']):
+                watermark['updated_at'] = updated_at
+
+        if fetch_mark is not None and watermark['updated_at']:
+            mark = fetch_mark.get('updated_at')
+            if (not mark) or mark < watermark['updated_at']:
+                watermark['updated_at'] = mark
+        return watermark
+
+    def cache_fetch_mark(self, sg, entity, filters):
+
+        # latest 'updated_at' of the query before its rows are fetched.
+        # Shotgun does not tell its time so the latest change it has
+        # stands for it. Returns mark with no 'updated_at' if query has
+        # no rows, delta sync then looks back an hour
+
+        row = sg.find_one(entity, filters, ['updated_at'], order = [{'field_name': 'updated_at', 'direction': 'desc'}])
+        return {'updated_at': row.get('updated_at') if row else None}
+
+    def cache_replace_result(self, uid, result_by_id, fetch_mark = None):
+
+        # replaces result with a complete result set and resets the watermark.
+        # result_by_id is owned by cache after this call and should not be changed.
+        # fetch_mark limits the watermark, see cache_watermark.
+        # Rows are compared with cached ones: if nothing has changed generation
+        # stays the same, if only a few rows have changed they are merged
+        # so unchanged rows and indexes are kept
+
+        result_by_id = self.cache_compact(result_by_id)
+        with self.cache_lock:
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                return False
+            old_result = cache_request['result']
+            watermark = self.cache_watermark(result_by_id, fetch_mark = fetch_mark)
+            changed = self.cache_changed_rows(old_result, result_by_id)
+            removed_ids = [entity_id for entity_id in old_result.keys() if entity_id not in result_by_id]
+
+            if not (changed or removed_ids):
+                complete = cache_request.get('watermark') is not None
+                cache_request['watermark'] = watermark
+                if not complete:
+                    self.cache_mark_complete(cache_request)
+                return True
+
+            if old_result and (len(changed) + len(removed_ids)) * 4 < len(result_by_id):
+                old_rows = {}
+                for entity_id in removed_ids:
+                    old_rows[entity_id] = old_result.get(entity_id)
+                for entity_id in changed.keys():
+                    old_rows[entity_id] = old_result.get(entity_id)
+                new_result = old_result.updated(changed, removed_ids)
+                cache_request['watermark'] = watermark
+                self.cache_mark_changed(cache_request, new_result, list(changed.keys()), removed_ids)
+                self.cache_publish(cache_request, new_result, self.cache_update_indexes(cache_request, old_rows, changed))
+                return True
+
+            new_result = flameCacheMap(result_by_id)
+            cache_request['watermark'] = watermark
+            self.cache_mark_changed(cache_request, new_result, None)
+            self.cache_publish(cache_request, new_result, self.cache_index_rows(cache_request, new_result))
+        return True
+
+    def cache_merge_result(self, uid, result_by_id, advance_watermark = True):
+
+        # merges partial or delta result into cached result.
+        # Rows equal to cached ones are skipped, so delta sync that
+        # has only re-read rows of its overlap window changes nothing
+
+        result_by_id = self.cache_compact(result_by_id)
+        with self.cache_lock:
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                return False
+            old_result = cache_request['result']
+            changed = self.cache_changed_rows(old_result, result_by_id)
+            if not changed:
+                return True
+            old_rows = {}
+            for entity_id in changed.keys():
+                old_rows[entity_id] = old_result.get(entity_id)
+            new_result = old_result.updated(changed)
+            if advance_watermark and cache_request.get('watermark'):
+                cache_request['watermark'] = self.cache_watermark(changed, cache_request.get('watermark'))
+            self.cache_mark_changed(cache_request, new_result, list(changed.keys()))
+            self.cache_publish(cache_request, new_result, self.cache_update_indexes(cache_request, old_rows, changed))
+        return True
+
+    def cache_changed_rows(self, old_result, result_by_id):
+
+        # returns rows of result_by_id that are new or differ from old_result.
+        # Rows are compared by content rather than by 'updated_at'
+        # as linked fields (i.e. 'entity.Shot.sg_sequence') change
+        # without the row itself being updated
+
+        changed = {}
+        for entity_id, row in result_by_id.items():
+            old_row = old_result.get(entity_id)
+            if old_row is None or old_row != row:
+                changed[entity_id] = row
+        return changed
+
+    def cache_mark_changed(self, cache_request, result_by_id, changed_ids, removed_ids = None):
+
+        # gives result about to be published for changed rows the next
+        # generation. Generation is only kept on published results,
+        # so it changes along with the result it stands for.
+        # changed_ids of None means the whole result has been replaced
+
+        result_by_id.generation = getattr(cache_request.get('result'), 'generation', 0) + 1
+        cache_request['dirty'] = True
+        self.cache_log_change(cache_request, result_by_id.generation, changed_ids, removed_ids)
+
+    def cache_mark_complete(self, cache_request):
+
+        # result has become complete, sessions served by cache service
+        # learn it with the next generation, so the same rows
+        # are published again as a new one
+
+        result_by_id = cache_request['result']
+        new_result = result_by_id.updated()
+        self.cache_mark_changed(cache_request, new_result, [])
+        self.cache_publish(cache_request, new_result, result_by_id.indexes)
+
+    def cache_publish(self, cache_request, result_by_id, indexes):
+
+        # makes new result and its indexes visible to readers.
+        # They are published as one object with a single assignment
+        # so readers never see new result with old indexes or generation
+
+        result_by_id.indexes = indexes
+        cache_request['result'] = result_by_id
+
+    def cache_remove_ids(self, uid, entity_ids):
+        with self.cache_lock:
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                return False
+            old_result = cache_request['result']
+            old_rows = {}
+            for entity_id in entity_ids:
+                old_rows[entity_id] = old_result.get(entity_id)
+            if not [row for row in old_rows.values() if row is not None]:
+                return True
+            new_result = old_result.updated(None, list(entity_ids))
+            self.cache_mark_changed(cache_request, new_result, [], list(entity_ids))
+            self.cache_publish(cache_request, new_result, self.cache_update_indexes(cache_request, old_rows, {}))
+        return True
+
+    def cache_log_change(self, cache_request, generation, changed_ids, removed_ids = None):
+
+        # queries registered with track_changes keep ids changed by
+        # the last generations so cache service sends only changed rows
+        # to sessions that are a few generations behind.
+        # changed_ids of None means the whole result has been replaced
+
+        changes = cache_request.get('changes')
+        if changes is None:
+            return
+        changes.append((generation, changed_ids, removed_ids or []))
+        if len(changes) > 64:
+            del changes[:len(changes) - 64]
+
+    def cache_changes_since(self, uid, generation):
+
+        # returns changes of a query made after given generation:
+        # {'generation': g, 'watermark': w, 'result': {id: row}} if the whole
+        # result needs to be sent or {'generation': g, 'watermark': w, 'rows': {id: row}, 'removed': [id]}
+        # Returns None if there were no changes since generation
+
+        with self.cache_lock:
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                return None
+            result_by_id = cache_request.get('result', {})
+            current = getattr(result_by_id, 'generation', 0)
+            watermark = cache_request.get('watermark')
+            changes = list(cache_request.get('changes') or [])
+
+        if generation == current:
+            return None
+        change = {'generation': current, 'watermark': watermark}
+
+        # log should cover every generation since the one session holds
+
+        full = (not generation) or generation > current
+        if not full and (not changes or changes[0][0] > generation + 1):
+            full = True
+
+        changed = set()
+        removed = set()
+        if not full:
+            for change_generation, changed_ids, removed_ids in changes:
+                if change_generation <= generation:
+                    continue
+                if changed_ids is None:
+                    full = True
+                    break
+                changed.update(changed_ids)
+                changed.difference_update(removed_ids)
+                removed.difference_update(changed_ids)
+                removed.update(removed_ids)
+
+        if full:
+            change['result'] = result_by_id
+        else:
+            change['rows'] = {entity_id: result_by_id[entity_id] for entity_id in changed if entity_id in result_by_id}
+            change['removed'] = list(removed)
+        return change
+
+    def cache_apply_change(self, uid, change):
+
+        # applies changes received from cache service
+
+        with self.cache_lock:
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                return False
+            if change.get('generation', 0) == cache_request.get('service_generation'):
+                return False
+            if 'result' in change:
+                self.cache_replace_result(uid, dict(change.get('result')))
+            else:
+                self.cache_merge_result(uid, change.get('rows', {}), advance_watermark = False)
+                self.cache_remove_ids(uid, change.get('removed', []))
+            cache_request['watermark'] = change.get('watermark')
+            cache_request['service_generation'] = change.get('generation', 0)
+        return True
+
+    def cache_compact(self, result_by_id):
+
+        # turns rows into compact records sharing identical
+        # entity links and strings with rows of other queries
+
+        if not (result_by_id and self.prefs_global.get('cache_compact_rows', True)):
+            return result_by_id
+        record = self.cache_interner.record
+        return {entity_id: record(row) for entity_id, row in result_by_id.items()}
+
+    def cache_memory_report(self, uids = None):
+
+        # approximate memory used by cached rows, in bytes.
+        # Objects shared between rows and queries (links, strings, layouts)
+        # are counted once for the first query they are found in.
+        # uids limits report to given queries
+
+        seen = set()
+        report = {}
+        for uid, cache_request in list(self.async_cache.items()):
+            if uids is not None and uid not in uids:
+                continue
+            result_by_id = cache_request.get('result', {})
+            report[uid] = {'rows': len(result_by_id), 'bytes': self.cache_size_of(result_by_id, seen)}
+            self.log_debug('cache memory: %s rows: %s, %.1f Mb' % (uid, report[uid]['rows'], report[uid]['bytes'] / 1048576.0))
+        return report
+
+    def cache_size_of(self, value, seen):
+
+        # approximate size of value and objects it refers to,
+        # objects which ids are in seen are not counted again
+
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+        size = sys.getsizeof(value)
+        if isinstance(value, flameCacheRecord):
+            size += self.cache_size_of(value._layout, seen) + self.cache_size_of(value._values, seen) + self.cache_size_of(value._extra, seen)
+        elif isinstance(value, flameCacheMap):
+            size += self.cache_size_of(value.buckets, seen)
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                size += self.cache_size_of(key, seen) + self.cache_size_of(item, seen)
+        elif isinstance(value, (list, tuple, set)):
+            for item in value:
+                size += self.cache_size_of(item, seen)
+        return size
+
+    def cache_metrics_report(self):
+
+        # per-query metrics combined with current cache state:
+        # rows, approximate size, age of cached data and refresh budget.
+        # Size is the last one measured in background by
+        # cache_measure_queries, it is not measured here
+
+        now = time.time()
+        metrics = self.cache_metrics.report()
+        report = {}
+        for uid, cache_request in list(self.async_cache.items()):
+            query_metrics = metrics.get(uid, self.cache_metrics.empty())
+            last_success = query_metrics.get('last_success')
+            query_metrics.update({
+                'entity': cache_request.get('query', {}).get('entity'),
+                'rows': len(cache_request.get('result') or {}),
+                'bytes': (cache_request.get('measured') or {}).get('bytes', 0),
+                'generation': getattr(cache_request.get('result'), 'generation', 0),
+                'complete': bool(cache_request.get('watermark')),
+                'budget': self.cache_effective_budget(cache_request, now),
+                'age': (now - last_success) if last_success else None
+            })
+            report[uid] = query_metrics
+        return report
+
+    def cache_metrics_text(self, report = None):
+
+        # plain text table of cache metrics
+
+        if report is None:
+            report = self.cache_metrics_report()
+
+        def latency(query_metrics, kind):
+            histogram = query_metrics.get('latency', {}).get(kind)
+            if not histogram:
+                return '-'
+            return '%.2f/%.2f' % (histogram.get('p50'), histogram.get('p95'))
+
+        lines = ['%-16s %-14s %7s %8s %7s %6s %11s %11s %11s %6s' % (
+            'query', 'entity', 'rows', 'size Mb', 'age', 'hits', 'initial', 'full', 'soft', 'errors')]
+        for uid in sorted(report.keys()):
+            query_metrics = report.get(uid)
+            age = query_metrics.get('age')
+            lines.append('%-16s %-14s %7s %8.1f %7s %6s %11s %11s %11s %6s' % (
+                uid[:16],
+                str(query_metrics.get('entity'))[:14],
+                query_metrics.get('rows'),
+                query_metrics.get('bytes', 0) / 1048576.0,
+                ('%.0fs' % age) if age is not None else '-',
+                query_metrics.get('hits'),
+                latency(query_metrics, 'initial'),
+                latency(query_metrics, 'full'),
+                latency(query_metrics, 'soft' if 'soft' in query_metrics.get('latency', {}) else 'events'),
+                sum(query_metrics.get('errors', {}).values())
+            ))
+        return '\n'.join(lines)
+
+    def cache_metrics_dump(self):
+
+        # dumps cache metrics to json file in prefs folder
+
+        import json
+
+        report = self.cache_metrics_report()
+        path = os.path.join(self.framework.prefs_folder, self.framework.bundle_name + '.cache_metrics.json')
+        try:
+            with open(path, 'w') as metrics_file:
+                json.dump({'time': time.time(), 'queries': report}, metrics_file, indent = 4, sort_keys = True, default = str)
+        except Exception as e:
+            self.log('unable to save cache metrics to %s: %s' % (path, e))
+            return None
+        self.log_debug('cache metrics saved to %s' % path)
+        return path
+
+    def cache_link_key(self, field):
+
+        # returns index key function grouping rows
+        # by linked entity (type, id)
+
+        def link_key(row):
+            entity = row.get(field)
+            if entity:
+                return (entity.get('type'), entity.get('id'))
+            return (None, None)
+        return link_key
+
+    def cache_link_name_key(self, field):
+
+        # returns index key function grouping rows
+        # by linked entity name regardless of its type
+
+        def link_name_key(row):
+            return self.cache_entity_name(row.get(field))
+        return link_name_key
+
+    def cache_entity_name_field(self, entity_type):
+
+        # field shotgun keeps name of entities of given type in,
+        # links carry it as 'name' whatever the field is
+
+        return {
+            'Project': 'name',
+            'HumanUser': 'name',
+            'Task': 'content',
+            'Note': 'subject',
+            'Delivery': 'title'
+            }.get(entity_type, 'code')
+
+    def cache_entity_name(self, entity):
+
+        # name of entity link or row of any type
+
+        if not entity:
+            return None
+        return entity.get('name') or entity.get(self.cache_entity_name_field(entity.get('type')))
+
+    def cache_linked_entity_types(self):
+
+        # entity types tasks can be linked to: the ones pipeline
+        # steps are defined for, along with shots, assets and sequences
+
+        entity_types = set(['Shot', 'Asset', 'Sequence'])
+        steps = self.async_cache.get('current_steps', {}).get('result') or {}
+        for step in steps.values():
+            if step.get('entity_type'):
+                entity_types.add(step.get('entity_type'))
+        return sorted(entity_types)
+
+    def cache_multi_link_key(self, field):
+
+        # returns index key function grouping rows by every entity
+        # of multi-entity field, i.e. task_assignees.
+        # A row is listed under each of its (type, id) keys
+
+        def multi_link_key(row):
+            return [(entity.get('type'), entity.get('id')) for entity in (row.get(field) or []) if entity]
+        multi_link_key.multiple = True
+        return multi_link_key
+
+    def cache_index(self, uid, index_name):
+
+        # returns secondary index of a query as {key: [rows sorted by id]}.
+        # Index is published along with the result it has been built from
+        # and should be treated as read-only
+
+        cache_request = self.async_cache.get(uid)
+        if not cache_request:
+            return {}
+        cache_request['last_used'] = time.time()
+        self.cache_metrics.hit(uid)
+        return getattr(cache_request.get('result'), 'indexes', {}).get(index_name) or {}
+
+    def cache_find_entity(self, name):
+
+        # returns entity of current tasks with given name, i.e. the one
+        # named after current batch group. Entities of any type are
+        # looked up, if several of them share the name the one
+        # with the earliest task wins
+
+        tasks = self.cache_index('current_tasks', 'by_entity_name').get(name)
+        if not tasks:
+            return {}
+        return dict(tasks[0].get('entity'))
+
+    def cache_entity_tasks(self, user_only = True):
+
+        # returns current tasks linked to entities, sorted by id.
+        # User tasks are taken from assignee index, all entities
+        # from entity index with the last task of each entity
+
+        if user_only:
+            user_id = 0
+            if self.sg_human_user:
+                user_id = self.sg_human_user.get('id', 0)
+            tasks_by_assignee = self.cache_index('current_tasks', 'by_assignee')
+            tasks = tasks_by_assignee.get(('HumanUser', user_id), [])
+        else:
+            tasks_by_entity = self.cache_index('current_tasks', 'by_entity')
+            tasks = sorted([entity_tasks[-1] for entity_tasks in tasks_by_entity.values()], key = lambda task: task.get('id'))
+        return [task for task in tasks if task.get('entity')]
+
+    def cache_add_index(self, uid, index_name, key_function):
+        with self.cache_lock:
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                return False
+            indexes = dict(cache_request.get('indexes', {}))
+            indexes[index_name] = key_function
+            cache_request['indexes'] = indexes
+            self.cache_build_indexes(cache_request, [index_name])
+        return True
+
+    def cache_build_indexes(self, cache_request, index_names = None):
+
+        # rebuilds given indexes of cached result and publishes them
+
+        with self.cache_lock:
+            result_by_id = cache_request.get('result')
+            if result_by_id is None:
+                return
+            self.cache_publish(cache_request, result_by_id.updated(), self.cache_index_rows(cache_request, result_by_id, index_names))
+
+    def cache_index_rows(self, cache_request, result_by_id, index_names = None):
+
+        # full index build is only needed when the whole result is replaced.
+        # Returns indexes of result_by_id, the ones not in index_names
+        # are taken from the published result as they are
+
+        indexes = cache_request.get('indexes', {})
+        if index_names is None:
+            index_names = list(indexes.keys())
+        built = dict(getattr(cache_request.get('result'), 'indexes', {}))
+        for index_name in index_names:
+            key_function = indexes.get(index_name)
+            index = {}
+            if getattr(key_function, 'multiple', False):
+                for entity_id in sorted(result_by_id.keys()):
+                    row = result_by_id.get(entity_id)
+                    for key in key_function(row):
+                        index.setdefault(key, []).append(row)
+            else:
+                for entity_id in sorted(result_by_id.keys()):
+                    row = result_by_id.get(entity_id)
+                    index.setdefault(key_function(row), []).append(row)
+            built[index_name] = flameCacheMap(index)
+        return built
+
+    def cache_update_indexes(self, cache_request, old_rows, new_rows):
+
+        # returns secondary indexes updated with changed rows only.
+        # Affected lists are rebuilt and the rest of every index
+        # is shared with the published one (see flameCacheMap)
+
+        indexes = cache_request.get('indexes', {})
+        published = getattr(cache_request.get('result'), 'indexes', {})
+        updated = dict(published)
+        for index_name in indexes.keys():
+            key_function = indexes.get(index_name)
+            index = published.get(index_name)
+            if index is None:
+                continue
+
+            # multi-key functions return list of keys for a row
+
+            if getattr(key_function, 'multiple', False):
+                row_keys = key_function
+            else:
+                row_keys = lambda row: [key_function(row)]
+
+            changes = {}
+            for entity_id, old_row in old_rows.items():
+                if old_row is not None:
+                    for key in row_keys(old_row):
+                        changes.setdefault(key, {})[entity_id] = None
+            for entity_id, new_row in new_rows.items():
+                if new_row is not None:
+                    for key in row_keys(new_row):
+                        changes.setdefault(key, {})[entity_id] = new_row
+
+            changed_keys = {}
+            removed_keys = []
+            for key in changes.keys():
+                rows_by_id = {row.get('id'):row for row in index.get(key, [])}
+                for entity_id, row in changes[key].items():
+                    if row is None:
+                        rows_by_id.pop(entity_id, None)
+                    else:
+                        rows_by_id[entity_id] = row
+                if rows_by_id:
+                    changed_keys[key] = [rows_by_id.get(entity_id) for entity_id in sorted(rows_by_id.keys())]
+                else:
+                    removed_keys.append(key)
+            updated[index_name] = index.updated(changed_keys, removed_keys)
+        return updated
+
+    def cache_project_key(self):
+
+        # snapshots are only valid for the same shotgun site and project
+
+        host = getattr(self.sg_user, 'host', None)
+        return '%s:%s' % (host, self.sg_linked_project_id)
+
+    def cache_load_snapshot(self, uid):
+        if not self.prefs_global.get('cache_snapshots', True):
+            return False
+        cache_request = self.async_cache.get(uid)
+        if not cache_request:
+            return False
+        
+        start = time.time()
+        snapshot = self.cache_snapshots.load(cache_request.get('project_key'), cache_request.get('key'))
+        if not snapshot:
+            return False
+
+        with self.cache_lock:
+            result_by_id = flameCacheMap(self.cache_compact(snapshot.get('result')))
+            cache_request['watermark'] = snapshot.get('watermark')
+            self.cache_mark_changed(cache_request, result_by_id, None)
+            cache_request['dirty'] = False
+            self.cache_publish(cache_request, result_by_id, self.cache_index_rows(cache_request, result_by_id))
+        self.log_debug('loaded snapshot for %s, len: %s, saved %s sec ago, took %s' % (
+            uid, 
+            len(cache_request['result'].keys()),
+            int(time.time() - snapshot.get('saved_at')),
+            time.time() - start))
+        return True
+
+    def cache_save_snapshots(self):
+
+        # saves queries changed since the last save.
+        # partial results (with no watermark set) are never saved
+
+        if not self.prefs_global.get('cache_snapshots', True):
+            return False
+        
+        for uid in list(self.async_cache.keys()):
+            cache_request = self.async_cache.get(uid)
+            if not cache_request:
+                continue
+            if not (cache_request.get('dirty') and cache_request.get('watermark')):
+                continue
+            cache_request['dirty'] = False
+            self.cache_snapshots.save(
+                cache_request.get('project_key'),
+                uid,
+                cache_request.get('key'),
+                cache_request.get('watermark'),
+                dict(cache_request.get('result', {}))
+            )
+        return True
+
+    # host cache service methods
+
+    def cache_service_socket(self):
+        import tempfile
+
+        # socket lives in a directory only this user has access to
+        # (see flameCacheService.private_dir). Unix socket paths
+        # are limited to about a hundred characters
+
+        path = os.path.join(self.framework.prefs_folder, self.framework.bundle_name + '.cache', 'service.sock')
+        if len(path) > 100:
+            path = os.path.join(tempfile.gettempdir(), '%s.%s.cache' % (self.framework.bundle_name, os.getuid()), 'service.sock')
+        flameCacheService.private_dir(os.path.dirname(path))
+        return path
+
+    def cache_service_connect(self, start = True):
 
-        return result
+        # connects to cache service of this host and starts one if needed.
+        # Attempts are made once in 30 seconds so sessions fall back
+        # to polling shotgun themselves if service can not be reached
 
-    def cache_clear(self):
-        self.async_cache = {}
-        return True
-    
-    def register_common_queries(self):
-        self.unregister_common_queries()
+        now = time.time()
+        if (now - self.cache_service_attempt) < 30:
+            return False
+        self.cache_service_attempt = now
 
-        if not self.connector.sg_linked_project_id:
+        try:
+            socket_path = self.cache_service_socket()
+        except OSError as e:
+            self.log('unable to use cache service: %s' % e)
             return False
-                        
-        self.current_project_uid = self.connector.cache_register({
-            'entity': 'Project',
-            'filters': [['id', 'is', self.connector.sg_linked_project_id]],
-            'fields': [
-            ]
-        }, uid = 'current_project')
 
-        self.current_tasks_uid = self.connector.cache_register({
-            'entity': 'Task',
-            'filters': [['project.Project.id', 'is', self.connector.sg_linked_project_id]],
-            'fields': [
-                'content',
-                'step.Step.code',
-                'step.Step.short_name',
-                'step.Step.id',
-                'sg_sort_order',
-                'task_assignees',
-                'project.Project.id',
-                'entity',
-                'entity.Asset.sg_asset_type',
-                'entity.Shot.sg_sequence'
-            ]
-        }, uid = 'current_tasks')
+        client = flameCacheServiceClient(socket_path)
+        try:
+            info = client.request('ping')
+        except Exception as e:
+            client.close()
+            if not start:
+                return False
+            self.log_debug('cache service is not running: %s' % e)
+            if not self.cache_service_start(socket_path):
+                return False
+            info = None
+            for attempt in range(100):
+                time.sleep(0.1)
+                try:
+                    info = client.request('ping')
+                    break
+                except:
+                    client.close()
+            if not info:
+                self.log('unable to connect to cache service')
+                return False
 
-        self.current_versions_uid = self.connector.cache_register({
-            'entity': 'Version',
-            'filters': [['project.Project.id', 'is', self.connector.sg_linked_project_id]],
-            'fields': [
-                'code',
-                'sg_task.Task.id',
-                'entity',
-                'published_files'
-            ]
-        }, uid = 'current_versions')
+        # service may have been started by another user login or site
 
-        self.current_pbfiles_uid = self.connector.cache_register({
-            'entity': 'PublishedFile',
-            'filters': [['project.Project.id', 'is', self.connector.sg_linked_project_id]],
-            'fields': [
-                'name',
-                'created_at',
-            #    'sg_colourspace',
-            #    'sg_image_file_type',
-                'published_file_type',
-                'path_cache',
-                'path_cache_storage',
-            #    'path',
-            #    'project.Project.id',
-            #    'project.Project.name',
-            #    'project.Project.tank_name',
-            #    'project.Project.sg_status',
-            #    'sg_source_location',
-                'task.Task.id',
-                'task.Task.entity',
-            #    'task.Task.content',
-            #    'task.Task.entity.Entity.type',
-            #    'task.Task.step.Step.id',
-            #    'task.Task.step.Step.code',
-            #    'task.Task.step.Step.short_name',
-                'version.Version.id',
-                'version.Version.code',
-            #    'version.Version.name',
-                'version_number',
-                'version.Version.sg_status_list'
-            ]
-        }, uid = 'current_pbfiles')
+        if info.get('host') != getattr(self.sg_user, 'host', None) or info.get('login') != getattr(self.sg_user, 'login', None):
+            self.log_debug('cache service is logged in as %s at %s, not using it' % (info.get('login'), info.get('host')))
+            client.close()
+            return False
 
-        self.current_steps_uid = self.connector.cache_register({
-            'entity': 'Step',
-            'filters': [],
-            'fields': [
-                'code',
-                'list_order',
-                'short_name',
-                'entity_type'
-            ]
-        }, uid = 'current_steps')
+        self.cache_service_attach(client)
+        self.log('connected to cache service, pid %s' % info.get('pid'))
+        return True
 
-    def unregister_common_queries(self):
-        # un-registers async cache requests
-        
-        self.cache_unregister('current_project')
-        self.cache_unregister('current_tasks')
-        self.cache_unregister('current_versions')
-        self.cache_unregister('current_pbfiles')
-        self.cache_unregister('current_steps')
+    def cache_service_start(self, socket_path):
+        import subprocess
 
+        # service runs this very file with the same python path
+        # and shotgun user serialized into its environment
 
-    def cache_softupdate(self, sg = None):
-        if not sg:
-            sg = self.sg
+        try:
+            import sgtk
+            serialized_user = sgtk.authentication.serialize_user(self.sg_user)
+        except Exception as e:
+            self.log_debug('unable to serialize shotgun user for cache service: %s' % e)
+            return False
 
-        results_by_hash = {}
+        script = os.path.abspath(__file__)
+        if script.endswith('.pyc'):
+            script = script[:-1]
+        python = self.cache_service_python()
+        if not python:
+            self.log('unable to find python interpreter for cache service, set cache_service_python preference')
+            return False
 
-        for cache_request_uid in self.async_cache.keys():
-            cache_request = self.async_cache.get(cache_request_uid)
-            if not cache_request:
-                continue
-            query = cache_request.get('query')
-            if not query:
-                continue
+        env = dict(os.environ)
+        env['FLAMEMENUSG_SG_USER'] = serialized_user
+        env['PYTHONPATH'] = os.pathsep.join([path for path in sys.path if path])
 
-            result = []
-            result_by_id = {}
-            
-            if hash(pformat(query)) in results_by_hash.keys():
-                result_by_id = results_by_hash.get(hash(pformat(query)))
-                # for entity_id in result_by_id:
-                #    self.async_cache[cache_request_uid]['result'][entity_id] = result_by_id.get(entity_id)
-            else:
-                start = time.time()
-                
-                entity = query.get('entity')
-                if not entity:
-                    continue
-                filters = query.get('filters')
-                fields = query.get('fields')
+        log_path = os.path.join(self.framework.prefs_folder, self.framework.bundle_name + '.cache_service.log')
+        try:
+            with open(log_path, 'a') as log_file, open(os.devnull, 'r') as devnull:
+                subprocess.Popen(
+                    [python, script, '--cache-service', socket_path],
+                    stdin = devnull,
+                    stdout = log_file,
+                    stderr = subprocess.STDOUT,
+                    env = env,
+                    close_fds = True,
+                    preexec_fn = os.setsid)
+        except Exception as e:
+            self.log('unable to start cache service: %s' % e)
+            return False
+        self.log_debug('started cache service, log: %s' % log_path)
+        return True
 
-                hour_filters = list(filters)
-                hour_filters.append(['updated_at', 'in_last', 1, 'HOUR'])
+    def cache_service_python(self):
+
+        # inside flame sys.executable is flame itself, so unless
+        # cache_service_python is set the interpreter flame python
+        # comes from is looked for next to its standard library
+
+        python = self.prefs_global.get('cache_service_python')
+        if python:
+            return python
+        if os.path.basename(sys.executable).lower().startswith('python'):
+            return sys.executable
+        for name in ('python%s.%s' % sys.version_info[:2], 'python%s' % sys.version_info[0], 'python'):
+            python = os.path.join(sys.prefix, 'bin', name)
+            if os.path.isfile(python) and os.access(python, os.X_OK):
+                return python
+        return None
 
-                # Cached results are stored as a dictionary with entity id as a key.
+    def cache_service_attach(self, client):
+        # every query is subscribed with the next sync
+        with self.cache_lock:
+            self.cache_service = client
+            self.cache_service_released = []
+            for cache_request in self.async_cache.values():
+                cache_request['service_uid'] = None
 
-                try:
-                    result = sg.find(entity, hour_filters, fields)
-                    if result:
-                        result_by_id = {e.get('id'):e for e in result}
-                except Exception as e:
-                    self.log_debug('error hard updating cache %s' % e)
+    def cache_service_detach(self):
 
-                for entity_id in result_by_id:
-                    self.async_cache[cache_request_uid]['result'][entity_id] = result_by_id.get(entity_id)
-    
-                results_by_hash[hash(pformat(query))] = result_by_id
+        # falls back to polling shotgun from this session.
+        # Queries that have not got their result from service yet
+        # are fetched here
 
-                # delta = time.time() - start
-                # self.log_debug('softupdate query: %s, len: %s took %s' % (entity, len(result_by_id.keys()), delta))
+        client = self.cache_service
+        if not client:
+            return False
+        with self.cache_lock:
+            self.cache_service = None
+            self.cache_service_released = []
+            pending = []
+            for uid, cache_request in self.async_cache.items():
+                cache_request.pop('service_uid', None)
+                cache_request.pop('service_generation', None)
+                if not cache_request.get('watermark'):
+                    pending.append(uid)
+        client.close()
+        self.cache_service_attempt = time.time()
+        self.log('disconnected from cache service')
 
-    def cache_hardupdate(self, sg = None):
-        
-        # use main thread shotgun connection if not given
+        if not self.sg_user:
+            return True
+        for uid in pending:
+            self.cache_start_initial_fetch(uid)
+        return True
 
-        if not sg:
-            sg = self.sg
+    def cache_service_sync(self, uids = None):
 
-        results_by_hash = {}
+        # subscribes queries that are not subscribed yet and applies rows
+        # changed in service since the generation each query holds
 
-        for cache_request_uid in self.async_cache.keys():
-            cache_request = self.async_cache.get(cache_request_uid)
-            if not cache_request:
-                continue
-            query = cache_request.get('query')
-            if not query:
-                continue
-            
-            if hash(pformat(query)) in results_by_hash.keys():
-                self.async_cache[cache_request_uid]['result'] = results_by_hash.get(hash(pformat(query)))
-            else:
-                start = time.time()
-                entity = query.get('entity')
-                if not entity:
-                    continue
-                filters = query.get('filters')
-                fields = query.get('fields')
+        client = self.cache_service
+        if not client:
+            return False
 
-                # Cached results are stored as a dictionary with entity id as a key.
+        with self.cache_service_lock:
+            start = time.time()
+            if uids is None:
+                uids = list(self.async_cache.keys())
+            try:
+                for uid in uids:
+                    cache_request = self.async_cache.get(uid)
+                    if not cache_request or cache_request.get('service_uid', False) is not None:
+                        continue
+                    response = client.request(
+                        'register',
+                        query = cache_request.get('query'),
+                        budget = cache_request.get('budget'),
+                        priority = cache_request.get('priority', 0))
+                    cache_request['service_generation'] = 0
+                    cache_request['service_uid'] = response.get('uid')
+
+                # local queries sharing a service query
+                # ask for changes since the oldest generation of them
+
+                queries = {}
+                local_uids = {}
+                used = set()
+                refresh = set()
+                for uid in uids:
+                    cache_request = self.async_cache.get(uid)
+                    if not (cache_request and cache_request.get('service_uid')):
+                        continue
+                    service_uid = cache_request.get('service_uid')
+                    generation = cache_request.get('service_generation', 0)
+                    queries[service_uid] = min(generation, queries.get(service_uid, generation))
+                    local_uids.setdefault(service_uid, []).append(uid)
+                    if (start - cache_request.get('last_used', 0)) < 60:
+                        used.add(service_uid)
+                    if cache_request.get('refresh_requested') is not None and cache_request.get('refresh_sent') is None:
+                        cache_request['refresh_sent'] = start
+                        refresh.add(service_uid)
+
+                released = self.cache_service_released
+                self.cache_service_released = []
+                response = client.request('sync', queries = queries, used = list(used), release = released, refresh = list(refresh))
+            except Exception as e:
+                self.log_debug('error syncing with cache service: %s' % e)
+                self.cache_service_detach()
+                return False
 
-                result = []
-                result_by_id = {}
-                
-                try:
-                    result = sg.find(entity, filters, fields)
-                    if result:
-                        result_by_id = {e.get('id'):e for e in result}
-                except Exception as e:
-                    self.log_debug('error hard updating cache %s' % e)
-                
-                self.async_cache[cache_request_uid]['result'] = result_by_id
-                results_by_hash[hash(pformat(query))] = result_by_id
-                
-                # delta = time.time() - start
-                # self.log_debug('hardupdate query: %s, len: %s took %s' % (entity, len(result_by_id.keys()), delta))
+            for service_uid, change in response.get('changes', {}).items():
+                for uid in local_uids.get(service_uid, []):
+                    self.cache_apply_change(uid, change)
+                    self.cache_metrics.observe(uid, 'service', time.time() - start)
 
-    def preformat_common_queries(self):
+            # service has dropped the query, it is registered again with the next sync
 
-        # sort versions, tasks and published files by entity (type, id)
-        
-        current_tasks_by_entity = {}
-        current_tasks = self.connector.cache_retrive_result('current_tasks')
-        if current_tasks:
-            for current_task in current_tasks:
-                entity = current_task.get('entity')
-                if entity:
-                    entity_key = (entity.get('type'), entity.get('id'))
-                else:
-                    entity_key = (None, None)
-                
-                if entity_key not in current_tasks_by_entity.keys():
-                    current_tasks_by_entity[entity_key] = [current_task]
-                else:
-                    current_tasks_by_entity[entity_key].append(current_task)
-        if self.async_cache.get('current_tasks'):
-            self.async_cache['current_tasks']['by_entity'] = current_tasks_by_entity
-
-        current_versions_by_entity = {}
-        current_versions = self.connector.cache_retrive_result('current_versions')
-        if current_versions:
-            for current_version in current_versions:
-                entity = current_version.get('entity')
-                if entity:
-                    entity_key = (entity.get('type'), entity.get('id'))
-                else:
-                    entity_key = (None, None)
-                if entity_key not in current_versions_by_entity.keys():
-                    current_versions_by_entity[entity_key] = [current_version]
-                else:
-                    current_versions_by_entity[entity_key].append(current_version)
-        if self.async_cache.get('current_versions'):
-            self.async_cache['current_versions']['by_entity'] = current_versions_by_entity
-
-        current_pbfiles_by_entity = {}
-        current_pbfiles  = self.connector.cache_retrive_result('current_pbfiles')
-        if current_pbfiles:
-            for current_pbfile in current_pbfiles:
-                entity = current_pbfile.get('task.Task.entity')
-                if entity:
-                    entity_key = (entity.get('type'), entity.get('id'))
-                else:
-                    entity_key = (None, None)
-                if entity_key not in current_pbfiles_by_entity.keys():
-                    current_pbfiles_by_entity[entity_key] = [current_pbfile]
-                else:
-                    current_pbfiles_by_entity[entity_key].append(current_pbfile)
-        if self.async_cache.get('current_pbfiles'):
-            self.async_cache['current_pbfiles']['by_entity'] = current_pbfiles_by_entity
+            for service_uid in response.get('missing', []):
+                for uid in local_uids.get(service_uid, []):
+                    cache_request = self.async_cache.get(uid)
+                    if cache_request:
+                        cache_request['service_uid'] = None
+        return True
 
     # end of async cache methods
 
@@ -1350,6 +5192,7 @@ class flameShotgunConnector(object):
                 self.log(pformat(e))
 
         self.prefs_global['user signed out'] = False
+        self.sg_pool.reset()
         self.update_human_user()
         self.sg = self.sg_user.create_sg_connection()
         return self.sg_user
@@ -1362,6 +5205,8 @@ class flameShotgunConnector(object):
         self.sg_user = None
         self.sg_human_user = None
         self.sg_user_name = None
+        self.sg_pool.reset()
+        self.cache_service_detach()
 
     def check_sg_linked_project(self, *args, **kwargs):
         try:
@@ -1453,7 +5298,7 @@ class flameShotgunConnector(object):
         if not self.sg_linked_project_id:
             return False
         try:
-            return self.sg.update('Project', self.sg_linked_project_id, {'tank_name': tank_name})
+            return self.sg_update('Project', self.sg_linked_project_id, {'tank_name': tank_name})
         except:
             return False
 
@@ -1918,7 +5763,7 @@ class flameMenuProjectconnect(flameMenuApp):
                     'entity': 'Project',
                     'filters': [['archived', 'is', False], ['is_template', 'is', False]],
                     'fields': ['name', 'tank_name']
-                    }, perform_query = True)
+                    }, perform_query = True, budget = 300)
 
         if self.connector.sg_linked_project and (not self.connector.sg_linked_project_id):
             self.log_debug("project '%s' can not be found" % self.connector.sg_linked_project)
@@ -2048,7 +5893,6 @@ class flameMenuProjectconnect(flameMenuApp):
         self.connector.bootstrap_toolkit()
         
     def refresh(self, *args, **kwargs):        
-        self.connector.cache_retrive_result(self.active_projects_uid, True)
         self.rescan()
 
     def sign_in(self, *args, **kwargs):
@@ -2062,7 +5906,7 @@ class flameMenuProjectconnect(flameMenuApp):
 
     def sign_out(self, *args, **kwargs):
         self.connector.destroy_toolkit_engine()
-        self.connector.unregister_common_queries()
+        self.connector.unregister_common_queries(retain = False)
         self.connector.prefs_global['user signed out'] = True
         self.connector.clear_user()
         self.framework.save_prefs()
@@ -2191,11 +6035,13 @@ class flameMenuProjectconnect(flameMenuApp):
             btn_General.setStyleSheet('QPushButton {font:italic; background-color: #4f4f4f; color: #d9d9d9; border-top: 1px inset black; border-bottom: 1px inset #555555}')
             btn_Publish.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
             btn_Superclips.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
+            btn_Cache.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
             
             paneGeneral.setVisible(False)
             panePublish.setVisible(False)
             paneTemplatesSelector.setVisible(False)
             paneSuperclips.setVisible(False)
+            paneCache.setVisible(False)
 
             paneGeneral.setVisible(True)
 
@@ -2203,11 +6049,13 @@ class flameMenuProjectconnect(flameMenuApp):
             btn_General.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
             btn_Publish.setStyleSheet('QPushButton {font:italic; background-color: #4f4f4f; color: #d9d9d9; border-top: 1px inset black; border-bottom: 1px inset #555555}')
             btn_Superclips.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
+            btn_Cache.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
 
             paneGeneral.setVisible(False)
             panePublish.setVisible(False)
             paneTemplatesSelector.setVisible(False)
             paneSuperclips.setVisible(False)
+            paneCache.setVisible(False)
 
             paneTemplatesSelector.setVisible(True)
             panePublish.setVisible(True)
@@ -2216,14 +6064,31 @@ class flameMenuProjectconnect(flameMenuApp):
             btn_General.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
             btn_Publish.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
             btn_Superclips.setStyleSheet('QPushButton {font:italic; background-color: #4f4f4f; color: #d9d9d9; border-top: 1px inset black; border-bottom: 1px inset #555555}')
+            btn_Cache.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
 
             paneGeneral.setVisible(False)
             panePublish.setVisible(False)
             paneTemplatesSelector.setVisible(False)
             paneSuperclips.setVisible(False)
+            paneCache.setVisible(False)
 
             paneSuperclips.setVisible(True)
 
+        def pressCache():
+            btn_General.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
+            btn_Publish.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
+            btn_Superclips.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
+            btn_Cache.setStyleSheet('QPushButton {font:italic; background-color: #4f4f4f; color: #d9d9d9; border-top: 1px inset black; border-bottom: 1px inset #555555}')
+
+            paneGeneral.setVisible(False)
+            panePublish.setVisible(False)
+            paneTemplatesSelector.setVisible(False)
+            paneSuperclips.setVisible(False)
+            paneCache.setVisible(False)
+
+            update_cacheMetrics()
+            paneCache.setVisible(True)
+
         window = None
         window = QtWidgets.QDialog()
         window.setFixedSize(1028, 328)
@@ -2241,6 +6106,7 @@ class flameMenuProjectconnect(flameMenuApp):
         paneGeneral = QtWidgets.QWidget(window)
         panePublish = QtWidgets.QWidget(window)
         paneSuperclips = QtWidgets.QWidget(window)
+        paneCache = QtWidgets.QWidget(window)
 
         # Main window HBox
 
@@ -2302,6 +6168,18 @@ class flameMenuProjectconnect(flameMenuApp):
         hbox_Superclips.addWidget(btn_Superclips)
         vbox_apps.addLayout(hbox_Superclips, alignment = QtCore.Qt.AlignLeft)
 
+        # Modules: Cache metrics button
+
+        hbox_Cache = QtWidgets.QHBoxLayout()
+        hbox_Cache.setAlignment(QtCore.Qt.AlignLeft)
+        btn_Cache = QtWidgets.QPushButton('Cache', window)
+        btn_Cache.setFocusPolicy(QtCore.Qt.NoFocus)
+        btn_Cache.setMinimumSize(128, 28)
+        btn_Cache.setStyleSheet('QPushButton {color: #989898; background-color: #373737; border-top: 1px inset #555555; border-bottom: 1px inset black}')
+        btn_Cache.pressed.connect(pressCache)
+        hbox_Cache.addWidget(btn_Cache)
+        vbox_apps.addLayout(hbox_Cache, alignment = QtCore.Qt.AlignLeft)
+
         # Modules: End of Modules section
         hbox_main.addLayout(vbox_apps)
 
@@ -3304,6 +7182,80 @@ class flameMenuProjectconnect(flameMenuApp):
         lbl_paneSuperclips.setAlignment(QtCore.Qt.AlignCenter)
         lbl_paneSuperclips.setFrameStyle(QtWidgets.QFrame.Box | QtWidgets.QFrame.Plain)
 
+        # Cache
+
+        paneCache.setFixedSize(840, 264)
+        paneCache.move(172, 20)
+        paneCache.setVisible(False)
+
+        lbl_cacheMetrics = QtWidgets.QLabel('Async Cache', paneCache)
+        lbl_cacheMetrics.setStyleSheet('QFrame {color: #989898; background-color: #373737}')
+        lbl_cacheMetrics.setMinimumSize(840, 28)
+        lbl_cacheMetrics.setAlignment(QtCore.Qt.AlignCenter)
+
+        txt_cacheMetrics = QtWidgets.QPlainTextEdit(paneCache)
+        txt_cacheMetrics.setReadOnly(True)
+        txt_cacheMetrics.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        txt_cacheMetrics.setFont(QtGui.QFont('Courier', 10))
+        txt_cacheMetrics.setFixedSize(840, 196)
+        txt_cacheMetrics.move(0, 34)
+        txt_cacheMetrics.setStyleSheet('QPlainTextEdit {color: #9a9a9a; background-color: #2a2a2a; border: 1px solid #555555}')
+
+        def update_cacheMetrics():
+            txt_cacheMetrics.setPlainText(self.connector.cache_metrics_text())
+
+        def dump_cacheMetrics():
+            path = self.connector.cache_metrics_dump()
+            if path:
+                lbl_cacheMetricsPath.setText(path)
+
+        # scope report pages through every default row of scoped
+        # queries, it is built in background and the pane polls for it
+
+        scope_timer = QtCore.QTimer(paneCache)
+
+        def poll_cacheScope():
+            status = self.connector.cache_scope_status
+            if not status.get('running'):
+                scope_timer.stop()
+                txt_cacheMetrics.setPlainText(status.get('text') or '')
+
+        scope_timer.timeout.connect(poll_cacheScope)
+
+        def update_cacheScope():
+            self.connector.cache_scope_report_start()
+            txt_cacheMetrics.setPlainText('building scope report...')
+            scope_timer.start(250)
+
+        btn_cacheMetricsRefresh = QtWidgets.QPushButton('Refresh', paneCache)
+        btn_cacheMetricsRefresh.setFocusPolicy(QtCore.Qt.NoFocus)
+        btn_cacheMetricsRefresh.setFixedSize(88, 28)
+        btn_cacheMetricsRefresh.move(0, 236)
+        btn_cacheMetricsRefresh.setStyleSheet('QPushButton {color: #9a9a9a; background-color: #424142; border-top: 1px inset #555555; border-bottom: 1px inset black}'
+                                    'QPushButton:pressed {font:italic; color: #d9d9d9}')
+        btn_cacheMetricsRefresh.clicked.connect(update_cacheMetrics)
+
+        btn_cacheMetricsDump = QtWidgets.QPushButton('Save JSON', paneCache)
+        btn_cacheMetricsDump.setFocusPolicy(QtCore.Qt.NoFocus)
+        btn_cacheMetricsDump.setFixedSize(88, 28)
+        btn_cacheMetricsDump.move(94, 236)
+        btn_cacheMetricsDump.setStyleSheet('QPushButton {color: #9a9a9a; background-color: #424142; border-top: 1px inset #555555; border-bottom: 1px inset black}'
+                                    'QPushButton:pressed {font:italic; color: #d9d9d9}')
+        btn_cacheMetricsDump.clicked.connect(dump_cacheMetrics)
+
+        btn_cacheScope = QtWidgets.QPushButton('Scope Report', paneCache)
+        btn_cacheScope.setFocusPolicy(QtCore.Qt.NoFocus)
+        btn_cacheScope.setFixedSize(88, 28)
+        btn_cacheScope.move(188, 236)
+        btn_cacheScope.setStyleSheet('QPushButton {color: #9a9a9a; background-color: #424142; border-top: 1px inset #555555; border-bottom: 1px inset black}'
+                                    'QPushButton:pressed {font:italic; color: #d9d9d9}')
+        btn_cacheScope.clicked.connect(update_cacheScope)
+
+        lbl_cacheMetricsPath = QtWidgets.QLabel('', paneCache)
+        lbl_cacheMetricsPath.setStyleSheet('QFrame {color: #989898}')
+        lbl_cacheMetricsPath.setFixedSize(552, 28)
+        lbl_cacheMetricsPath.move(288, 236)
+
         # Close button
 
         def close_prefs_dialog():
@@ -3334,11 +7286,11 @@ class flameMenuProjectconnect(flameMenuApp):
             except:
                 self.flame = None
 
-        self.connector.cache_retrive_result(self.active_projects_uid, True)
+        # hooks are rescanned once refreshed projects are in cache,
+        # right away if there is nothing to refresh
 
-        if self.flame:
-            self.flame.execute_shortcut('Rescan Python Hooks')
-            self.log_debug('Rescan Python Hooks')
+        if not self.connector.cache_request_refresh(self.active_projects_uid):
+            self.connector.cache_schedule_rescan()
 
 
 class flameBatchBlessing(flameMenuApp):
@@ -3791,35 +7743,20 @@ class flameMenuNewBatch(flameMenuApp):
         return menu
 
     def get_entities(self, user_only = True, filter_out=[]):
-        cached_tasks = self.connector.cache_retrive_result('current_tasks')
-
-        if not isinstance(cached_tasks, list):
+        if not 'current_tasks' in self.connector.async_cache.keys():
             
             # try to unregister cache and register again
 
             self.unregister_query()
             self.register_query()
 
-            cached_tasks = self.connector.cache_retrive_result('current_tasks')
-
-            if not isinstance(cached_tasks, list):
+            if not 'current_tasks' in self.connector.async_cache.keys():
 
                 # give up
 
                 return {}
 
-        if not cached_tasks:
-            return {}
-
-        tasks = []
-        if user_only:
-            for task in cached_tasks:
-                task_assignees = task.get('task_assignees')
-                for task_assignee in task_assignees:
-                    if task_assignee.get('id') == self.connector.sg_human_user.get('id'):
-                        tasks.append(task)
-        else:
-            tasks = list(cached_tasks)
+        tasks = self.connector.cache_entity_tasks(user_only)
 
         entities = {}
         for task in tasks:
@@ -3830,7 +7767,7 @@ class flameMenuNewBatch(flameMenuApp):
                 task_entity_id = task['entity']['id']
                 if task_entity_type not in entities.keys():
                     entities[task_entity_type] = {}
-                entities[task_entity_type][task_entity_id] = task['entity']
+                entities[task_entity_type][task_entity_id] = dict(task['entity'])
 
         for entity_type in entities.keys():
             entities[entity_type] = entities[entity_type].values()
@@ -4068,10 +8005,8 @@ class flameMenuNewBatch(flameMenuApp):
                 'code': self.asset_name,
                 'task_template': self.asset_task_template}
                 self.log_debug('creating new asset...')
-                new_asset = self.connector.sg.create('Asset', data)
+                new_asset = self.connector.sg_create('Asset', data)
                 self.log_debug('new asset:\n%s' % pformat(new_asset))
-                self.log_debug('updating async cache for cuttent_tasks')
-                self.connector.cache_retrive_result('current_tasks', True)
                 self.log_debug('creating new batch')
                 self.create_new_batch(new_asset)
 
@@ -4154,7 +8089,7 @@ class flameMenuNewBatch(flameMenuApp):
                 else:
                     data = {'project': {'type': 'Project','id': self.connector.sg_linked_project_id},
                     'code': self.sequence_name}
-                    return self.connector.sg.create('Sequence', data)
+                    return self.connector.sg_create('Sequence', data)
             else:
                 return {}
 
@@ -4380,7 +8315,7 @@ class flameMenuNewBatch(flameMenuApp):
                     if not shot_sequence:
                         sequence_data = {'project': {'type': 'Project','id': self.connector.sg_linked_project_id},
                         'code': 'DefaultSequence'}
-                        shot_sequence = self.connector.sg.create('Sequence', sequence_data)
+                        shot_sequence = self.connector.sg_create('Sequence', sequence_data)
                 else:
                     shot_sequence = self.connector.sg.find_one('Sequence', [['id', 'is', self.sequence_id]])
 
@@ -4389,10 +8324,8 @@ class flameMenuNewBatch(flameMenuApp):
                 'sg_sequence': shot_sequence,
                 'task_template': self.shot_task_template}
                 self.log_debug('creating new shot...')
-                new_shot = self.connector.sg.create('Shot', data)
+                new_shot = self.connector.sg_create('Shot', data)
                 self.log_debug('new shot:\n%s' % pformat(new_shot))
-                self.log_debug('updating async cache for current tasks')
-                self.connector.cache_retrive_result('current_tasks', True)
                 self.log_debug('creating new batch')
                 self.create_new_batch(new_shot)
 
@@ -4494,11 +8427,11 @@ class flameMenuNewBatch(flameMenuApp):
             except:
                 self.flame = None
 
-        self.connector.cache_retrive_result('current_tasks', True)
+        # hooks are rescanned once refreshed tasks are in cache,
+        # right away if there is nothing to refresh
 
-        if self.flame:
-            self.flame.execute_shortcut('Rescan Python Hooks')
-            self.log_debug('Rescan Python Hooks')
+        if not self.connector.cache_request_refresh('current_tasks'):
+            self.connector.cache_schedule_rescan()
 
 
 class flameMenuBatchLoader(flameMenuApp):
@@ -4542,17 +8475,14 @@ class flameMenuBatchLoader(flameMenuApp):
             return None
         
         batch_name = self.flame.batch.name.get_value()
-        tasks = []
-        cached_tasks = self.connector.cache_retrive_result('current_tasks')
-
-        if not isinstance(cached_tasks, list):
+        if not 'current_tasks' in self.connector.async_cache.keys():
             return []
 
-        for cached_task in cached_tasks:
-            if not cached_task.get('entity'):
-                continue
-            tasks.append(cached_task)
-        entities_id_list = [task.get('entity').get('id') for task in tasks]
+        # ids of entities with tasks are taken from index keys
+        # so menu build does not walk every task
+
+        tasks_by_entity = self.connector.cache_index('current_tasks', 'by_entity')
+        entities_id_list = set(entity_id for entity_type, entity_id in tasks_by_entity.keys() if entity_type)
 
         add_menu_list = []
 
@@ -4566,13 +8496,7 @@ class flameMenuBatchLoader(flameMenuApp):
                     add_menu_list.pop(index)
 
             if not add_menu_list:
-                entity = {}
-                for task in tasks:
-                    current_entity = task.get('entity')
-                    if current_entity:
-                        if current_entity.get('name') == batch_name:
-                            entity = current_entity
-                            break
+                entity = self.connector.cache_find_entity(batch_name)
                 if entity:
                     self.update_loader_list(entity)
                 add_menu_list = self.prefs.get('additional menu ' + batch_name)
@@ -4581,17 +8505,15 @@ class flameMenuBatchLoader(flameMenuApp):
             self.prefs['additional menu ' + batch_name] = []
             project_id = self.connector.sg_linked_project_id
 
-            entity = {}
-            for task in tasks:
-                current_entity = task.get('entity')
-                if current_entity:
-                    if current_entity.get('name') == batch_name:
-                        entity = current_entity
-                        break
+            entity = self.connector.cache_find_entity(batch_name)
             if entity:
                 self.update_loader_list(entity)
             add_menu_list = self.prefs.get('additional menu ' + batch_name)
 
+        # entities of the menu are refreshed more often than the rest of the project
+
+        self.connector.cache_focus_entities(add_menu_list)
+
         menus = []
         menus.append(self.build_addremove_menu())
 
@@ -4715,17 +8637,19 @@ class flameMenuBatchLoader(flameMenuApp):
         if 'showLatest' not in self.prefs[entity_key].keys():
             self.prefs[entity_key]['showLatest'] = True
 
+        self.connector.cache_touch('current_tasks', 'current_versions', 'current_pbfiles')
+
         cached_tasks_query = self.connector.async_cache.get('current_tasks')
-        cached_tasks_by_entity = cached_tasks_query.get('by_entity') if cached_tasks_query else False
+        cached_tasks_by_entity = getattr(cached_tasks_query.get('result'), 'indexes', {}).get('by_entity') if cached_tasks_query else False
         tasks = cached_tasks_by_entity.get(entity_key, []) if cached_tasks_by_entity else []
         tasks_by_id = cached_tasks_query.get('result') if cached_tasks_query else {}
 
         cached_versions_query = self.connector.async_cache.get('current_versions')
-        cached_versions_by_entity = cached_versions_query.get('by_entity') if cached_versions_query else False
+        cached_versions_by_entity = getattr(cached_versions_query.get('result'), 'indexes', {}).get('by_entity') if cached_versions_query else False
         versions = cached_versions_by_entity.get(entity_key, []) if cached_versions_by_entity else []
 
         cached_pbfiles_query = self.connector.async_cache.get('current_pbfiles')
-        cached_pbfiles_by_entity = cached_pbfiles_query.get('by_entity') if cached_pbfiles_query else False
+        cached_pbfiles_by_entity = getattr(cached_pbfiles_query.get('result'), 'indexes', {}).get('by_entity') if cached_pbfiles_query else False
         publishes = cached_pbfiles_by_entity.get(entity_key, []) if cached_pbfiles_by_entity else []
         cached_pbfiles_by_id = cached_pbfiles_query.get('result') if cached_pbfiles_query else {}
 
@@ -5115,7 +9039,8 @@ class flameMenuBatchLoader(flameMenuApp):
                 if existing_entity.get('id') == entity_id:
                     add_list.pop(index)
         else:
-            add_list.append(entity)
+            add_list.append(dict(entity))
+            self.connector.cache_focus_entity(entity)
         self.prefs['additional menu ' + batch_name] = add_list
 
     def load_into_batch(self, entity):
@@ -5160,29 +9085,10 @@ class flameMenuBatchLoader(flameMenuApp):
 
         # get current tasks form async cache
 
-        cached_tasks = self.connector.cache_retrive_result('current_tasks')
-
-        if not isinstance(cached_tasks, list):
+        if not 'current_tasks' in self.connector.async_cache.keys():
             return {}
 
-        # remove tasks without entities and filter if user_only
-
-        user_id = 0
-        if self.connector.sg_human_user:
-            user_id = self.connector.sg_human_user.get('id', 0)
-        tasks = []
-        for cached_task in cached_tasks:
-            if not cached_task.get('entity'):
-                continue
-            if user_only:
-                if not cached_task.get('task_assignees'):
-                    continue
-                else:
-                    task_assignees_ids = [assignee.get('id') for assignee in cached_task.get('task_assignees', [])]
-                    if user_id not in task_assignees_ids:
-                        continue
-
-            tasks.append(cached_task)            
+        tasks = self.connector.cache_entity_tasks(user_only)
 
         # group entities by id
 
@@ -5339,6 +9245,7 @@ class flameMenuPublisher(flameMenuApp):
         flameMenuApp.__init__(self, framework)
         self.connector = connector
 
+
         # app defaults
         if not self.prefs.master.get(self.name):
             self.prefs['show_all'] = True
@@ -5409,17 +9316,14 @@ class flameMenuPublisher(flameMenuApp):
             return None
 
         batch_name = self.flame.batch.name.get_value()
-        tasks = []
-        cached_tasks = self.connector.cache_retrive_result('current_tasks')
-
-        if not isinstance(cached_tasks, list):
+        if not 'current_tasks' in self.connector.async_cache.keys():
             return []
 
-        for cached_task in cached_tasks:
-            if not cached_task.get('entity'):
-                continue
-            tasks.append(cached_task)
-        entities_id_list = [task.get('entity').get('id') for task in tasks]
+        # ids of entities with tasks are taken from index keys
+        # so menu build does not walk every task
+
+        tasks_by_entity = self.connector.cache_index('current_tasks', 'by_entity')
+        entities_id_list = set(entity_id for entity_type, entity_id in tasks_by_entity.keys() if entity_type)
         
         add_menu_list = []
 
@@ -5433,13 +9337,7 @@ class flameMenuPublisher(flameMenuApp):
                     add_menu_list.pop(index)
             
             if not add_menu_list:                                
-                entity = {}
-                for task in tasks:
-                    current_entity = task.get('entity')
-                    if current_entity:
-                        if current_entity.get('name') == batch_name:
-                            entity = current_entity
-                            break
+                entity = self.connector.cache_find_entity(batch_name)
                 if entity:
                     self.update_loader_list(entity)
                 add_menu_list = self.prefs.get('additional menu ' + batch_name)
@@ -5447,17 +9345,15 @@ class flameMenuPublisher(flameMenuApp):
         else:
             self.prefs['additional menu ' + batch_name] = []
 
-            entity = {}
-            for task in tasks:
-                current_entity = task.get('entity')
-                if current_entity:
-                    if current_entity.get('name') == batch_name:
-                        entity = current_entity
-                        break
+            entity = self.connector.cache_find_entity(batch_name)
             if entity:
                 self.update_loader_list(entity)
             add_menu_list = self.prefs.get('additional menu ' + batch_name)
 
+        # entities of the menu are refreshed more often than the rest of the project
+
+        self.connector.cache_focus_entities(add_menu_list)
+
         menus = []
 
         add_remove_menu = self.build_addremove_menu()
@@ -5597,17 +9493,21 @@ class flameMenuPublisher(flameMenuApp):
             self.prefs[entity_key] = {}
             self.prefs[entity_key]['show_all'] = True
 
+        self.connector.cache_touch('current_tasks', 'current_versions', 'current_pbfiles')
+
         cached_tasks_query = self.connector.async_cache.get('current_tasks')
-        cached_tasks_by_entity = cached_tasks_query.get('by_entity') if cached_tasks_query else False
+        cached_tasks_by_entity = getattr(cached_tasks_query.get('result'), 'indexes', {}).get('by_entity') if cached_tasks_query else False
         tasks = cached_tasks_by_entity.get(entity_key, []) if cached_tasks_by_entity else []
 
         cached_versions_query = self.connector.async_cache.get('current_versions')
-        cached_versions_by_entity = cached_versions_query.get('by_entity') if cached_versions_query else False
+        cached_versions_by_entity = getattr(cached_versions_query.get('result'), 'indexes', {}).get('by_entity') if cached_versions_query else False
         versions = cached_versions_by_entity.get(entity_key, []) if cached_versions_by_entity else []
 
         cached_pbfiles_query = self.connector.async_cache.get('current_pbfiles')
-        cached_pbfiles_by_entity = cached_pbfiles_query.get('by_entity') if cached_pbfiles_query else False
+        cached_pbfiles_by_entity = getattr(cached_pbfiles_query.get('result'), 'indexes', {}).get('by_entity') if cached_pbfiles_query else False
         pbfiles = cached_pbfiles_by_entity.get(entity_key, []) if cached_pbfiles_by_entity else []
+        latest_pbfiles_by_task = self.connector.cache_columns('current_pbfiles').latest(
+            ('task.Task.id', 'published_file_type', 'name'), 'created_at', by_field = 'task.Task.id')
 
         if not self.connector.sg_human_user:
             human_user = {'id': 0}
@@ -5759,36 +9659,14 @@ class flameMenuPublisher(flameMenuApp):
                         version_names.append('* ' + version.get('code'))
                 else:
                     
-                    # group Published Files by Published File Type id and name pair
-                    # find the latest Published File for that pair
                     # get the set of ids for versions linked to Published Files
+                    # latest Published File for every Published File Type and name pair
+                    # comes from columnar view of cached Published Files by task id
 
                     pbfiles_version_ids = set()
-                    pbfile_type_id_name_group = {}
-                    pbfile_type_id_name_datetime = {}
-                    pbfile_type_id_name_count = {}
-
                     for pbfile in task_pbfiles:
-                        
                         pbfile_version_id = pbfile.get('version.Version.id')
                         if pbfile_version_id: pbfiles_version_ids.add(pbfile_version_id)
-                        
-                        pbfile_id = 0
-                        pbfile_type = pbfile.get('published_file_type')
-                        if isinstance(pbfile_type, dict):
-                            pbfile_id = pbfile_type.get('id')
-                        pbfile_name = pbfile.get('name')
-                        pbfile_created_at = pbfile.get('created_at')
-                        pbfile_type_id_name_key = (pbfile_id, pbfile_name)
-                        if pbfile_type_id_name_key not in pbfile_type_id_name_group.keys():
-                            pbfile_type_id_name_group[pbfile_type_id_name_key] = pbfile
-                            pbfile_type_id_name_datetime[pbfile_type_id_name_key] = pbfile_created_at
-                            pbfile_type_id_name_count[pbfile_type_id_name_key] = 1
-                        else:
-                            if pbfile_created_at > pbfile_type_id_name_datetime.get(pbfile_type_id_name_key):
-                                pbfile_type_id_name_group[pbfile_type_id_name_key] = pbfile
-                                pbfile_type_id_name_datetime[pbfile_type_id_name_key] = pbfile_created_at
-                                pbfile_type_id_name_count[pbfile_type_id_name_key] += 1
 
                     version_names_set = set()
                     
@@ -5809,8 +9687,7 @@ class flameMenuPublisher(flameMenuApp):
                         for loose_version in loose_versions:
                             version_names.append(' '*3 + loose_version.get('code'))
 
-                    for key in pbfile_type_id_name_group.keys():
-                        pbfile = pbfile_type_id_name_group.get(key)
+                    for pbfile in latest_pbfiles_by_task.get(task_id, []):
                         if pbfile.get('version.Version.code'):
                             version_names_set.add(pbfile.get('version.Version.code'))
 
@@ -6144,7 +10021,7 @@ class flameMenuPublisher(flameMenuApp):
         self.log_debug('PublishedFile type: found: %s' % pformat(published_file_type))        
         if not published_file_type:
             self.log_debug('creating PublishedFile type %s' % flame_render_type)
-            published_file_type = self.connector.sg.create("PublishedFileType", {"code": flame_render_type})
+            published_file_type = self.connector.sg_create("PublishedFileType", {"code": flame_render_type})
             self.log_debug('created: %s' % pformat(published_file_type))
 
         # fill the pb_info data for 'flame_render'
@@ -6441,7 +10318,7 @@ class flameMenuPublisher(flameMenuApp):
         )
         version = {}
         try:
-            version = self.connector.sg.create('Version', version_data)
+            version = self.connector.sg_create('Version', version_data)
             self.log_debug('created Version: \n%s' % pformat(version))
         except Exception as e:
             self.progress.hide()
@@ -6519,7 +10396,7 @@ class flameMenuPublisher(flameMenuApp):
         )
         self.progress.set_progress(version_name, 'Registering main publish files...')
         try:
-            published_file = self.connector.sg.create('PublishedFile', published_file_data)
+            published_file = self.connector.sg_create('PublishedFile', published_file_data, refresh_links = ['version'])
         except Exception as e:
             self.progress.hide()
             mbox = QtWidgets.QMessageBox()
@@ -6611,7 +10488,7 @@ class flameMenuPublisher(flameMenuApp):
                         flame_file_name = "%s%s%s" % (match.group(1), frame_spec, ext)
                         flame_path = os.path.join(export_dir, flame_file_name)
 
-                        self.connector.sg.update('Version', version.get('id'), {'sg_first_frame': min_frame, 'sg_last_frame': max_frame})
+                        self.connector.sg_update('Version', version.get('id'), {'sg_first_frame': min_frame, 'sg_last_frame': max_frame})
 
             pb_info['flame_render']['flame_path'] = flame_path
         
@@ -6707,7 +10584,7 @@ class flameMenuPublisher(flameMenuApp):
         if not published_file_type:
             self.log_debug('creating PublishedFile type %s' % flame_render_type)
             try:
-                published_file_type = self.connector.sg.create("PublishedFileType", {"code": flame_batch_type})
+                published_file_type = self.connector.sg_create("PublishedFileType", {"code": flame_batch_type})
             except Exception as e:
                 self.progress.hide()
                 mbox = QtWidgets.QMessageBox()
@@ -6738,7 +10615,7 @@ class flameMenuPublisher(flameMenuApp):
         self.progress.set_progress(version_name, 'Registering batch...')
 
         try:
-            published_file = self.connector.sg.create('PublishedFile', published_file_data)
+            published_file = self.connector.sg_create('PublishedFile', published_file_data, refresh_links = ['version'])
         except Exception as e:
             self.progress.hide()
             mbox = QtWidgets.QMessageBox()
@@ -6908,36 +10785,18 @@ class flameMenuPublisher(flameMenuApp):
                 if existing_entity.get('id') == entity_id:
                     add_list.pop(index)
         else:
-            add_list.append(entity)
+            add_list.append(dict(entity))
+            self.connector.cache_focus_entity(entity)
         self.prefs['additional menu ' + batch_name] = add_list
 
     def get_entities(self, user_only = True, filter_out=[]):
         
         # get current tasks form async cache
 
-        cached_tasks = self.connector.cache_retrive_result('current_tasks')
-
-        if not isinstance(cached_tasks, list):
+        if not 'current_tasks' in self.connector.async_cache.keys():
             return {}
 
-        # remove tasks without entities and filter if user_only
-        
-        user_id = 0
-        if self.connector.sg_human_user:
-            user_id = self.connector.sg_human_user.get('id', 0)
-        tasks = []
-        for cached_task in cached_tasks:
-            if not cached_task.get('entity'):
-                continue
-            if user_only:
-                if not cached_task.get('task_assignees'):
-                    continue
-                else:
-                    task_assignees_ids = [assignee.get('id') for assignee in cached_task.get('task_assignees', [])]
-                    if user_id not in task_assignees_ids:
-                        continue
-
-            tasks.append(cached_task)            
+        tasks = self.connector.cache_entity_tasks(user_only)
 
         # group entities by id
 
@@ -7490,12 +11349,12 @@ class flameMenuPublisher(flameMenuApp):
             except:
                 self.flame = None
 
-        self.connector.cache_retrive_result('current_tasks', True)
-        self.connector.async_cache.get('current_versions', True)
+        # hooks are rescanned once refreshed tasks and versions
+        # are in cache, right away if there is nothing to refresh
 
-        if self.flame:
-            self.flame.execute_shortcut('Rescan Python Hooks')
-            self.log_debug('Rescan Python Hooks')
+        requested = self.connector.cache_request_refresh('current_tasks')
+        if not (self.connector.cache_request_refresh('current_versions') or requested):
+            self.connector.cache_schedule_rescan()
 
 
 # --- FLAME STARTUP SEQUENCE ---
@@ -7765,3 +11624,20 @@ def batch_render_end(info, userData, *args, **kwargs):
         userData['batch_setup_name'] = 'Render aborted by user'
 
     flameBatchBlessingApp.bless_batch_renders(userData)
+
+# --- HOST CACHE SERVICE ---
+# flameMenuSG.py --cache-service <socket path> is started by connector
+# when 'cache_service' preference is on (see flameCacheService)
+
+def cache_service_main(argv):
+    import sgtk
+
+    sys.excepthook = sys.__excepthook__
+    socket_path = argv[argv.index('--cache-service') + 1]
+    sg_user = sgtk.authentication.deserialize_user(os.environ.get('FLAMEMENUSG_SG_USER'))
+    service = flameCacheService(flameAppFramework(), socket_path, sg_user)
+    service.serve_forever()
+    return 0
+
+if __name__ == '__main__' and '--cache-service' in sys.argv:
+    sys.exit(cache_service_main(sys.argv))